@@ -6,6 +6,8 @@ import datetime
 import time
 import math
 import glob
+import re
+import json
 
 
 import multiprocessing
@@ -40,16 +42,139 @@ def normalize_path_to_dir(path_to_dir):
 		return path_to_dir
 
 
-def run_command(cmdstring):
+_command_runner = None # if set, run_command calls it instead of executing commands
+_file_reader = None # if set, read_file calls it instead of reading files
+_fact_getter = None # if set, get_host_fact calls it instead of getting facts
+_probe_runner = None # if set, run_probes calls it instead of probing network
+
+
+def set_command_runner(runner):
+	"""set function(cmdstring, timeout) to be called by run_command instead of executing commands,
+	i.e. stub for benchmarks or capture replay. None - execute commands"""
+	global _command_runner
+	_command_runner = runner
+
+
+def set_file_reader(reader):
+	"""set function(path) to be called by read_file instead of reading files. None - read files"""
+	global _file_reader
+	_file_reader = reader
+
+
+def set_fact_getter(getter):
+	"""set function(name, func) to be called by get_host_fact. None - call func"""
+	global _fact_getter
+	_fact_getter = getter
+
+
+def get_host_fact(name, func):
+	"""return func(), some fact about host which tests depend on (i.e. if command exists).
+	Facts go through hook like commands and files, so they can be recorded and replayed"""
+	if _fact_getter is not None:
+		return _fact_getter(name, func)
+	return func()
+
+
+def set_probe_runner(runner):
+	"""set function(name, func) to be called by run_probes. None - call func"""
+	global _probe_runner
+	_probe_runner = runner
+
+
+def run_probes(name, func):
+	"""return func(), results of network probes named name as JSON-serializable value.
+	Probes go through hook like commands, so they can be recorded and replayed without network access"""
+	if _probe_runner is not None:
+		return _probe_runner(name, func)
+	return func()
+
+
+def find_executable(name):
+	import shutil
+	return get_host_fact(f"which {name}", lambda: shutil.which(name))
+
+
+def execute_command(cmdstring, timeout = None):
+	"""execute command, return (output bytes with stderr, exit code)"""
 	import subprocess
 	import shlex
 	
-	if len(cmdstring) == 0:
-		return -1
 	args = shlex.split(cmdstring)
 	run_proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
-	result = subprocess.Popen.communicate(run_proc)[0].decode("utf-8")
-	return result
+	try:
+		output = run_proc.communicate(timeout = timeout)[0]
+	except subprocess.TimeoutExpired:
+		run_proc.kill()
+		run_proc.communicate()
+		raise
+	return output, run_proc.returncode
+
+
+def run_command(cmdstring, timeout = None):
+	if len(cmdstring) == 0:
+		return -1
+	if _command_runner is not None:
+		return _command_runner(cmdstring, timeout)
+	return execute_command(cmdstring, timeout)[0].decode("utf-8")
+
+
+def read_file(path):
+	"""read text file, raise OSError if it can not be read"""
+	if _file_reader is not None:
+		return _file_reader(path)
+	with open(path, "r") as f:
+		return f.read()
+
+
+def run_parallel(func, items, max_workers = 8):
+	"""run func for each of items in a bounded thread pool, return list of results in order of items.
+	func should handle its own exceptions"""
+	from concurrent.futures import ThreadPoolExecutor
+	
+	items = list(items)
+	if len(items) == 0:
+		return []
+	with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(items)))) as executor:
+		return list(executor.map(func, items))
+
+
+DEFAULT_STATE_DIR = "/var/tmp/simple_reporter"
+
+
+def get_state_dir(config = None):
+	"""return dir for state files (cache, history), as set by state_dir in [main] section"""
+	state_dir = DEFAULT_STATE_DIR
+	if config is not None and config.has_option("main", "state_dir"):
+		state_dir = config.get("main", "state_dir")
+	os.makedirs(state_dir, exist_ok = True)
+	return state_dir
+
+
+def load_json_state(state_file, default = None):
+	try:
+		with open(state_file, "r") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return default
+
+
+def save_json_state(state_file, state):
+	"""save state as json atomically - write temp file, then rename it over old one"""
+	tmp_file = f"{state_file}.tmp.{os.getpid()}.{threading.get_ident()}"
+	with open(tmp_file, "w") as f:
+		json.dump(state, f)
+	os.replace(tmp_file, state_file)
+
+
+def rotate_file(filename, backup_count = 5):
+	"""rotate filename to filename.1, filename.1 to filename.2 and so on, keep at most backup_count old files"""
+	for i in range(backup_count - 1, 0, -1):
+		if os.path.isfile(f"{filename}.{i}"):
+			os.replace(f"{filename}.{i}", f"{filename}.{i + 1}")
+	if backup_count > 0 and os.path.isfile(filename):
+		os.replace(filename, f"{filename}.1")
+	elif os.path.isfile(filename):
+		os.unlink(filename)
 
 
 def detect_OS():
@@ -156,11 +281,260 @@ def parse_uptime(uptime_str):
 	return datetime.timedelta(days = days, hours = hours, minutes = minutes)
 
 
+def parse_smartctl_scan(scan_str):
+	"""parse output of smartctl --scan-open into list of (device, device_type) tuples
+	/dev/sda -d sat # /dev/sda [SAT], ATA device
+	/dev/nvme0 -d nvme # /dev/nvme0, NVMe device
+	# /dev/sdb -d scsi # /dev/sdb, SCSI device open failed: No such device
+	"""
+	result_list = []
+	for line in scan_str.splitlines():
+		line = line.split("#")[0].strip()
+		if not line.startswith("/dev/"):
+			continue
+		words = line.split()
+		device_type = words[words.index("-d") + 1] if "-d" in words[:-1] else None
+		result_list.append((words[0], device_type))
+	return result_list
+
+
+def parse_smartctl_json(json_str):
+	"""parse output of smartctl -j into dict with health, temperature, sectors and wear level.
+	Values which disk does not report are None"""
+	data = json.loads(json_str)
+	ata_attrs = {}
+	for attr in data.get("ata_smart_attributes", {}).get("table", []):
+		ata_attrs[attr.get("id")] = attr
+	result_dict = {"model": data.get("model_name", data.get("scsi_model_name")),
+		"serial": data.get("serial_number"),
+		"exit_status": data.get("smartctl", {}).get("exit_status"),
+		"health": None,
+		"temperature": data.get("temperature", {}).get("current"),
+		"reallocated_sectors": None,
+		"pending_sectors": None,
+		"wear_pct": None}
+	if "passed" in data.get("smart_status", {}):
+		result_dict["health"] = "PASSED" if data["smart_status"]["passed"] else "FAILED"
+	if 5 in ata_attrs:
+		result_dict["reallocated_sectors"] = ata_attrs[5].get("raw", {}).get("value")
+	elif "scsi_grown_defect_list" in data:
+		result_dict["reallocated_sectors"] = data["scsi_grown_defect_list"]
+	if 197 in ata_attrs:
+		result_dict["pending_sectors"] = ata_attrs[197].get("raw", {}).get("value")
+	nvme_log = data.get("nvme_smart_health_information_log", {})
+	if "percentage_used" in nvme_log:
+		result_dict["wear_pct"] = nvme_log["percentage_used"]
+	elif "current_percent" in data.get("endurance_used", {}):
+		result_dict["wear_pct"] = data["endurance_used"]["current_percent"]
+	else:
+		# normalized value of these attributes counts down from 100 as SSD wears out
+		for attr_id in (177, 231, 233):
+			if attr_id in ata_attrs and ata_attrs[attr_id].get("value") is not None:
+				result_dict["wear_pct"] = max(0, 100 - ata_attrs[attr_id]["value"])
+				break
+	return result_dict
+
+
+def parse_systemctl_show(show_str):
+	"""parse output of systemctl show --property=Id,... unit1 unit2 into dict Id -> dict of properties.
+	Units are divided by empty lines"""
+	result_dict = {}
+	for block in re.split(r"\n\s*\n", show_str):
+		props = {}
+		for line in block.splitlines():
+			if "=" in line:
+				key, value = line.split("=", 1)
+				props[key] = value
+		if "Id" in props:
+			result_dict[props["Id"]] = props
+	return result_dict
+
+
+def parse_service_status_batch(status_str):
+	"""parse output of FreeBSD batched service status (see ServiceTest) into dict name -> {"running", "pid"}
+	== sshd
+	sshd is running as pid 812.
+	== rc=0
+	"""
+	result_dict = {}
+	name = None
+	pid = None
+	for line in status_str.splitlines():
+		if line.startswith("== rc="):
+			if name is not None:
+				result_dict[name] = {"running": line == "== rc=0", "pid": pid}
+			name = None
+		elif line.startswith("== "):
+			name = line[3:].strip()
+			pid = None
+		else:
+			m = re.search(r"is running as pid ([0-9]+)", line)
+			if m:
+				pid = m.group(1)
+	return result_dict
+
+
+def parse_ping_output(ping_str):
+	"""parse statistics from ping output (Linux iputils and FreeBSD), return dict or None if no statistics found
+	4 packets transmitted, 4 received, 0% packet loss, time 3004ms
+	rtt min/avg/max/mdev = 0.030/0.040/0.052/0.008 ms
+	4 packets transmitted, 4 packets received, 0.0% packet loss
+	round-trip min/avg/max/stddev = 0.047/0.059/0.073/0.010 ms
+	"""
+	m = re.search(r"([0-9]+) packets transmitted, ([0-9]+) (?:packets )?received.*?([0-9.]+)% packet loss", ping_str)
+	if m is None:
+		return None
+	result_dict = {"transmitted": int(m.group(1)),
+		"received": int(m.group(2)),
+		"loss_pct": float(m.group(3)),
+		"rtt_min": None,
+		"rtt_avg": None,
+		"rtt_max": None,
+		"rtt_mdev": None}
+	m = re.search(r"= ([0-9.]+)/([0-9.]+)/([0-9.]+)/([0-9.]+) ms", ping_str)
+	if m is not None:
+		result_dict["rtt_min"], result_dict["rtt_avg"], result_dict["rtt_max"], result_dict["rtt_mdev"] = [float(v) for v in m.groups()]
+	return result_dict
+
+
+def parse_traceroute_output(traceroute_str):
+	"""parse hops from traceroute -n output, return list of hops, each hop is sorted list of addresses, or ["*"] if no reply
+	traceroute to 8.8.8.8 (8.8.8.8), 30 hops max, 60 byte packets
+	 1  192.168.1.1  0.512 ms
+	 2  * * *
+	 3  10.0.0.1  5.104 ms 10.0.0.2  5.211 ms !H
+	"""
+	hops = []
+	for line in traceroute_str.splitlines():
+		words = line.split()
+		if len(words) < 2 or not words[0].isdigit():
+			continue
+		addresses = []
+		for i, word in enumerate(words[1:], start = 1):
+			if word == "*" or word.startswith("!") or word == "ms":
+				continue
+			if i + 1 < len(words) and words[i + 1] == "ms":
+				continue # this is rtt
+			if word not in addresses:
+				addresses.append(word)
+		hops.append(sorted(addresses) if len(addresses) != 0 else ["*"])
+	return hops
+
+
+def _zfs_int(value):
+	return int(value) if value.isdigit() else None
+
+
+def parse_zpool_list(list_str):
+	"""parse output of zpool list -Hp -o name,size,alloc,free,frag,cap,health into list of dicts"""
+	pools = []
+	for line in list_str.splitlines():
+		words = line.split("\t")
+		if len(words) != 7:
+			continue
+		pools.append({"name": words[0],
+			"size": _zfs_int(words[1]),
+			"alloc": _zfs_int(words[2]),
+			"free": _zfs_int(words[3]),
+			"frag_pct": _zfs_int(words[4].rstrip("%")),
+			"cap_pct": _zfs_int(words[5].rstrip("%")),
+			"health": words[6]})
+	return pools
+
+
+def parse_zfs_list(list_str):
+	"""parse output of zfs list -Hp -o name,used,avail,usedbydataset into list of dicts"""
+	datasets = []
+	for line in list_str.splitlines():
+		words = line.split("\t")
+		if len(words) != 4:
+			continue
+		datasets.append({"name": words[0], "used": _zfs_int(words[1]), "avail": _zfs_int(words[2]), "used_by_dataset": _zfs_int(words[3])})
+	return datasets
+
+
+def parse_zpool_status(status_str):
+	"""parse output of zpool status -p into dict pool name -> {"state", "scan", "last_scrub", "scrub_in_progress", "errors", "vdevs"}
+	vdevs is list of dicts {"name", "state", "read", "write", "cksum"}
+	  pool: tank
+	 state: ONLINE
+	  scan: scrub repaired 0B in 00:01:02 with 0 errors on Sun Oct 13 00:25:03 2024
+	config:
+	
+		NAME        STATE     READ WRITE CKSUM
+		tank        ONLINE       0     0     0
+		  mirror-0  ONLINE       0     0     0
+	
+	errors: No known data errors
+	"""
+	pools = {}
+	pool = None
+	in_config = False
+	for line in status_str.splitlines():
+		stripped = line.strip()
+		if stripped.startswith("pool: "):
+			pool = {"state": None, "scan": "", "last_scrub": None, "scrub_in_progress": False, "errors": "", "vdevs": []}
+			pools[stripped[len("pool: "):]] = pool
+			in_config = False
+			continue
+		if pool is None:
+			continue
+		if stripped.startswith("state: "):
+			pool["state"] = stripped[len("state: "):]
+		elif stripped.startswith("scan: "):
+			pool["scan"] = stripped[len("scan: "):]
+			pool["scrub_in_progress"] = "scrub in progress" in pool["scan"]
+			m = re.search(r"scrub repaired .* on (.+)$", pool["scan"])
+			if m is not None:
+				try:
+					pool["last_scrub"] = datetime.datetime.strptime(" ".join(m.group(1).split()), "%a %b %d %H:%M:%S %Y")
+				except ValueError:
+					pass
+		elif stripped.startswith("errors: "):
+			pool["errors"] = stripped[len("errors: "):]
+			in_config = False
+		elif stripped.startswith("NAME") and "STATE" in stripped:
+			in_config = True
+		elif in_config and stripped != "":
+			words = stripped.split()
+			if len(words) >= 5 and words[2].isdigit() and words[3].isdigit() and words[4].isdigit():
+				pool["vdevs"].append({"name": words[0], "state": words[1], "read": int(words[2]), "write": int(words[3]), "cksum": int(words[4])})
+	return pools
+
+
 def get_uptime():
 	uptime_cmd_result = run_command("uptime")
 	return parse_uptime(uptime_cmd_result)
 
 
+def get_boot_time(os_family = None):
+	"""boot time as datetime, read from btime of /proc/stat, or from kern.boottime sysctl on FreeBSD. None if it could not be read"""
+	try:
+		if os_family == "FreeBSD":
+			# { sec = 1700000000, usec = 123456 } Tue Nov 14 22:13:20 2023
+			match = re.search(r"sec = (\d+)", run_command("sysctl -n kern.boottime"))
+			if match is not None:
+				return datetime.datetime.fromtimestamp(int(match.group(1)))
+		else:
+			for line in read_file("/proc/stat").splitlines():
+				if line.startswith("btime "):
+					return datetime.datetime.fromtimestamp(int(line.split()[1]))
+	except Exception:
+		pass
+	return None
+
+
+def normalize_df_output(df_str):
+	"""df output reduced to mount point and Use% of each filesystem, block counts are dropped"""
+	lines = []
+	for line in df_str.splitlines()[1:]:
+		words = line.split()
+		if len(words) < 6:
+			continue
+		lines.append(f"{' '.join(words[5:])} {words[4]}")
+	return "\n".join(lines)
+
+
 def save_heartbeat(heartbeat_file):
 	with open(heartbeat_file, "w") as f:
 		datetime_now_str = datetime.datetime.now().isoformat()
@@ -170,10 +544,9 @@ def save_heartbeat(heartbeat_file):
 
 
 def read_heartbeat(heartbeat_file):
-	with open(heartbeat_file, "r") as f:
-		content = f.read()
-		heartbeat_datetime = datetime.datetime.fromisoformat(content)
-		return heartbeat_datetime
+	content = read_file(heartbeat_file)
+	heartbeat_datetime = datetime.datetime.fromisoformat(content)
+	return heartbeat_datetime
 
 
 def humanify_seconds(iseconds):
@@ -206,6 +579,251 @@ def humanify_seconds(iseconds):
 
 
 
+def gzip_text(text, chunk_size = 65536):
+	"""gzip text, encoding and compressing it chunk by chunk, so there is no full utf-8 copy of big text in memory"""
+	import gzip
+	import io
+	buf = io.BytesIO()
+	with gzip.GzipFile(fileobj = buf, mode = "wb") as gz:
+		for i in range(0, len(text), chunk_size):
+			gz.write(text[i:i + chunk_size].encode("utf-8"))
+	return buf.getvalue()
+
+
+def truncate_text_to_bytes(text, max_bytes):
+	"""return beginning of text which takes at most max_bytes in utf-8"""
+	return text[:max_bytes].encode("utf-8")[:max_bytes].decode("utf-8", errors = "ignore")
+
+
+def humanify_bytes(ibytes):
+	"""format size in bytes like du -h does: 512, 1.5K, 20M, 3.1G"""
+	size = float(ibytes)
+	for unit in ["", "K", "M", "G", "T"]:
+		if size < 1024 or unit == "T":
+			break
+		size = size / 1024
+	if unit == "":
+		return f"{int(size)}"
+	return f"{size:.1f}{unit}" if size < 10 else f"{int(round(size))}{unit}"
+
+
+class MetricFamilies(object):
+	"""metrics in Prometheus text exposition format. Samples are added one by one as tests are walked,
+	grouped into families by name, and whole text is rendered once"""
+	
+	def __init__(self, prefix = ""):
+		super(MetricFamilies, self).__init__()
+		self.prefix = prefix
+		self.families = {} # name -> {"help", "type", "samples": list of (labels, value)}
+	
+	
+	def add(self, name, value, labels = None, help_text = "", metric_type = "gauge"):
+		"""add sample, None values are skipped"""
+		if value is None:
+			return
+		family = self.families.setdefault(self.prefix + name, {"help": help_text, "type": metric_type, "samples": []})
+		family["samples"].append((labels or {}, value))
+	
+	
+	@staticmethod
+	def _escape(value):
+		return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+	
+	
+	@staticmethod
+	def _escape_help(value):
+		return value.replace("\\", "\\\\").replace("\n", "\\n")
+	
+	
+	@staticmethod
+	def _format_value(value):
+		if isinstance(value, bool):
+			return "1" if value else "0"
+		if isinstance(value, int):
+			return str(value)
+		value = float(value)
+		if math.isnan(value):
+			return "NaN"
+		if math.isinf(value):
+			return "+Inf" if value > 0 else "-Inf"
+		return repr(value)
+	
+	
+	def render(self):
+		lines = []
+		for name, family in self.families.items():
+			lines.append(f"# HELP {name} {self._escape_help(family['help'])}")
+			lines.append(f"# TYPE {name} {family['type']}")
+			for labels, value in family["samples"]:
+				label_str = ",".join([f"{k}=\"{self._escape(v)}\"" for k, v in labels.items()])
+				lines.append(f"{name}{{{label_str}}} {self._format_value(value)}" if label_str != "" else f"{name} {self._format_value(value)}")
+		return "\n".join(lines) + "\n"
+
+
+class TruncatingQueueHandler(logging.handlers.QueueHandler):
+	"""QueueHandler which cuts long messages (command outputs, reports, dumps) before they are queued.
+	Beginning and end of message are kept, so tracebacks at the end are not lost. max_message_chars = 0 - no limit"""
+	
+	def __init__(self, queue, max_message_chars = 8192):
+		super(TruncatingQueueHandler, self).__init__(queue)
+		self.max_message_chars = max_message_chars
+	
+	
+	def prepare(self, record):
+		record = super(TruncatingQueueHandler, self).prepare(record)
+		if self.max_message_chars > 0 and len(record.msg) > self.max_message_chars:
+			half = self.max_message_chars // 2
+			record.msg = f"{record.msg[:half]} [... {len(record.msg) - 2 * half} of {len(record.msg)} chars cut ...] {record.msg[-half:]}"
+		return record
+
+
+class PhaseTimings(object):
+	"""durations of named phases, measured with monotonic clock. Durations of repeated phase are summed"""
+	
+	def __init__(self):
+		super(PhaseTimings, self).__init__()
+		self.durations = {} # phase -> seconds, in order of first measurement
+	
+	
+	def add(self, phase, duration_s):
+		if duration_s is None:
+			return
+		self.durations[phase] = self.durations.get(phase, 0.0) + duration_s
+	
+	
+	def timed(self, phase, func, *args, **kwargs):
+		"""call func, add its run time to phase, return its result"""
+		start = time.monotonic()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			self.add(phase, time.monotonic() - start)
+	
+	
+	@staticmethod
+	def slowest(durations, n = 10):
+		"""n slowest of (name, seconds) pairs"""
+		return sorted(durations, key = lambda item: item[1], reverse = True)[:n]
+
+
+class DirSizeScanner(object):
+	"""native disk usage scanner, walks dirs with os.scandir and counts allocated size like du does.
+	
+	Top-level subtrees are walked in parallel threads, so stat syscalls overlap on slow disks and NFS.
+	Listing of every dir can be cached by its mtime: if dir is unchanged since previous scan, names of its files
+	and subdirs are taken from cache instead of reading dir. Files are stat'ed on every scan, as file growing
+	in place does not change dir mtime.
+	"""
+	
+	def __init__(self, max_depth = 1, one_file_system = True, exclude = None, max_workers = 8, cache = None, cache_max_age_s = 86400, logger = None):
+		super(DirSizeScanner, self).__init__()
+		self._logger = logger
+		self.max_depth = max_depth # dirs up to this depth are reported as entries
+		self.one_file_system = one_file_system
+		self.exclude = exclude if exclude is not None else [] # list of glob patterns, matched against name and full path
+		self.max_workers = max_workers
+		self.cache = cache if cache is not None else {} # path -> {"mtime_ns", "date", "files", "subdirs"}
+		self.cache_max_age_s = cache_max_age_s
+		self.new_cache = {}
+		self.entries = [] # list of (path, depth, size)
+		self.errors = []
+		self.cache_hits = 0
+		self._lock = threading.Lock()
+		self._root_dev = None
+		self._now = None
+	
+	
+	def _is_excluded(self, path):
+		import fnmatch
+		name = os.path.basename(path)
+		for pattern in self.exclude:
+			if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+				return True
+		return False
+	
+	
+	@staticmethod
+	def _get_size(st):
+		return st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+	
+	
+	def _list_dir(self, path, st):
+		"""return (files_size, subdirs) of dir, names of files and subdirs are from cache if dir is unchanged"""
+		cached = self.cache.get(path)
+		if cached is not None and cached.get("mtime_ns") == st.st_mtime_ns and "files" in cached and self._now - cached["date"] < self.cache_max_age_s:
+			with self._lock:
+				self.cache_hits += 1
+			self.new_cache[path] = cached
+			files_size = 0
+			for name in cached["files"]:
+				try:
+					files_size += self._get_size(os.lstat(os.path.join(path, name)))
+				except FileNotFoundError:
+					pass
+				except OSError as e:
+					self.errors.append(f"{os.path.join(path, name)}: {e}")
+			return files_size, cached["subdirs"]
+		files_size = 0
+		files = []
+		subdirs = []
+		with os.scandir(path) as it:
+			for entry in it:
+				try:
+					if self._is_excluded(entry.path):
+						continue
+					if entry.is_dir(follow_symlinks = False):
+						subdirs.append(entry.name)
+					else:
+						files_size += self._get_size(entry.stat(follow_symlinks = False))
+						files.append(entry.name)
+				except OSError as e:
+					self.errors.append(f"{entry.path}: {e}")
+		self.new_cache[path] = {"mtime_ns": st.st_mtime_ns, "date": self._now, "files": files, "subdirs": subdirs}
+		return files_size, subdirs
+	
+	
+	def _scan_dir(self, path, depth = 0):
+		"""return total size of dir, recursively"""
+		try:
+			st = os.lstat(path)
+			if self.one_file_system and st.st_dev != self._root_dev:
+				return 0
+			files_size, subdirs = self._list_dir(path, st)
+		except OSError as e:
+			self.errors.append(f"{path}: {e}")
+			return 0
+		subdir_paths = [os.path.join(path, d) for d in subdirs]
+		if depth == 0:
+			subdirs_sizes = run_parallel(lambda p: self._scan_dir(p, depth + 1), subdir_paths, self.max_workers)
+		else:
+			subdirs_sizes = [self._scan_dir(p, depth + 1) for p in subdir_paths]
+		total = self._get_size(st) + files_size + sum(subdirs_sizes)
+		if depth <= self.max_depth:
+			self.entries.append((path, depth, total))
+		return total
+	
+	
+	def scan(self, path):
+		"""scan path, return its total size. Entries up to max_depth are left in self.entries"""
+		self.entries = []
+		self.errors = []
+		self.new_cache = {}
+		self.cache_hits = 0
+		self._now = time.time()
+		path = os.path.abspath(path)
+		self._root_dev = os.lstat(path).st_dev
+		total = self._scan_dir(path)
+		if self._logger: self._logger.debug(f"scan: {path} scanned, total {total}, {len(self.new_cache)} dirs, {self.cache_hits} from cache, {len(self.errors)} errors")
+		return total
+	
+	
+	def get_top_entries(self, top_n = 10):
+		"""return top_n largest entries below root, as list of (path, size)"""
+		entries = [(p, size) for p, depth, size in self.entries if depth > 0]
+		return sorted(entries, key = lambda e: e[1], reverse = True)[:top_n]
+
+
+
 class send_mail3(object):
 	"""new send_mail for python3, rewrited to support gmail and SMTP authentication
 	supported features:
@@ -226,14 +844,18 @@ class send_mail3(object):
 		self.SMTP_PORT = 25 # 
 		self.USE_AUTH = False # True if auth required
 		self.USE_TLS = False # 
+		self.SMTP_TIMEOUT = 30 # seconds
+		self._smtp = None # SMTP session, reused by send() until close_session()
 		
 		self.recipient_list = to # list of recimients, i.e ["mail1@example.com",]
 		self.subject = subject # email subject
 		self.message_text = message # body text, can contain "\n"
 		self.message_html = "" # message body in HTML # TODO: currently unused
-		self.message = None # message object
+		self.message = None # message object, only while it is composed
+		self.message_bytes = None # composed message serialized once, used for sending and spooling
 		
 		self.attachment_files = [] # list of paths of attachments
+		self.attachment_texts = [] # list of (filename, text) tuples, attached gzip-compressed as filename.gz
 		
 		self.DEBUG = False # True if use debug
 		self.VERBOSE = False # True if should be verbose
@@ -273,32 +895,72 @@ class send_mail3(object):
 			except Exception as e:
 				print("Unable to open one of the attachments. Error: " + str(sys.exc_info()[0]) + ", " + str(e) + ", traceback: " + traceback.format_exc())
 				pass
+		for filename, text in self.attachment_texts:
+			attachment_msg = MIMEBase("application", "gzip")
+			attachment_msg.set_payload(gzip_text(text))
+			encoders.encode_base64(attachment_msg)
+			attachment_msg.add_header("Content-Disposition", "attachment", filename = filename + ".gz")
+			self.message.attach(attachment_msg)
+		# serialized once, MIME tree is dropped so only one copy of report is kept
+		self.message_bytes = self.message.as_bytes()
+		self.message = None
 		self._composed = True
 		
 	
+	def open_session(self):
+		"""connect to SMTP server, do STARTTLS and login. Session is reused by send() until close_session()"""
+		self.close_session()
+		smtp_obj = smtplib.SMTP(self.SMTP_SERVER, self.SMTP_PORT, timeout = self.SMTP_TIMEOUT)
+		try:
+			if self.DEBUG:
+				smtp_obj.set_debuglevel(True)
+			if self.USE_TLS:
+				smtp_obj.starttls()
+			smtp_obj.ehlo()
+			if self.USE_AUTH:
+				smtp_obj.login(self.smtp_username, self.smtp_passwd)
+		except Exception:
+			smtp_obj.close()
+			raise
+		self._smtp = smtp_obj
+		if self._logger: self._logger.debug(f"open_session: connected to {self.SMTP_SERVER}:{self.SMTP_PORT}")
+	
+	
+	def close_session(self):
+		if self._smtp is None:
+			return
+		try:
+			self._smtp.quit()
+		except Exception:
+			self._smtp.close()
+		self._smtp = None
+	
+	
+	def send_raw(self, sender, recipient_list, message):
+		"""send already composed message over current session, open session if needed.
+		Reconnects once if server has dropped idle session. Raises on error"""
+		if self._smtp is None:
+			self.open_session()
+		try:
+			self._smtp.sendmail(sender, recipient_list, message)
+		except smtplib.SMTPServerDisconnected:
+			self.open_session()
+			self._smtp.sendmail(sender, recipient_list, message)
+	
+	
 	def send(self):
-		"""send message"""
+		"""send message, return True if sent OK"""
 		if not self._composed:
 			self.compose()
 		try:
-			with smtplib.SMTP(self.SMTP_SERVER, self.SMTP_PORT) as smtp_obj:
-				# smtp_obj.connect()
-				if self.DEBUG:
-					smtp_obj.set_debuglevel(True)
-				# smtp_obj.ehlo()
-				
-				if self.USE_TLS:
-					smtp_obj.starttls()
-				smtp_obj.ehlo()
-				if self.USE_AUTH:
-					smtp_obj.login(self.smtp_username, self.smtp_passwd)
-				smtp_obj.sendmail(self.sender, self.recipient_list, self.message.as_string())
-				smtp_obj.close()
+			self.send_raw(self.sender, self.recipient_list, self.message_bytes)
 			if self._logger: self._logger.info("send: message send successfuly")
+			return True
 		except Exception as e:
 			print("Unable to send the email. Error: " + str(sys.exc_info()[0]) + ", " + str(e) + ", traceback: " + traceback.format_exc())
 			if self._logger: self._logger.error("send: Unable to send the email. Error: " + str(sys.exc_info()[0]) + ", " + str(e) + ", traceback: " + traceback.format_exc())
-			pass
+			self.close_session()
+			return False
 
 
 def get_current_user():
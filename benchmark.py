@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""Benchmarks of tests, parsers, template rendering and full run on large synthetic command outputs.
+Commands are not executed: run_command is stubbed with generated outputs, so results do not depend on host.
+
+Usage:
+	benchmark.py - run all benchmarks, compare with baseline if it exists
+	--only name1,name2 - run only these benchmarks
+	--repeat N - run each benchmark N times, best time is used (default 3)
+	--syslog-mb N - size of synthetic syslog file (default 256, use 4096 for multi-GB file)
+	--baseline FILE - baseline file (default benchmark_baseline.json near this script)
+	--save-baseline - save results as new baseline
+	--threshold X - benchmark is regression if it is slower than baseline by more than X (default 0.25 = 25%)
+Exit code is 1 if there are regressions.
+"""
+
+
+import sys
+import os
+import time
+import json
+import random
+import tempfile
+import configparser
+import logging
+
+from base_functions import *
+from tests import *
+
+
+
+class StubCommands(object):
+	"""replacement of run_command: returns synthetic output for known commands, empty string for others"""
+	
+	def __init__(self, disks = 64, hosts = 256, ps_lines = 100000, dmesg_bytes = 4 * 1024 * 1024):
+		super(StubCommands, self).__init__()
+		self.disks = [f"/dev/sd{chr(96 + i // 26) if i >= 26 else ''}{chr(97 + i % 26)}" for i in range(disks)]
+		self.hosts = [f"host{i}.example.com" for i in range(hosts)]
+		self.outputs = {"ps aux": self.generate_ps_aux(ps_lines),
+			"dmesg": self.generate_dmesg(dmesg_bytes),
+			"uptime": " 16:01:35 up 5 days, 10:01,  3 users,  load average: 0.42, 0.30, 0.17\n",
+			"df": "Filesystem     1K-blocks     Used Available Use% Mounted on\n" + "".join([f"/dev/sda{i}       100000000 50000000  50000000  50% /mnt/{i}\n" for i in range(32)]),
+			"smartctl --scan-open": "".join([f"{d} -d sat # {d} [SAT], ATA device\n" for d in self.disks])}
+		self.misses = []
+	
+	
+	@staticmethod
+	def generate_ps_aux(lines):
+		rnd = random.Random(1)
+		result_lines = ["USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND"]
+		commands = ["/usr/sbin/nginx -g daemon off;", "/usr/bin/python3 /opt/app/worker.py --queue default", "postgres: writer process", "[kworker/3:1-events]", "/usr/sbin/sshd -D"]
+		for pid in range(1, lines):
+			result_lines.append(f"root     {pid:>7} {rnd.random() * 10:4.1f} {rnd.random() * 5:4.1f} {rnd.randint(1000, 9000000):>6} {rnd.randint(100, 900000):>5} ?        Ss   Oct18   0:{rnd.randint(0, 59):02d} {rnd.choice(commands)}")
+		return "\n".join(result_lines) + "\n"
+	
+	
+	@staticmethod
+	def generate_dmesg(ring_bytes):
+		rnd = random.Random(2)
+		messages = ["usb 1-1: new high-speed USB device number 2 using xhci_hcd", "EXT4-fs (sda1): mounted filesystem with ordered data mode", "e1000e 0000:00:19.0 eth0: NIC Link is Up 1000 Mbps Full Duplex", "audit: type=1400 audit(1697000000.000:42): apparmor=\"STATUS\""]
+		result_lines = []
+		size = 0
+		ts = 0.0
+		while size < ring_bytes:
+			ts += rnd.random()
+			line = f"[{ts:12.6f}] {rnd.choice(messages)}"
+			result_lines.append(line)
+			size += len(line) + 1
+		return "\n".join(result_lines) + "\n"
+	
+	
+	@staticmethod
+	def generate_smartctl_json(device):
+		return json.dumps({"smartctl": {"exit_status": 0}, "model_name": "WDC WD40EFRX", "serial_number": device[-3:],
+			"smart_status": {"passed": True}, "temperature": {"current": 35},
+			"ata_smart_attributes": {"table": [{"id": i, "value": 100, "raw": {"value": 0}} for i in range(1, 200, 4)]}})
+	
+	
+	@staticmethod
+	def generate_smartctl_full(device):
+		return "\n".join([f"smartctl 7.3 full dump of {device}"] + [f"{i:3d} Attribute_Name_{i}    0x0033   100   100   010    Pre-fail  Always       -       0" for i in range(1, 256)]) + "\n"
+	
+	
+	@staticmethod
+	def generate_ping(host):
+		return f"PING {host} (10.0.0.1) 56(84) bytes of data.\n" + "".join([f"64 bytes from 10.0.0.1: icmp_seq={i} ttl=64 time=0.0{i}0 ms\n" for i in range(1, 5)]) + \
+			f"\n--- {host} ping statistics ---\n4 packets transmitted, 4 received, 0% packet loss, time 3004ms\nrtt min/avg/max/mdev = 0.030/0.040/0.052/0.008 ms\n"
+	
+	
+	def __call__(self, cmdstring, timeout = None):
+		if cmdstring in self.outputs:
+			return self.outputs[cmdstring]
+		words = cmdstring.split()
+		if words[0] == "smartctl" and "-j" in words:
+			return self.generate_smartctl_json(words[-1])
+		if words[0] == "smartctl" and "-a" in words:
+			return self.generate_smartctl_full(words[-1])
+		if words[0] == "ping":
+			return self.generate_ping(words[-1])
+		self.misses.append(cmdstring)
+		return ""
+
+
+
+def generate_zpool_status(pools = 16, vdevs = 64):
+	lines = []
+	for p in range(pools):
+		lines += [f"  pool: tank{p}", " state: ONLINE", "  scan: scrub repaired 0B in 00:01:02 with 0 errors on Sun Oct 13 00:25:03 2024", "config:", "",
+			"\tNAME        STATE     READ WRITE CKSUM", f"\ttank{p}       ONLINE       0     0     0"]
+		for v in range(vdevs // 2):
+			lines.append(f"\t  mirror-{v}  ONLINE       0     0     0")
+			lines += [f"\t    da{v * 2 + i}     ONLINE       0     0     0" for i in range(2)]
+		lines += ["", "errors: No known data errors", ""]
+	return "\n".join(lines)
+
+
+def generate_syslog(path, size_mb):
+	"""write syslog-like file of size_mb, written in blocks so generation itself is fast"""
+	block = "".join([f"Oct 19 16:{i % 60:02d}:{i % 60:02d} host CRON[{1000 + i}]: (root) CMD (command -v debian-sa1 > /dev/null && debian-sa1 1 1)\n" for i in range(8192)])
+	block_bytes = block.encode("utf-8")
+	with open(path, "wb") as f:
+		for i in range(max(1, size_mb * 1024 * 1024 // len(block_bytes))):
+			f.write(block_bytes)
+
+
+
+class BenchmarkSuite(object):
+	"""runs benchmarks, compares results with baseline"""
+	
+	def __init__(self, repeat = 3, syslog_mb = 256, only = None):
+		super(BenchmarkSuite, self).__init__()
+		self.repeat = repeat
+		self.syslog_mb = syslog_mb
+		self.only = only
+		self.results = {} # name -> best time in seconds
+		self.tmp_dir = tempfile.mkdtemp(prefix = "simple_reporter_benchmark_")
+		self.syslog_file = os.path.join(self.tmp_dir, "syslog")
+		self.stub = StubCommands()
+		self._logger = logging.getLogger("benchmark")
+		self._logger.addHandler(logging.NullHandler())
+		self._logger.propagate = False
+	
+	
+	def _get_config(self, section, options):
+		config = configparser.ConfigParser()
+		config.read_dict({"main": {"state_dir": self.tmp_dir}, section: dict(options, type = section)})
+		return config
+	
+	
+	def _make_test(self, cls, section, options = {}):
+		return cls(config = self._get_config(section, options), logger = self._logger, name = section)
+	
+	
+	def _write_full_config(self):
+		config_file = os.path.join(self.tmp_dir, "benchmark.conf")
+		config = configparser.ConfigParser()
+		config.read_dict({"main": {"log_file": os.path.join(self.tmp_dir, "benchmark.log"), "state_dir": self.tmp_dir},
+			"uptime": {"enabled": "True", "type": "uptime"},
+			"datetime": {"enabled": "True", "type": "datetime"},
+			"df": {"enabled": "True", "type": "df-trivial"},
+			"ps": {"enabled": "True", "type": "ps", "process_substr": "nginx"},
+			"dmesg": {"enabled": "True", "type": "dmesg", "last_lines": "50"},
+			"smartctl": {"enabled": "True", "type": "smartctl"},
+			"ping": {"enabled": "True", "type": "ping", "hosts": ",".join(self.stub.hosts)},
+			"syslog": {"enabled": "True", "type": "file_content", "path": self.syslog_file, "max_lines": "100"}})
+		with open(config_file, "w") as f:
+			config.write(f)
+		return config_file
+	
+	
+	def bench(self, name, func, setup = None):
+		"""run func repeat times, setup (if any) is run before each run and is not timed. Best time is saved"""
+		if self.only is not None and name not in self.only:
+			return
+		times = []
+		for i in range(self.repeat):
+			arg = setup() if setup is not None else None
+			start = time.perf_counter()
+			if setup is not None:
+				func(arg)
+			else:
+				func()
+			times.append(time.perf_counter() - start)
+		self.results[name] = min(times)
+		print(f"{name:<28}{min(times):10.4f}s  (of {self.repeat} runs)")
+	
+	
+	def _full_cycle(self, config_file, render_only = False):
+		import simple_reporter
+		sr = simple_reporter.SimpleReporter(config_file = config_file, log_file = os.path.join(self.tmp_dir, "benchmark.log"))
+		try:
+			sr.init_all()
+			sr.run_tests()
+			if render_only:
+				start = time.perf_counter()
+				sr.compile_report()
+				return time.perf_counter() - start
+			sr.compile_report()
+		finally:
+			# logger is global, so handlers of previous cycles should not stay
+			sr.close_logger()
+	
+	
+	def run(self):
+		set_command_runner(self.stub)
+		try:
+			generate_syslog(self.syslog_file, self.syslog_mb)
+			zpool_status = generate_zpool_status()
+			self.bench("parse_ps_aux_100k", lambda t: t.run(), lambda: self._make_test(PSTest, "ps", {"process_substr": "nginx"}))
+			self.bench("parse_dmesg_ring", lambda t: t.run(), lambda: self._make_test(DmesgTest, "dmesg", {"last_lines": "50"}))
+			self.bench("smartctl_64_disks", lambda t: t.run(), lambda: self._make_test(SmartctlTest, "smartctl", {"full_dump_ttl_s": "0"}))
+			self.bench("ping_256_hosts", lambda t: t.run(), lambda: self._make_test(PingTest, "ping", {"hosts": ",".join(self.stub.hosts)}))
+			self.bench("parse_zpool_status", lambda: parse_zpool_status(zpool_status))
+			self.bench(f"file_content_syslog_{self.syslog_mb}mb", lambda t: t.run(), lambda: self._make_test(FileContentTest, "syslog", {"path": self.syslog_file, "max_lines": "100"}))
+			config_file = self._write_full_config()
+			if self.only is None or "render_report" in self.only:
+				times = [self._full_cycle(config_file, render_only = True) for i in range(self.repeat)]
+				self.results["render_report"] = min(times)
+				print(f"{'render_report':<28}{min(times):10.4f}s  (of {self.repeat} runs)")
+			self.bench("full_cycle", lambda: self._full_cycle(config_file))
+		finally:
+			set_command_runner(None)
+		if len(self.stub.misses) != 0:
+			print(f"commands without stub output: {sorted(set(self.stub.misses))}")
+		return self.results
+	
+	
+	def compare(self, baseline, threshold):
+		"""print comparison with baseline, return list of names of regressed benchmarks"""
+		regressions = []
+		for name, seconds in self.results.items():
+			if name not in baseline:
+				print(f"{name:<28}no baseline")
+				continue
+			ratio = seconds / baseline[name] if baseline[name] > 0 else 1.0
+			regressed = ratio > 1 + threshold
+			if regressed:
+				regressions.append(name)
+			print(f"{name:<28}{baseline[name]:10.4f}s -> {seconds:10.4f}s  {(ratio - 1) * 100:+6.1f}%{'  REGRESSION' if regressed else ''}")
+		return regressions
+	
+	
+	def cleanup(self):
+		import shutil
+		shutil.rmtree(self.tmp_dir, ignore_errors = True)
+
+
+
+if __name__ == "__main__":
+	arguments = sys.argv[1:]
+	if "-h" in arguments or "--help" in arguments:
+		print(__doc__)
+		sys.exit(0)
+	REPEAT = int(arguments[arguments.index("--repeat") + 1]) if "--repeat" in arguments else 3
+	SYSLOG_MB = int(arguments[arguments.index("--syslog-mb") + 1]) if "--syslog-mb" in arguments else 256
+	ONLY = arguments[arguments.index("--only") + 1].split(",") if "--only" in arguments else None
+	THRESHOLD = float(arguments[arguments.index("--threshold") + 1]) if "--threshold" in arguments else 0.25
+	BASELINE_FILE = arguments[arguments.index("--baseline") + 1] if "--baseline" in arguments else os.path.join(os.path.abspath(os.path.dirname(__file__)), "benchmark_baseline.json")
+	
+	suite = BenchmarkSuite(repeat = REPEAT, syslog_mb = SYSLOG_MB, only = ONLY)
+	try:
+		results = suite.run()
+	finally:
+		suite.cleanup()
+	if "--save-baseline" in arguments:
+		baseline = load_json_state(BASELINE_FILE, {})
+		baseline.update(results)
+		save_json_state(BASELINE_FILE, baseline)
+		print(f"baseline saved to {BASELINE_FILE}")
+		sys.exit(0)
+	baseline = load_json_state(BASELINE_FILE)
+	if baseline is None:
+		print(f"no baseline in {BASELINE_FILE}, run with --save-baseline to create it")
+		sys.exit(0)
+	print(f"\ncomparison with baseline {BASELINE_FILE}, threshold {THRESHOLD * 100:.0f}%:")
+	regressions = suite.compare(baseline, THRESHOLD)
+	if len(regressions) != 0:
+		print(f"regressions: {', '.join(regressions)}")
+		sys.exit(1)
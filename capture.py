@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""Capture bundles: record raw outputs of commands, file reads and host facts of a run, and replay them later
+instead of executing anything. Used by simple_reporter.py --record DIR and --replay DIR.
+
+Bundle dir:
+	manifest.json - OS info, commands (argv, exit code, duration), files, facts and results of network probes,
+		contents are referenced by sha256
+	blobs/<sha256>.gz - contents, each unique content is stored once
+	state/ - copy of state files at start of run, so replay sees the same history
+	simple_reporter.conf - config of run, passwords and tokens are redacted
+"""
+
+
+import os
+import time
+import datetime
+import json
+import gzip
+import hashlib
+import shlex
+import shutil
+import tempfile
+import threading
+import subprocess
+import configparser
+
+# logging
+import logging
+import logging.handlers
+
+import traceback
+
+from base_functions import *
+
+
+
+BUNDLE_VERSION = 1
+REDACTED_OPTIONS = ("password", "passwd", "token", "secret")
+
+
+
+class CaptureRecorder(object):
+	"""records every run_command, read_file and get_host_fact call of run into bundle dir"""
+	
+	def __init__(self, bundle_dir, logger = None):
+		super(CaptureRecorder, self).__init__()
+		self.bundle_dir = bundle_dir
+		self._logger = logger
+		self.REPLAY = False
+		self.commands = []
+		self.files = []
+		self.facts = {}
+		self.probes = {}
+		self._lock = threading.Lock()
+		self._started = None
+	
+	
+	def _store_blob(self, data):
+		sha = hashlib.sha256(data).hexdigest()
+		blob_file = os.path.join(self.bundle_dir, "blobs", sha + ".gz")
+		if not os.path.isfile(blob_file):
+			with open(blob_file, "wb") as f:
+				f.write(gzip.compress(data))
+		return sha
+	
+	
+	def run_command(self, cmdstring, timeout = None):
+		start = time.monotonic()
+		entry = {"cmd": cmdstring, "argv": shlex.split(cmdstring), "exit_code": None, "duration_s": None, "output": None, "timeout": False}
+		try:
+			output, entry["exit_code"] = execute_command(cmdstring, timeout)
+			entry["output"] = self._store_blob(output)
+			return output.decode("utf-8")
+		except subprocess.TimeoutExpired:
+			entry["timeout"] = True
+			raise
+		finally:
+			entry["duration_s"] = time.monotonic() - start
+			with self._lock:
+				self.commands.append(entry)
+	
+	
+	def read_file(self, path):
+		entry = {"path": path, "content": None, "error": None}
+		try:
+			with open(path, "rb") as f:
+				data = f.read()
+			entry["content"] = self._store_blob(data)
+			return data.decode("utf-8")
+		except OSError as e:
+			entry["error"] = {"errno": e.errno, "strerror": e.strerror}
+			raise
+		finally:
+			with self._lock:
+				self.files.append(entry)
+	
+	
+	def get_fact(self, name, func):
+		value = func()
+		with self._lock:
+			self.facts[name] = value
+		return value
+	
+	
+	def run_probes(self, name, func):
+		results = func()
+		with self._lock:
+			self.probes[name] = results
+		return results
+	
+	
+	def _save_config(self, config):
+		redacted = configparser.ConfigParser(interpolation = None)
+		redacted.read_dict({section: dict(config.items(section, raw = True)) for section in config.sections()})
+		for section in redacted.sections():
+			for option in redacted.options(section):
+				if any([word in option for word in REDACTED_OPTIONS]):
+					redacted.set(section, option, "REDACTED")
+		with open(os.path.join(self.bundle_dir, "simple_reporter.conf"), "w") as f:
+			redacted.write(f)
+	
+	
+	def start(self, config):
+		"""copy config and state files to bundle, then hook commands, file reads and facts"""
+		os.makedirs(os.path.join(self.bundle_dir, "blobs"), exist_ok = True)
+		self._save_config(config)
+		state_dir = get_state_dir(config)
+		bundle_state_dir = os.path.join(self.bundle_dir, "state")
+		os.makedirs(bundle_state_dir, exist_ok = True)
+		for name in os.listdir(state_dir):
+			if name.endswith(".json") and os.path.isfile(os.path.join(state_dir, name)):
+				shutil.copy2(os.path.join(state_dir, name), bundle_state_dir)
+		self._started = datetime.datetime.now()
+		set_command_runner(self.run_command)
+		set_file_reader(self.read_file)
+		set_fact_getter(self.get_fact)
+		set_probe_runner(self.run_probes)
+		if self._logger: self._logger.info(f"start: recording to {self.bundle_dir}")
+	
+	
+	def save(self):
+		"""unhook and write manifest"""
+		from tests import BaseTest
+		
+		set_command_runner(None)
+		set_file_reader(None)
+		set_fact_getter(None)
+		set_probe_runner(None)
+		manifest = {"version": BUNDLE_VERSION,
+			"host": get_hostname(),
+			"date": self._started.isoformat() if self._started is not None else None,
+			"os": BaseTest._os_type_dict,
+			"commands": self.commands,
+			"files": self.files,
+			"facts": self.facts,
+			"probes": self.probes}
+		save_json_state(os.path.join(self.bundle_dir, "manifest.json"), manifest)
+		if self._logger: self._logger.info(f"save: saved {len(self.commands)} commands, {len(self.files)} files, {len(self.facts)} facts, {len(self.probes)} probe runs to {self.bundle_dir}")
+
+
+
+class CaptureReplayer(object):
+	"""feeds outputs from bundle instead of executing commands, reading files and probing network.
+	Command run several times gets its recorded outputs in order, the last one is repeated after that.
+	Command, file or probes not in bundle raise error, like failed command would"""
+	
+	def __init__(self, bundle_dir, logger = None):
+		super(CaptureReplayer, self).__init__()
+		self.bundle_dir = bundle_dir
+		self._logger = logger
+		self.REPLAY = True
+		self.manifest = load_json_state(os.path.join(self.bundle_dir, "manifest.json"))
+		if self.manifest is None:
+			raise FileNotFoundError(f"no manifest.json in capture bundle {self.bundle_dir}")
+		self._commands = {} # cmd -> list of entries
+		for entry in self.manifest["commands"]:
+			self._commands.setdefault(entry["cmd"], []).append(entry)
+		self._files = {entry["path"]: entry for entry in self.manifest["files"]}
+		self._counters = {}
+		self._blobs = {}
+		self._lock = threading.Lock()
+		self.state_dir = None
+	
+	
+	def _load_blob(self, sha):
+		if sha not in self._blobs:
+			with open(os.path.join(self.bundle_dir, "blobs", sha + ".gz"), "rb") as f:
+				self._blobs[sha] = gzip.decompress(f.read())
+		return self._blobs[sha]
+	
+	
+	def run_command(self, cmdstring, timeout = None):
+		if cmdstring not in self._commands:
+			raise RuntimeError(f"command is not in capture bundle: {cmdstring}")
+		with self._lock:
+			entries = self._commands[cmdstring]
+			index = self._counters.get(cmdstring, 0)
+			self._counters[cmdstring] = index + 1
+		entry = entries[min(index, len(entries) - 1)]
+		if entry["timeout"]:
+			raise subprocess.TimeoutExpired(entry["argv"], timeout)
+		return self._load_blob(entry["output"]).decode("utf-8")
+	
+	
+	def read_file(self, path):
+		if path not in self._files:
+			raise FileNotFoundError(2, "file is not in capture bundle", path)
+		entry = self._files[path]
+		if entry["error"] is not None:
+			raise OSError(entry["error"]["errno"], entry["error"]["strerror"], path)
+		return self._load_blob(entry["content"]).decode("utf-8")
+	
+	
+	def get_fact(self, name, func):
+		if name in self.manifest["facts"]:
+			return self.manifest["facts"][name]
+		if self._logger: self._logger.error(f"get_fact: fact {name} is not in capture bundle, using value of this host")
+		return func()
+	
+	
+	def run_probes(self, name, func):
+		if name not in self.manifest.get("probes", {}):
+			raise RuntimeError(f"probes are not in capture bundle: {name}")
+		return self.manifest["probes"][name]
+	
+	
+	def start(self, config):
+		"""use copy of bundle state in temp dir as state_dir, set OS info of recorded host, hook commands, file reads, facts and probes.
+		Should be called before anything uses state_dir"""
+		from tests import BaseTest
+		
+		self.state_dir = tempfile.mkdtemp(prefix = "simple_reporter_replay_")
+		bundle_state_dir = os.path.join(self.bundle_dir, "state")
+		if os.path.isdir(bundle_state_dir):
+			for name in os.listdir(bundle_state_dir):
+				shutil.copy2(os.path.join(bundle_state_dir, name), self.state_dir)
+		if not config.has_section("main"):
+			config.add_section("main")
+		config.set("main", "state_dir", self.state_dir)
+		BaseTest._os_type_dict = self.manifest["os"]
+		set_command_runner(self.run_command)
+		set_file_reader(self.read_file)
+		set_fact_getter(self.get_fact)
+		set_probe_runner(self.run_probes)
+		if self._logger: self._logger.info(f"start: replaying {self.bundle_dir} recorded on {self.manifest['host']} at {self.manifest['date']}, state dir {self.state_dir}")
+	
+	
+	def save(self):
+		"""unhook, remove temp state dir"""
+		set_command_runner(None)
+		set_file_reader(None)
+		set_fact_getter(None)
+		set_probe_runner(None)
+		if self.state_dir is not None:
+			shutil.rmtree(self.state_dir, ignore_errors = True)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""Fleet collector: receives results pushed by many simple_reporter instances (reporter-push),
+stores them in local sqlite db and composes one fleet digest: failing hosts first, then hosts whose results changed.
+Used by simple_reporter.py --collector.
+
+Run as script to simulate clients: collector.py --simulate <number of hosts> <url>
+"""
+
+
+import sys
+import os
+import time
+import datetime
+import json
+import gzip
+import zlib
+import hashlib
+import sqlite3
+import threading
+import queue
+import http.server
+import urllib.request
+
+# logging
+import logging
+import logging.handlers
+
+import traceback
+
+from base_functions import *
+
+
+
+class FleetHTTPHandler(http.server.BaseHTTPRequestHandler):
+	"""accepts POST of gzip-compressed JSON payload, puts it into queue of collector and replies at once"""
+	
+	def do_POST(self):
+		collector = self.server.collector
+		if collector.token is not None and self.headers.get("X-Simple-Reporter-Token") != collector.token:
+			self.send_error(403)
+			return
+		length = int(self.headers.get("Content-Length", 0))
+		if length > collector.max_payload_bytes:
+			self.send_error(413)
+			return
+		body = self.rfile.read(length)
+		try:
+			if self.headers.get("Content-Encoding", "") == "gzip":
+				# bounded decompression, so small payload can not expand into huge one
+				decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+				body = decompressor.decompress(body, collector.max_payload_bytes)
+				if decompressor.unconsumed_tail != b"":
+					self.send_error(413)
+					return
+			payload = json.loads(body)
+			collector.validate_payload(payload)
+		except Exception as e:
+			collector._logger.error(f"do_POST: bad payload from {self.client_address[0]}: {e}")
+			self.send_error(400)
+			return
+		collector.queue.put((time.time(), payload))
+		self.send_response(202)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+	
+	
+	def log_message(self, format, *args):
+		# every host reports, logging each request is too much
+		pass
+
+
+
+class FleetHTTPServer(http.server.ThreadingHTTPServer):
+	"""large listen backlog, so all hosts can connect within the same second"""
+	request_queue_size = 1024
+	daemon_threads = True
+
+
+
+class FleetCollector(object):
+	"""FleetCollector - HTTP server for pushed results, writer thread which stores them in sqlite in batches,
+	and digest of fleet state.
+	
+	Config section with type = collector: listen, db_file, token, batch_size, flush_interval_s, stale_after_s, history_days
+	"""
+	
+	def __init__(self, config = None, logger = None):
+		super(FleetCollector, self).__init__()
+		self._config = config
+		self._logger = logger
+		self.listen = "0.0.0.0:9878"
+		self.db_file = os.path.join(get_state_dir(self._config), "fleet.sqlite")
+		self.token = None # if set, clients should send it in X-Simple-Reporter-Token header
+		self.digest_interval_s = 3600
+		self.batch_size = 500 # payloads written in one transaction
+		self.flush_interval_s = 1.0 # batch is written at least that often
+		self.stale_after_s = 7200 # host which did not report that long is shown as failing
+		self.history_days = 7 # results older than that are deleted
+		self.max_payload_bytes = 16 * 1024 * 1024
+		self.queue = queue.Queue()
+		self._server = None
+		self._writer_thread = None
+		self._stop_event = threading.Event()
+		self._digest_hashes = [] # (brief_hash, host) of hosts in last composed digest
+		self.load_config()
+	
+	
+	def load_config(self):
+		for section in self._config.sections():
+			if "type" not in self._config.options(section) or self._config.get(section, "type") != "collector":
+				continue
+			if self._config.get(section, "enabled") != "True":
+				self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
+				continue
+			self._logger.debug(f"load_config: will use section {section}")
+			if self._config.has_option(section, "listen"):
+				self.listen = self._config.get(section, "listen")
+			if self._config.has_option(section, "db_file"):
+				self.db_file = self._config.get(section, "db_file")
+			if self._config.has_option(section, "token"):
+				self.token = self._config.get(section, "token")
+			if self._config.has_option(section, "digest_interval_s"):
+				self.digest_interval_s = self._config.getint(section, "digest_interval_s")
+			if self._config.has_option(section, "batch_size"):
+				self.batch_size = self._config.getint(section, "batch_size")
+			if self._config.has_option(section, "flush_interval_s"):
+				self.flush_interval_s = self._config.getfloat(section, "flush_interval_s")
+			if self._config.has_option(section, "stale_after_s"):
+				self.stale_after_s = self._config.getint(section, "stale_after_s")
+			if self._config.has_option(section, "history_days"):
+				self.history_days = self._config.getint(section, "history_days")
+			break
+	
+	
+	def _connect(self):
+		conn = sqlite3.connect(self.db_file, timeout = 30)
+		conn.execute("PRAGMA journal_mode = WAL")
+		conn.execute("PRAGMA synchronous = NORMAL")
+		return conn
+	
+	
+	def init_db(self):
+		conn = self._connect()
+		with conn:
+			conn.execute("CREATE TABLE IF NOT EXISTS results (host TEXT, run TEXT, received REAL, test TEXT, type TEXT, failed INTEGER, ignored INTEGER, error_text TEXT, brief TEXT, hash TEXT, data TEXT)")
+			conn.execute("CREATE INDEX IF NOT EXISTS results_received ON results (received)")
+			# state_hash - hash of briefs of last run, digest_hash - state_hash at time of last sent digest
+			conn.execute("CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, last_seen REAL, run TEXT, failed_tests TEXT, brief TEXT, state_hash TEXT, digest_hash TEXT)")
+		conn.close()
+	
+	
+	@staticmethod
+	def validate_payload(payload):
+		"""raise ValueError if payload is not dict with host and list of test records"""
+		if not isinstance(payload, dict) or not isinstance(payload.get("host"), str) or not isinstance(payload.get("tests"), list):
+			raise ValueError("payload has no host or tests")
+		for t in payload["tests"]:
+			if not isinstance(t, dict) or not isinstance(t.get("name"), str):
+				raise ValueError("test record is not dict with name")
+			for key in ("error_text", "brief"):
+				if t.get(key) is not None and not isinstance(t[key], str):
+					raise ValueError(f"{key} of test {t['name']} is not string")
+	
+	
+	@staticmethod
+	def _host_row(received, payload):
+		tests = payload["tests"]
+		failed_tests = [f"{t['name']}: {t.get('error_text') or ''}" for t in tests if t.get("failed")]
+		brief = "\n".join([t["brief"] for t in tests if t.get("brief")])
+		# counters, pids and timestamps change hash of results on every run, so changes are detected by brief
+		state_hash = hashlib.sha256(brief.encode("utf-8")).hexdigest()
+		return (payload["host"], received, payload.get("run"), json.dumps(failed_tests), brief, state_hash)
+	
+	
+	def write_batch(self, conn, batch):
+		"""store batch of (received, payload) in one transaction. Bad payload is skipped, not the whole batch"""
+		result_rows = []
+		host_rows = []
+		for received, payload in batch:
+			try:
+				self.validate_payload(payload)
+				host_row = self._host_row(received, payload)
+				payload_rows = [(payload["host"], payload.get("run"), received, t.get("name"), t.get("type"), bool(t.get("failed")), bool(t.get("ignored")),
+					t.get("error_text"), t.get("brief"), t.get("hash"), json.dumps(t.get("data"))) for t in payload["tests"]]
+			except Exception as e:
+				self._logger.error(f"write_batch: skipping bad payload of host {payload.get('host') if isinstance(payload, dict) else None}: {e}")
+				continue
+			host_rows.append(host_row)
+			result_rows += payload_rows
+		with conn:
+			conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", result_rows)
+			conn.executemany("INSERT INTO hosts (host, last_seen, run, failed_tests, brief, state_hash) VALUES (?, ?, ?, ?, ?, ?) "
+				"ON CONFLICT (host) DO UPDATE SET last_seen = excluded.last_seen, run = excluded.run, failed_tests = excluded.failed_tests, "
+				"brief = excluded.brief, state_hash = excluded.state_hash", host_rows)
+		self._logger.debug(f"write_batch: stored {len(batch)} payloads, {len(result_rows)} results")
+	
+	
+	def _writer(self):
+		"""runs in writer thread: waits for first payload, then takes whatever else is queued up to batch_size"""
+		conn = self._connect()
+		while not (self._stop_event.is_set() and self.queue.empty()):
+			try:
+				batch = [self.queue.get(timeout = self.flush_interval_s)]
+			except queue.Empty:
+				continue
+			while len(batch) < self.batch_size:
+				try:
+					batch.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			try:
+				self.write_batch(conn, batch)
+			except Exception as e:
+				self._logger.error(f"_writer: could not store batch of {len(batch)} payloads: {e}, traceback: {traceback.format_exc()}")
+		conn.close()
+	
+	
+	def start(self):
+		self.init_db()
+		self._stop_event.clear()
+		self._writer_thread = threading.Thread(target = self._writer, daemon = True)
+		self._writer_thread.start()
+		host, port = self.listen.rsplit(":", 1)
+		self._server = FleetHTTPServer((host, int(port)), FleetHTTPHandler)
+		self._server.collector = self
+		# port 0 - any free port
+		self.listen = f"{host}:{self._server.server_address[1]}"
+		threading.Thread(target = self._server.serve_forever, daemon = True).start()
+		self._logger.info(f"start: listening on {self.listen}, db {self.db_file}")
+	
+	
+	def stop(self):
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+		self._stop_event.set()
+		if self._writer_thread is not None:
+			self._writer_thread.join()
+			self._writer_thread = None
+		self._logger.info("stop: complete")
+	
+	
+	def compose_digest(self):
+		"""compose text of fleet digest. Hosts are marked as reported by mark_digest_sent(), once digest is sent.
+		Returns None if no hosts reported yet"""
+		now = time.time()
+		conn = self._connect()
+		rows = conn.execute("SELECT host, last_seen, run, failed_tests, brief, state_hash, digest_hash FROM hosts ORDER BY host").fetchall()
+		if len(rows) == 0:
+			conn.close()
+			return None
+		failing_lines = []
+		changed_lines = []
+		failing_count = 0
+		for host, last_seen, run, failed_tests, brief, state_hash, digest_hash in sorted(rows, key = lambda r: -len(json.loads(r[3]))):
+			failed_tests = json.loads(failed_tests)
+			if now - last_seen > self.stale_after_s:
+				failed_tests = [f"no report since {datetime.datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S')}"] + failed_tests
+			if len(failed_tests) != 0:
+				failing_count += 1
+				failing_lines.append(f"{host} ({len(failed_tests)} problems, run {run}):")
+				failing_lines += [f"\t{line}" for line in failed_tests]
+			elif state_hash != digest_hash:
+				changed_lines.append(f"{host} ({'new host' if digest_hash is None else 'changed'}, run {run}):")
+				changed_lines += [f"\t{line}" for line in brief.splitlines()]
+		self._digest_hashes = [(state_hash, host) for host, last_seen, run, failed_tests, brief, state_hash, digest_hash in rows]
+		with conn:
+			conn.execute("DELETE FROM results WHERE received < ?", (now - self.history_days * 86400, ))
+		conn.close()
+		changed_count = len([l for l in changed_lines if not l.startswith("\t")])
+		digest_lines = [f"FLEET DIGEST from {get_hostname()}: {len(rows)} hosts, {failing_count} failing, {changed_count} changed, {len(rows) - failing_count - changed_count} unchanged", ""]
+		if len(failing_lines) != 0:
+			digest_lines += ["FAILING HOSTS:"] + failing_lines + [""]
+		if len(changed_lines) != 0:
+			digest_lines += ["CHANGED HOSTS:"] + changed_lines + [""]
+		self._logger.info(f"compose_digest: {len(rows)} hosts, {failing_count} failing, {changed_count} changed")
+		return "\n".join(digest_lines)
+	
+	
+	def mark_digest_sent(self):
+		"""hosts of last composed digest are not shown as changed in next digest, until they change again"""
+		conn = self._connect()
+		with conn:
+			conn.executemany("UPDATE hosts SET digest_hash = ? WHERE host = ?", self._digest_hashes)
+		conn.close()
+		self._digest_hashes = []
+
+
+
+def simulate_clients(url, hosts_count, tests_count = 20, max_parallel = 64, token = None):
+	"""push synthetic payloads as hosts_count hosts at once, return (ok count, seconds)"""
+	def push(i):
+		tests = [{"name": f"test{j}", "type": "simulated", "failed": (i + j) % 97 == 0, "ignored": False,
+			"error_text": "simulated failure" if (i + j) % 97 == 0 else "", "brief": f"test{j}: value {(i * j) % 10}",
+			"hash": hashlib.sha256(f"{i} {j}".encode("utf-8")).hexdigest(), "data": {"value": i * j}} for j in range(tests_count)]
+		body = gzip.compress(json.dumps({"host": f"host{i:04d}", "run": datetime.datetime.now().isoformat(timespec = "seconds"), "tests": tests}).encode("utf-8"))
+		headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+		if token is not None:
+			headers["X-Simple-Reporter-Token"] = token
+		try:
+			with urllib.request.urlopen(urllib.request.Request(url, data = body, headers = headers, method = "POST"), timeout = 30) as response:
+				return response.status == 202
+		except Exception as e:
+			print(f"host{i:04d}: {e}")
+			return False
+	
+	start = time.monotonic()
+	results = run_parallel(push, range(hosts_count), max_parallel)
+	return len([r for r in results if r]), time.monotonic() - start
+
+
+
+if __name__ == "__main__":
+	arguments = sys.argv[1:]
+	if len(arguments) != 3 or arguments[0] != "--simulate":
+		print("Usage: collector.py --simulate <number of hosts> <url>")
+		sys.exit(1)
+	ok_count, duration = simulate_clients(arguments[2], int(arguments[1]))
+	print(f"pushed {ok_count} of {arguments[1]} hosts in {duration:.3f}s")
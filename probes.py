@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""Async endpoint probes: TCP connect and HTTP(S) GET against many targets concurrently.
+Used by EndpointsTest and IfconfigMeTest.
+"""
+
+
+import os
+import time
+import asyncio
+import ssl
+import urllib.parse
+
+# logging
+import logging
+import logging.handlers
+
+import traceback
+
+
+
+class Probe(object):
+	"""Probe - one target and its expectations, also holds result after run
+	
+	kind:
+		tcp - only connect to host:port, url is tcp://host:port
+		http - GET url (http or https), check status and body
+		external_ip - GET url, body is our external IP address, i.e. https://ifconfig.me/ip
+	"""
+	
+	def __init__(self, url, kind = None, expect_status = None, expect_body = None, timeout_s = 5.0):
+		super(Probe, self).__init__()
+		self.url = url
+		self._parsed_url = urllib.parse.urlsplit(url)
+		self.scheme = self._parsed_url.scheme
+		self.kind = kind if kind is not None else ("tcp" if self.scheme == "tcp" else "http")
+		self.host = self._parsed_url.hostname
+		self.port = self._parsed_url.port or {"http": 80, "https": 443}.get(self.scheme)
+		self.path = (self._parsed_url.path or "/") + (f"?{self._parsed_url.query}" if self._parsed_url.query else "")
+		self.expect_status = expect_status # if None, any 2xx and 3xx status is OK
+		self.expect_body = expect_body # substring which should be in body
+		self.timeout_s = timeout_s
+		# results
+		self.ok = None
+		self.status = None
+		self.body = ""
+		self.latency_ms = None
+		self.error = ""
+	
+	
+	@classmethod
+	def from_line(cls, line, timeout_s = 5.0):
+		"""create probe from config line: <url> [kind=external_ip] [status=200] [body=substring] [timeout=3]"""
+		words = line.split()
+		options = dict(w.split("=", 1) for w in words[1:] if "=" in w)
+		return cls(words[0],
+			kind = options.get("kind"),
+			expect_status = int(options["status"]) if "status" in options else None,
+			expect_body = options.get("body"),
+			timeout_s = float(options.get("timeout", timeout_s)))
+	
+	
+	@property
+	def conn_key(self):
+		"""probes with same key can share connection"""
+		return (self.scheme, self.host, self.port)
+	
+	
+	def check(self):
+		"""set ok and error according to expectations"""
+		if self.error != "":
+			self.ok = False
+			return
+		self.ok = True
+		if self.kind == "tcp":
+			return
+		if self.expect_status is not None and self.status != self.expect_status:
+			self.ok = False
+			self.error = f"status {self.status} != {self.expect_status}"
+		elif self.expect_status is None and not (200 <= self.status < 400):
+			self.ok = False
+			self.error = f"status {self.status}"
+		elif self.expect_body is not None and self.expect_body not in self.body:
+			self.ok = False
+			self.error = f"body does not contain \"{self.expect_body}\""
+	
+	
+	@property
+	def result_dict(self):
+		"""results of probe, so they can be recorded and replayed"""
+		return {"ok": self.ok, "status": self.status, "body": self.body, "latency_ms": self.latency_ms, "error": self.error}
+	
+	
+	def set_result(self, result_dict):
+		self.ok = result_dict["ok"]
+		self.status = result_dict["status"]
+		self.body = result_dict["body"]
+		self.latency_ms = result_dict["latency_ms"]
+		self.error = result_dict["error"]
+	
+	
+	def __repr__(self):
+		return f"<Probe {self.kind} {self.url} ok={self.ok}>"
+
+
+
+class HTTPConnection(object):
+	"""minimal HTTP/1.1 client connection on asyncio streams, keep-alive is used when server allows it"""
+	
+	def __init__(self, scheme, host, port, max_body_bytes = 65536):
+		super(HTTPConnection, self).__init__()
+		self.scheme = scheme
+		self.host = host
+		self.port = port
+		self.max_body_bytes = max_body_bytes # body is read fully, but only this much is kept
+		self._reader = None
+		self._writer = None
+	
+	
+	@property
+	def connected(self):
+		return self._writer is not None and not self._writer.is_closing()
+	
+	
+	async def connect(self):
+		ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+		self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl = ssl_context)
+	
+	
+	async def close(self):
+		writer = self._writer
+		self._writer = None
+		self._reader = None
+		if writer is not None:
+			writer.close()
+			try:
+				await asyncio.wait_for(writer.wait_closed(), 5)
+			except Exception:
+				pass
+	
+	
+	async def _read_body(self, status, headers):
+		body = b""
+		if 100 <= status < 200 or status in (204, 304):
+			# these responses never have body (RFC 9112 6.3), whatever headers say
+			pass
+		elif headers.get("transfer-encoding", "").lower() == "chunked":
+			while True:
+				size = int((await self._reader.readline()).split(b";")[0].strip(), 16)
+				if size == 0:
+					# skip trailers
+					while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+						pass
+					break
+				chunk = await self._reader.readexactly(size + 2)
+				if len(body) < self.max_body_bytes:
+					body += chunk[:-2]
+		elif "content-length" in headers:
+			remain = int(headers["content-length"])
+			while remain > 0:
+				chunk = await self._reader.read(min(remain, 65536))
+				if chunk == b"":
+					raise ConnectionError("connection closed while reading body")
+				remain -= len(chunk)
+				if len(body) < self.max_body_bytes:
+					body += chunk
+		else:
+			# body till connection close
+			while True:
+				chunk = await self._reader.read(65536)
+				if chunk == b"":
+					break
+				if len(body) < self.max_body_bytes:
+					body += chunk
+			headers["connection"] = "close"
+		return body[:self.max_body_bytes]
+	
+	
+	async def get(self, path):
+		"""send GET, return (status, body). If kept alive connection was closed by server since previous request,
+		request is repeated once on new connection"""
+		reused = self.connected
+		if not reused:
+			await self.connect()
+		try:
+			return await self._request(path)
+		except (ConnectionError, asyncio.IncompleteReadError):
+			if not reused:
+				raise
+			await self.close()
+			await self.connect()
+			return await self._request(path)
+	
+	
+	async def _request(self, path):
+		host_header = self.host if self.port in (80, 443) else f"{self.host}:{self.port}"
+		request = f"GET {path} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: simple_reporter\r\nAccept: */*\r\nConnection: keep-alive\r\n\r\n"
+		self._writer.write(request.encode("ascii"))
+		await self._writer.drain()
+		status = 100
+		while 100 <= status < 200:
+			# interim responses (103 Early Hints etc) are followed by final one
+			status_line = await self._reader.readline()
+			if status_line == b"":
+				raise ConnectionError("connection closed by server")
+			status = int(status_line.split()[1])
+			headers = {}
+			while True:
+				line = await self._reader.readline()
+				if line in (b"\r\n", b"\n", b""):
+					break
+				key, value = line.decode("latin-1").split(":", 1)
+				headers[key.strip().lower()] = value.strip()
+		body = await self._read_body(status, headers)
+		if headers.get("connection", "").lower() == "close":
+			await self.close()
+		return status, body.decode("utf-8", errors = "replace")
+
+
+
+class EndpointProber(object):
+	"""runs probes concurrently with asyncio.
+	HTTP probes to the same scheme, host and port are run one after another over one keep-alive connection,
+	different hosts and TCP probes run concurrently, at most max_parallel at once."""
+	
+	def __init__(self, max_parallel = 64, logger = None):
+		super(EndpointProber, self).__init__()
+		self._logger = logger
+		self.max_parallel = max_parallel
+	
+	
+	async def _run_tcp_probe(self, probe):
+		start = time.monotonic()
+		try:
+			reader, writer = await asyncio.wait_for(asyncio.open_connection(probe.host, probe.port), probe.timeout_s)
+			probe.latency_ms = (time.monotonic() - start) * 1000
+			writer.close()
+			try:
+				await asyncio.wait_for(writer.wait_closed(), 5)
+			except Exception:
+				pass
+		except asyncio.TimeoutError:
+			probe.error = f"timeout after {probe.timeout_s}s"
+		except Exception as e:
+			probe.error = f"{type(e).__name__}: {e}"
+		probe.check()
+	
+	
+	async def _run_http_probes(self, probes):
+		conn = HTTPConnection(probes[0].scheme, probes[0].host, probes[0].port)
+		try:
+			for probe in probes:
+				start = time.monotonic()
+				try:
+					probe.status, probe.body = await asyncio.wait_for(conn.get(probe.path), probe.timeout_s)
+					probe.latency_ms = (time.monotonic() - start) * 1000
+				except asyncio.TimeoutError:
+					probe.error = f"timeout after {probe.timeout_s}s"
+					await conn.close()
+				except Exception as e:
+					probe.error = f"{type(e).__name__}: {e}"
+					await conn.close()
+				probe.check()
+		finally:
+			await conn.close()
+	
+	
+	async def _run_all(self, probes):
+		semaphore = asyncio.Semaphore(self.max_parallel)
+		
+		async def limited(coro):
+			async with semaphore:
+				await coro
+		
+		jobs = []
+		http_groups = {}
+		for probe in probes:
+			if probe.kind == "tcp":
+				jobs.append(self._run_tcp_probe(probe))
+			else:
+				http_groups.setdefault(probe.conn_key, []).append(probe)
+		for group in http_groups.values():
+			jobs.append(self._run_http_probes(group))
+		await asyncio.gather(*[limited(j) for j in jobs])
+	
+	
+	def run(self, probes):
+		"""run all probes, results are set in probe objects"""
+		start = time.monotonic()
+		asyncio.run(self._run_all(probes))
+		if self._logger: self._logger.debug(f"run: {len(probes)} probes complete in {time.monotonic() - start:.3f}s")
+		return probes
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""On-demand profiling of simple_reporter.py run, nothing here is imported or started unless asked for.
+	--profile DIR: whole run under cProfile, saved as DIR/simple_reporter.pstats and DIR/simple_reporter_pstats.txt,
+		plus stacks of all threads sampled by timer thread, saved as DIR/simple_reporter.collapsed (input of flamegraph.pl)
+	--trace-malloc: tracemalloc snapshots after init, after run_tests and after render, top allocation sites of each phase are logged
+"""
+
+
+import os
+import sys
+import time
+import threading
+import collections
+import cProfile
+import pstats
+import tracemalloc
+
+# logging
+import logging
+import logging.handlers
+
+import traceback
+
+
+
+class RunProfiler(object):
+	"""cProfile of main thread and sampled collapsed stacks of all threads"""
+	
+	def __init__(self, profile_dir, sample_interval_s = 0.005):
+		super(RunProfiler, self).__init__()
+		self.profile_dir = profile_dir
+		self.sample_interval_s = sample_interval_s
+		self._logger = None
+		self._profile = cProfile.Profile()
+		self._stacks = collections.Counter() # "frame;frame;frame" -> samples
+		self._stop_event = threading.Event()
+		self._sampler = threading.Thread(target = self._sample_loop, name = "profiler-sampler", daemon = True)
+	
+	
+	@staticmethod
+	def _collapse(frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+			frame = frame.f_back
+		return ";".join(reversed(names))
+	
+	
+	def _sample_loop(self):
+		own_id = threading.get_ident()
+		thread_names = {}
+		while not self._stop_event.wait(self.sample_interval_s):
+			for t in threading.enumerate():
+				thread_names[t.ident] = t.name
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id == own_id:
+					continue
+				self._stacks[thread_names.get(thread_id, str(thread_id)) + ";" + self._collapse(frame)] += 1
+	
+	
+	def start(self):
+		os.makedirs(self.profile_dir, exist_ok = True)
+		self._sampler.start()
+		self._profile.enable()
+	
+	
+	def stop(self):
+		"""stop profiling and save results"""
+		self._profile.disable()
+		self._stop_event.set()
+		self._sampler.join()
+		pstats_file = os.path.join(self.profile_dir, "simple_reporter.pstats")
+		self._profile.dump_stats(pstats_file)
+		with open(os.path.join(self.profile_dir, "simple_reporter_pstats.txt"), "w") as f:
+			stats = pstats.Stats(self._profile, stream = f)
+			stats.sort_stats("cumulative").print_stats(50)
+			stats.sort_stats("tottime").print_stats(50)
+		with open(os.path.join(self.profile_dir, "simple_reporter.collapsed"), "w") as f:
+			for stack, count in sorted(self._stacks.items()):
+				f.write(f"{stack} {count}\n")
+		if self._logger: self._logger.info(f"stop: profile saved to {pstats_file}, {sum(self._stacks.values())} stack samples collected")
+		print(f"profile saved to {self.profile_dir}")
+
+
+
+class MallocTracer(object):
+	"""tracemalloc snapshots at phase boundaries, logs allocation sites which grew most during each phase"""
+	
+	def __init__(self, top_n = 15, frames = 1):
+		super(MallocTracer, self).__init__()
+		self.top_n = top_n
+		self.frames = frames
+		self._logger = None
+		self._last_snapshot = None
+	
+	
+	def start(self):
+		tracemalloc.start(self.frames)
+	
+	
+	def snapshot(self, phase):
+		snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+		if self._last_snapshot is None:
+			stats = snapshot.statistics("lineno")
+		else:
+			stats = snapshot.compare_to(self._last_snapshot, "lineno")
+		self._last_snapshot = snapshot
+		current, peak = tracemalloc.get_traced_memory()
+		lines = [f"snapshot: after {phase}: traced {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB, top allocation sites of phase:"]
+		lines += [f"	{stat}" for stat in stats[:self.top_n]]
+		if self._logger:
+			self._logger.info("\n".join(lines))
+		else:
+			print("\n".join(lines))
+	
+	
+	def stop(self):
+		tracemalloc.stop()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+
+__author__ = "Igor Martynov (phx.planewalker@gmail.com)"
+
+
+
+"""Registry of test types and reporter types. Each type name (value of "type" option of config section) is mapped to
+"module:Class", and module is imported only when section of that type is found in config.
+
+Besides built-in types, plugins are registered from:
+	- entry points of installed packages, groups simple_reporter.tests and simple_reporter.reporters, e.g. in pyproject.toml:
+		[project.entry-points."simple_reporter.tests"]
+		my_check = "my_package.checks:MyCheckTest"
+	- .py files in plugin_dirs (option of main section). File is not imported to find its types, it is parsed,
+		and types are taken from dict literals SIMPLE_REPORTER_TESTS and SIMPLE_REPORTER_REPORTERS (type name -> class name):
+		SIMPLE_REPORTER_TESTS = {"my_check": "MyCheckTest"}
+Test class is created as cls(config = config, logger = logger, name = section), reporter class as cls(config = config, logger = logger, section = section).
+"""
+
+
+import os
+import sys
+import ast
+import importlib
+try:
+	import importlib.metadata
+	HAS_ENTRY_POINTS = True
+except ImportError:
+	# python < 3.8, plugins can be loaded only from plugin_dirs
+	HAS_ENTRY_POINTS = False
+
+# logging
+import logging
+import logging.handlers
+
+import traceback
+
+
+
+BUILTIN_TESTS = {
+	"df": "tests:DFTest",
+	"ifconfig": "tests:IfconfigTest",
+	"uptime": "tests:UptimeTest",
+	"dmesg": "tests:DmesgTest",
+	"zfs_zpool_status": "tests:ZFSZPoolStatusTest",
+	"zfs_zpool_list": "tests:ZFSZPoolListTest",
+	"smartctl": "tests:SmartctlTest",
+	"ping": "tests:PingTest",
+	"traceroute": "tests:TracerouteTest",
+	"df-trivial": "tests:DFTrivialTest",
+	"downtime": "tests:DowntimeTest",
+	"file_content": "tests:FileContentTest",
+	"datetime": "tests:DatetimeTest",
+	"ps": "tests:PSTest",
+	"service": "tests:ServiceTest",
+	"ifconfigme": "tests:IfconfigMeTest",
+	"endpoints": "tests:EndpointsTest",
+	"file_exist": "tests:FileExistTest",
+	"remote_fs": "tests:RemoteFSTest",
+	"du": "tests:DUTest",
+	}
+
+BUILTIN_REPORTERS = {
+	"reporter-email": "reporters:EmailReporter",
+	"reporter-file": "reporters:FileReporter",
+	"reporter-json": "reporters:JSONReporter",
+	"reporter-prometheus": "reporters:PrometheusReporter",
+	"reporter-push": "reporters:PushReporter",
+	}
+
+ENTRY_POINT_GROUPS = {"tests": "simple_reporter.tests", "reporters": "simple_reporter.reporters"}
+PLUGIN_DIR_VARIABLES = {"tests": "SIMPLE_REPORTER_TESTS", "reporters": "SIMPLE_REPORTER_REPORTERS"}
+
+
+
+class PluginRegistry(object):
+	"""maps type names to "module:Class" specs of tests and reporters, imports classes on first use"""
+	
+	def __init__(self, logger = None):
+		super(PluginRegistry, self).__init__()
+		self._logger = logger
+		self.specs = {"tests": dict(BUILTIN_TESTS), "reporters": dict(BUILTIN_REPORTERS)} # kind -> type name -> "module:Class"
+		self._classes = {} # "module:Class" -> class
+		self._plugin_paths = [] # plugin dirs, added to sys.path only when class from them is imported
+	
+	
+	def register(self, kind, name, spec):
+		if name in self.specs[kind] and self.specs[kind][name] != spec:
+			self._logger.info(f"register: {kind} type {name} is now {spec}, was {self.specs[kind][name]}")
+		self.specs[kind][name] = spec
+	
+	
+	def discover_entry_points(self):
+		if not HAS_ENTRY_POINTS:
+			self._logger.info("discover_entry_points: importlib.metadata is not available (python < 3.8), entry points are not loaded")
+			return
+		for kind, group in ENTRY_POINT_GROUPS.items():
+			try:
+				entry_points = importlib.metadata.entry_points(group = group)
+			except TypeError:
+				# python < 3.10
+				entry_points = importlib.metadata.entry_points().get(group, [])
+			for ep in entry_points:
+				self.register(kind, ep.name, ep.value)
+				self._logger.debug(f"discover_entry_points: {kind} type {ep.name} -> {ep.value}")
+	
+	
+	def discover_plugin_dir(self, plugin_dir):
+		"""find types in .py files of plugin_dir without importing them"""
+		if not os.path.isdir(plugin_dir):
+			self._logger.error(f"discover_plugin_dir: {plugin_dir} is not a dir, ignoring it")
+			return
+		for file_name in sorted(os.listdir(plugin_dir)):
+			if not file_name.endswith(".py") or file_name.startswith("_"):
+				continue
+			module_name = file_name[:-3]
+			try:
+				with open(os.path.join(plugin_dir, file_name), "r") as f:
+					tree = ast.parse(f.read(), filename = file_name)
+			except (OSError, SyntaxError) as e:
+				self._logger.error(f"discover_plugin_dir: could not parse plugin {file_name}: {e}")
+				continue
+			for node in tree.body:
+				if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+					continue
+				for kind, variable in PLUGIN_DIR_VARIABLES.items():
+					if node.targets[0].id != variable:
+						continue
+					try:
+						types = ast.literal_eval(node.value)
+					except ValueError as e:
+						self._logger.error(f"discover_plugin_dir: {variable} in {file_name} should be dict literal: {e}")
+						continue
+					for name, class_name in types.items():
+						self.register(kind, name, f"{module_name}:{class_name}")
+						self._logger.debug(f"discover_plugin_dir: {kind} type {name} -> {module_name}:{class_name}")
+		if plugin_dir not in self._plugin_paths:
+			self._plugin_paths.append(plugin_dir)
+	
+	
+	def has(self, kind, name):
+		return name in self.specs[kind]
+	
+	
+	def get(self, kind, name):
+		"""class of type name, imported now if it was not yet. Raises ImportError or AttributeError if it could not be imported"""
+		spec = self.specs[kind][name]
+		if spec not in self._classes:
+			module_name, class_name = spec.split(":", 1)
+			for path in self._plugin_paths:
+				if path not in sys.path:
+					sys.path.append(path)
+			module = importlib.import_module(module_name)
+			self._classes[spec] = getattr(module, class_name)
+			self._logger.debug(f"get: imported {spec} for {kind} type {name}")
+		return self._classes[spec]
@@ -16,9 +16,15 @@ import os.path
 import os
 import datetime
 import time
-# import glob
+import glob
 import configparser
 import socket
+import json
+import threading
+import http.server
+import gzip
+import tempfile
+import urllib.request
 
 # logging
 import logging
@@ -28,8 +34,6 @@ import traceback
 
 from jinja2 import Template, Environment, FileSystemLoader, select_autoescape, BaseLoader
 
-import telegram
-
 
 from tests import *
 from base_functions import *
@@ -38,21 +42,55 @@ from base_functions import *
 class BaseReporter(object):
 	"""BaseReporter - as any Reporter, this class is intended to send (or do anything similar) report"""
 	
-	def __init__(self, config = None, logger = None):
+	def __init__(self, config = None, logger = None, section = None):
 		super(BaseReporter, self).__init__()
 		self._config = config
 		self._logger = logger
 		self.type = "reporter-base"
+		self.section = section # config section of this reporter, if None - first enabled section of its type is used
+		self.timeout_s = 60 # SimpleReporter waits that much for send_report
+		self.STREAMING = False # True if reporter can write report chunk by chunk with send_report_stream
+		self.STRUCTURED = False # True if reporter gets test objects with send_tests instead of report text
+	
+	
+	@property
+	def name(self):
+		return self.section if self.section is not None else self.type
+	
+	
+	def _is_own_section(self, section):
+		return self.section is None or section == self.section
+	
+	
+	def _load_common_options(self, section):
+		if self._config.has_option(section, "timeout_s"):
+			self.timeout_s = self._config.getfloat(section, "timeout_s")
 	
 	
 	def load_config(self):
 		raise NotImplemented
 	
 	
-	def send_report(self, report):
+	def send_report(self, report, attachments = []):
+		"""send report text. attachments is list of (filename, text) with full outputs of sections truncated in report"""
 		raise NotImplemented
 	
 	
+	def send_report_stream(self, chunks, attachments = []):
+		"""send report given as iterable of text chunks. Reporters which need full text get it joined once"""
+		return self.send_report("".join(chunks), attachments)
+	
+	
+	def send_tests(self, tests):
+		"""send results of tests (only for STRUCTURED reporters)"""
+		raise NotImplemented
+	
+	
+	def close(self):
+		"""release resources (connections, files) held between reports"""
+		pass
+	
+	
 
 class EmailReporter(send_mail3, BaseReporter):
 	"""Send report via email.
@@ -61,6 +99,7 @@ class EmailReporter(send_mail3, BaseReporter):
 	
 	def __init__(self, config = None,
 		logger = None,
+		section = None,
 		sender = "",
 		to = [],
 		subject = "",
@@ -71,9 +110,14 @@ class EmailReporter(send_mail3, BaseReporter):
 			subject = subject,
 			message = message,
 			logger = logger)
-		BaseReporter.__init__(self, logger = logger, config = config)
+		BaseReporter.__init__(self, logger = logger, config = config, section = section)
 		self.RECIPIENT_DIVIDER = ","
 		self.type = "reporter-email"
+		self.use_outbox = True
+		self.outbox_dir = os.path.join(get_state_dir(self._config), "outbox")
+		self.outbox_max_age_s = 7 * 86400
+		self.outbox_backoff_s = 300
+		self.outbox_max_backoff_s = 6 * 3600
 		self.load_config()
 	
 	
@@ -83,11 +127,12 @@ class EmailReporter(send_mail3, BaseReporter):
 			if "type" not in self._config.options(section):
 				self._logger.debug(f"load_config: no option 'type' in section {section}")
 				continue
-			if self._config.get(section, "type") == self.type:
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
 				if self._config.get(section, "enabled") != "True":
 					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
 					continue
 				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
 				try:
 					self.sender = self._config.get(section, "sender")
 					self.smtp_passwd = self._config.get(section, "smtp_password")
@@ -98,28 +143,118 @@ class EmailReporter(send_mail3, BaseReporter):
 					self.USE_AUTH = True if self._config.get(section, "use_auth") == "True" else False
 					self.USE_TLS = True if self._config.get(section, "use_tls") == "True" else False
 					self.subject = Environment(loader = BaseLoader).from_string(self._config.get(section, "email_subject")).render(hostname = socket.getfqdn())
+					if self._config.has_option(section, "smtp_timeout_s"):
+						self.SMTP_TIMEOUT = self._config.getint(section, "smtp_timeout_s")
+					if self._config.has_option(section, "outbox"):
+						self.use_outbox = self._config.get(section, "outbox") == "True"
+					if self._config.has_option(section, "outbox_dir"):
+						self.outbox_dir = self._config.get(section, "outbox_dir")
+					if self._config.has_option(section, "outbox_max_age_s"):
+						self.outbox_max_age_s = self._config.getint(section, "outbox_max_age_s")
+					if self._config.has_option(section, "outbox_backoff_s"):
+						self.outbox_backoff_s = self._config.getint(section, "outbox_backoff_s")
+					# new message may take connect + reconnect, then one outbox message: each can wait SMTP_TIMEOUT
+					if self.timeout_s < 3 * self.SMTP_TIMEOUT:
+						self._logger.info(f"load_config: timeout_s {self.timeout_s} is less than 3 * smtp_timeout_s, using {3 * self.SMTP_TIMEOUT}")
+						self.timeout_s = 3 * self.SMTP_TIMEOUT
 					self._logger.info("load_config: config load complete, ending section parsing")
 				except Exception as e:
 					self._logger.error(f"load_config: got error while parsing section, error: {e}, traceback: {traceback.format_exc()}")
 				break
 	
 	
-	def send_report(self, report):
+	def _spool_message(self):
+		"""save composed message to outbox, it will be sent by flush_outbox on next runs"""
+		os.makedirs(self.outbox_dir, exist_ok = True)
+		message_id = f"{time.time_ns()}_{os.getpid()}"
+		with open(os.path.join(self.outbox_dir, message_id + ".eml"), "wb") as f:
+			f.write(self.message_bytes)
+		save_json_state(os.path.join(self.outbox_dir, message_id + ".json"),
+			{"created": time.time(), "attempts": 0, "next_attempt": 0, "sender": self.sender, "to": self.recipient_list})
+		self._logger.info(f"_spool_message: message saved to outbox as {message_id}")
+		return message_id
+	
+	
+	def _unspool_message(self, message_id):
+		for ext in (".eml", ".json"):
+			os.unlink(os.path.join(self.outbox_dir, message_id + ext))
+	
+	
+	def flush_outbox(self):
+		"""send messages from outbox over current session, with backoff, drop messages older than outbox_max_age_s.
+		Stops on first error, as relay is probably still down. Returns number of sent messages"""
+		if not os.path.isdir(self.outbox_dir):
+			return 0
+		sent = 0
+		now = time.time()
+		for meta_file in sorted(glob.glob(os.path.join(self.outbox_dir, "*.json"))):
+			eml_file = meta_file[:-len(".json")] + ".eml"
+			meta = load_json_state(meta_file)
+			if meta is None or not os.path.isfile(eml_file):
+				continue
+			if now - meta["created"] > self.outbox_max_age_s:
+				self._logger.error(f"flush_outbox: message {eml_file} is older than {self.outbox_max_age_s}s, dropping it")
+				os.unlink(eml_file)
+				os.unlink(meta_file)
+				continue
+			if meta["next_attempt"] > now:
+				continue
+			try:
+				with open(eml_file, "rb") as f:
+					self.send_raw(meta["sender"], meta["to"], f.read())
+			except Exception as e:
+				meta["attempts"] += 1
+				meta["next_attempt"] = now + min(self.outbox_backoff_s * 2 ** (meta["attempts"] - 1), self.outbox_max_backoff_s)
+				save_json_state(meta_file, meta)
+				self._logger.error(f"flush_outbox: could not send {eml_file} (attempt {meta['attempts']}): {e}")
+				self.close_session()
+				break
+			os.unlink(eml_file)
+			os.unlink(meta_file)
+			sent += 1
+		if sent != 0:
+			self._logger.info(f"flush_outbox: sent {sent} messages from outbox")
+		return sent
+	
+	
+	def send_report(self, report, attachments = []):
 		self._logger.debug("send_report: starting")
 		self.message_text = report
+		self.attachment_texts = attachments
 		self.compose()
-		self.send()
+		if not self.use_outbox:
+			return self.send()
+		# message is spooled before network is touched, so it is kept even if this thread is abandoned on timeout
+		message_id = self._spool_message()
+		sent_ok = self.send()
+		if sent_ok:
+			self._unspool_message(message_id)
+			# relay is up, send older messages too
+			self.flush_outbox()
+		else:
+			# message stays in outbox, its first attempt is done
+			meta_file = os.path.join(self.outbox_dir, message_id + ".json")
+			meta = load_json_state(meta_file)
+			meta["attempts"] = 1
+			meta["next_attempt"] = time.time() + self.outbox_backoff_s
+			save_json_state(meta_file, meta)
 		self._logger.debug("send_report: complete")
+		return sent_ok
+	
+	
+	def close(self):
+		self.close_session()
 		
 
 
 class FileReporter(BaseReporter):
 	"""save report to text file"""
-	def __init__(self, config = None, logger = None):
-		super(FileReporter, self).__init__(logger = logger, config = config)
+	def __init__(self, config = None, logger = None, section = None):
+		super(FileReporter, self).__init__(logger = logger, config = config, section = section)
 		
 		self.filename = "report.txt"
 		self.type = "reporter-file"
+		self.STREAMING = True
 		self.load_config()
 	
 	
@@ -129,30 +264,283 @@ class FileReporter(BaseReporter):
 			if "type" not in self._config.options(section):
 				self._logger.debug(f"load_config: no option 'type' in section {section}")
 				continue
-			if self._config.get(section, "type") == self.type:
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
+				if self._config.get(section, "enabled") != "True":
+					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
+					continue
+				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
+				try:
+					self.filename = self._config.get(section, "filename")
+				except Exception as e:
+					self._logger.error(f"load_config: got error while parsing section, error: {e}, traceback: {traceback.format_exc()}")
+				break
+	
+	
+	def send_report(self, report, attachments = []):
+		return self.send_report_stream([report], attachments)
+	
+	
+	def _open_temp(self, filename, mode):
+		"""temp file in dir of filename, so it can be moved over filename with os.replace"""
+		return tempfile.NamedTemporaryFile(mode = mode, dir = os.path.dirname(os.path.abspath(filename)), prefix = f".{os.path.basename(filename)}.", suffix = ".tmp", delete = False)
+	
+	
+	def _replace(self, temp_filename, filename):
+		"""move temp file over filename, keeping mode of old file (temp files are created with 0600)"""
+		os.chmod(temp_filename, os.stat(filename).st_mode & 0o7777 if os.path.isfile(filename) else 0o644)
+		os.replace(temp_filename, filename)
+	
+	
+	def send_report_stream(self, chunks, attachments = []):
+		"""report is written to temp file, which replaces old report only when stream is complete,
+		so report stream which was cut off does not leave truncated report"""
+		with self._open_temp(self.filename, "w") as f:
+			try:
+				for chunk in chunks:
+					f.write(chunk)
+			except BaseException:
+				f.close()
+				os.unlink(f.name)
+				raise
+		self._replace(f.name, self.filename)
+		for filename, text in attachments:
+			with self._open_temp(f"{self.filename}.{filename}.gz", "wb") as f:
+				f.write(gzip_text(text))
+			self._replace(f.name, f"{self.filename}.{filename}.gz")
+		self._logger.debug(f"send_report: report written to file {self.filename}, {len(attachments)} attachments")
+	
+
+
+class JSONReporter(BaseReporter):
+	"""write results of tests as NDJSON: one JSON record per test per run, for ingestion by other tools.
+	filename = - writes to stdout, otherwise records are appended to file, which is rotated when it grows over max_bytes"""
+	def __init__(self, config = None, logger = None, section = None):
+		super(JSONReporter, self).__init__(logger = logger, config = config, section = section)
+		self.type = "reporter-json"
+		self.STRUCTURED = True
+		self.filename = "report.ndjson"
+		self.max_bytes = 10 * 1024 * 1024
+		self.backup_count = 5
+		# one encoder for all records, compact separators, anything not serializable (datetime) as str
+		self._encoder = json.JSONEncoder(default = str, ensure_ascii = False, separators = (",", ":"))
+		self.load_config()
+	
+	
+	def load_config(self):
+		for section in self._config.sections():
+			if "type" not in self._config.options(section):
+				self._logger.debug(f"load_config: no option 'type' in section {section}")
+				continue
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
 				if self._config.get(section, "enabled") != "True":
 					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
 					continue
 				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
 				try:
 					self.filename = self._config.get(section, "filename")
+					if self._config.has_option(section, "max_bytes"):
+						self.max_bytes = self._config.getint(section, "max_bytes")
+					if self._config.has_option(section, "backup_count"):
+						self.backup_count = self._config.getint(section, "backup_count")
 				except Exception as e:
 					self._logger.error(f"load_config: got error while parsing section, error: {e}, traceback: {traceback.format_exc()}")
 				break
 	
 	
-	def send_report(self, report):
-		with open(self.filename, "w") as f:
-			f.write(report)
-		self._logger.debug(f"send_report: report written to file {self.filename}")
+	def send_tests(self, tests):
+		if tests is None or len(tests) == 0:
+			self._logger.debug("send_tests: no tests, nothing to write")
+			return True
+		run_info = {"host": get_hostname(), "run": datetime.datetime.now().isoformat(timespec = "seconds")}
+		encode = self._encoder.encode
+		text = "".join([encode(dict(t.as_record(), **run_info)) + "\n" for t in tests])
+		if self.filename == "-":
+			sys.stdout.write(text)
+			sys.stdout.flush()
+		else:
+			data = text.encode("utf-8")
+			if self.max_bytes > 0 and os.path.isfile(self.filename) and os.path.getsize(self.filename) + len(data) > self.max_bytes:
+				rotate_file(self.filename, self.backup_count)
+				self._logger.info(f"send_tests: file {self.filename} rotated")
+			with open(self.filename, "ab") as f:
+				f.write(data)
+		self._logger.debug(f"send_tests: {len(tests)} records, {len(text)} chars written to {self.filename}")
+		return True
+	
+
+
+class PushReporter(BaseReporter):
+	"""push results of tests to fleet collector (simple_reporter.py --collector) over HTTP.
+	Payload is one gzip-compressed JSON document per run: host, run date and records of all tests"""
+	def __init__(self, config = None, logger = None, section = None):
+		super(PushReporter, self).__init__(logger = logger, config = config, section = section)
+		self.type = "reporter-push"
+		self.STRUCTURED = True
+		self.url = None
+		self.token = None
+		self.timeout_s = 30
+		self._encoder = json.JSONEncoder(default = str, ensure_ascii = False, separators = (",", ":"))
+		self.load_config()
+	
+	
+	def load_config(self):
+		for section in self._config.sections():
+			if "type" not in self._config.options(section):
+				self._logger.debug(f"load_config: no option 'type' in section {section}")
+				continue
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
+				if self._config.get(section, "enabled") != "True":
+					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
+					continue
+				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
+				try:
+					self.url = self._config.get(section, "url")
+					if self._config.has_option(section, "token"):
+						self.token = self._config.get(section, "token")
+				except Exception as e:
+					self._logger.error(f"load_config: got error while parsing section, error: {e}, traceback: {traceback.format_exc()}")
+				break
+	
+	
+	def send_tests(self, tests):
+		if tests is None or len(tests) == 0:
+			self._logger.debug("send_tests: no tests, nothing to push")
+			return True
+		payload = {"host": get_hostname(), "run": datetime.datetime.now().isoformat(timespec = "seconds"), "tests": [t.as_record() for t in tests]}
+		body = gzip.compress(self._encoder.encode(payload).encode("utf-8"))
+		headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+		if self.token is not None:
+			headers["X-Simple-Reporter-Token"] = self.token
+		request = urllib.request.Request(self.url, data = body, headers = headers, method = "POST")
+		with urllib.request.urlopen(request, timeout = self.timeout_s) as response:
+			self._logger.debug(f"send_tests: pushed {len(tests)} records, {len(body)} bytes to {self.url}, got status {response.status}")
+			return 200 <= response.status < 300
+	
+
+
+class MetricsHTTPHandler(http.server.BaseHTTPRequestHandler):
+	"""serves metrics_text of server on /metrics"""
+	
+	def do_GET(self):
+		if self.path.split("?")[0] not in ("/", "/metrics"):
+			self.send_error(404)
+			return
+		body = self.server.metrics_text.encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+	
+	
+	def log_message(self, format, *args):
+		# requests are not logged, scraping is too frequent for that
+		pass
+
+
+
+class PrometheusReporter(BaseReporter):
+	"""export results of tests as Prometheus metrics: per-test gauges (failed, ignored, duration, last success)
+	and numeric values of tests (metrics of test result snapshots).
+	textfile - file to write metrics to atomically, for node_exporter textfile collector
+	listen - host:port of built-in HTTP endpoint /metrics, for long-running mode (--serve)"""
+	def __init__(self, config = None, logger = None, section = None):
+		super(PrometheusReporter, self).__init__(logger = logger, config = config, section = section)
+		self.type = "reporter-prometheus"
+		self.STRUCTURED = True
+		self.textfile = None
+		self.listen = None
+		self.metrics_text = ""
+		self._server = None
+		self._state_file = os.path.join(get_state_dir(self._config), "prometheus_state.json")
+		self.load_config()
+	
+	
+	def load_config(self):
+		for section in self._config.sections():
+			if "type" not in self._config.options(section):
+				self._logger.debug(f"load_config: no option 'type' in section {section}")
+				continue
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
+				if self._config.get(section, "enabled") != "True":
+					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
+					continue
+				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
+				try:
+					if self._config.has_option(section, "textfile"):
+						self.textfile = self._config.get(section, "textfile")
+					if self._config.has_option(section, "listen"):
+						self.listen = self._config.get(section, "listen")
+				except Exception as e:
+					self._logger.error(f"load_config: got error while parsing section, error: {e}, traceback: {traceback.format_exc()}")
+				break
+	
+	
+	def build_metrics(self, tests):
+		"""walk tests once, adding their samples to metric families, return text of all metrics"""
+		state = load_json_state(self._state_file, {"last_success": {}})
+		now = time.time()
+		metrics = MetricFamilies(prefix = "simple_reporter_")
+		for t in [t.snapshot for t in tests]:
+			labels = {"test": t.name, "type": t.type}
+			if not t.failed and not t.ignored:
+				state["last_success"][t.name] = now
+			metrics.add("test_failed", bool(t.failed), labels, "1 if test failed")
+			metrics.add("test_ignored", t.ignored, labels, "1 if test was ignored (not applicable on this host)")
+			if t.date_start is not None and t.date_end is not None:
+				metrics.add("test_duration_seconds", (t.date_end - t.date_start).total_seconds(), labels, "duration of test run")
+			metrics.add("test_last_success_timestamp_seconds", state["last_success"].get(t.name), labels, "time of last run when test did not fail")
+			for name, help_text, metric_labels, value in t.metrics:
+				metrics.add(name, value, dict({"test": t.name}, **metric_labels), help_text)
+		metrics.add("last_run_timestamp_seconds", now, None, "time of last run of tests")
+		save_json_state(self._state_file, state)
+		return metrics.render()
+	
+	
+	def start_server(self):
+		host, port = self.listen.rsplit(":", 1)
+		self._server = http.server.ThreadingHTTPServer((host, int(port)), MetricsHTTPHandler)
+		self._server.daemon_threads = True
+		self._server.metrics_text = self.metrics_text
+		threading.Thread(target = self._server.serve_forever, daemon = True).start()
+		self._logger.info(f"start_server: serving metrics on http://{self.listen}/metrics")
+	
+	
+	def send_tests(self, tests):
+		if tests is None or len(tests) == 0:
+			self._logger.debug("send_tests: no tests, nothing to export")
+			return True
+		self.metrics_text = self.build_metrics(tests)
+		if self.textfile is not None:
+			tmp_file = f"{self.textfile}.tmp.{os.getpid()}"
+			with open(tmp_file, "w") as f:
+				f.write(self.metrics_text)
+			os.replace(tmp_file, self.textfile)
+		if self.listen is not None:
+			if self._server is None:
+				self.start_server()
+			self._server.metrics_text = self.metrics_text
+		self._logger.debug(f"send_tests: exported {len(self.metrics_text)} chars of metrics of {len(tests)} tests")
+		return True
+	
+	
+	def close(self):
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
 	
 
 
 # TODO: currently not supported - under construction
 class TelegramReporter(BaseReporter):
 	"""send report via Telegram"""
-	def __init__(self, config = None, logger = None, sender = "", to = []):
-		super(TelegramReporter, self).__init__(logger = logger, config = config)
+	def __init__(self, config = None, logger = None, section = None, sender = "", to = []):
+		super(TelegramReporter, self).__init__(logger = logger, config = config, section = section)
 		self.type = "reporter-telegram"
 		
 		self.RECIPIENT_DIVIDER = ","
@@ -168,11 +556,12 @@ class TelegramReporter(BaseReporter):
 			if "type" not in self._config.options(section):
 				self._logger.debug(f"load_config: no option 'type' in section {section}")
 				continue
-			if self._config.get(section, "type") == self.type:
+			if self._config.get(section, "type") == self.type and self._is_own_section(section):
 				if self._config.get(section, "enabled") != "True":
 					self._logger.info(f"load_config: found section {section}, but it is disabled, ignoring")
 					continue
 				self._logger.debug(f"load_config: will use section {section}")
+				self._load_common_options(section)
 				try:
 					
 					# self.sender = self._config.get(section, "sender")
@@ -188,13 +577,14 @@ class TelegramReporter(BaseReporter):
 	
 	def init_bot(self):
 		if self.__bot is None:
+			import telegram # optional dependency, needed only by this reporter
 			self.__bot = telegram.Bot(token = self._bot_token)
 			self._logger.debug("init_bot: bot inited")
 		else:
 			self._logger.error(f"init_bot: bot already inied as {self.__bot}")
 			
 	
-	def send_report(self, report):
+	def send_report(self, report, attachments = []):
 		self.__bot.sendMessage(chat_id = self._chat_id, text = report)
 
 
@@ -18,32 +18,37 @@ import os.path
 import os
 import datetime
 import time
+import re
 import configparser
 import socket
 import logging
 import logging.handlers
+import threading
+import queue
 
 import traceback
+import atexit
 
 from jinja2 import Template, Environment, FileSystemLoader, select_autoescape, BaseLoader
 
-from reporters import *
-from tests import *
 from base_functions import *
+from registry import PluginRegistry
+from collector import FleetCollector
+from capture import CaptureRecorder, CaptureReplayer
 
 
 
 class TestLoader(object):
 	"""loads all tests from config, creates representing Test objects"""
 	
-	def __init__(self, logger = None, config = None):
+	def __init__(self, logger = None, config = None, registry = None):
 		super(TestLoader, self).__init__()
 		self._logger = logger
 		self._config = config
+		self._registry = registry # PluginRegistry, states which test type is handled by which class
 		self.tests = []
-		self.tests_table = {} # dict which states which test type is handled by which class
 		self.REQUIRE_ENABLED = False # True if section will be loaded only if enabled = True
-		self.init_tests_table()
+		self.REQUIRE_ALERT = False # True if section will be loaded only if alert = True (for alert runs)
 	
 	
 	def add_test(self, test_obj):
@@ -51,53 +56,40 @@ class TestLoader(object):
 		self._logger.debug(f"add_test: added test {test_obj} ({test_obj.descr})")
 	
 	
-	def init_tests_table(self):
-		# currently, new test should be added to self.tests_table with its type as key
-		self.tests_table = {}
-		self.tests_table["df"] = DFTest
-		self.tests_table["ifconfig"] = IfconfigTest
-		self.tests_table["uptime"] = UptimeTest
-		self.tests_table["dmesg"] = DmesgTest
-		self.tests_table["zfs_zpool_status"] = ZFSZPoolStatusTest
-		self.tests_table["zfs_zpool_list"] = ZFSZPoolListTest
-		self.tests_table["smartctl"] = SmartctlTest
-		self.tests_table["ping"] = PingTest
-		self.tests_table["traceroute"] = TracerouteTest
-		self.tests_table["df-trivial"] = DFTrivialTest
-		self.tests_table["downtime"] = DowntimeTest
-		self.tests_table["file_content"] = FileContentTest
-		self.tests_table["datetime"] = DatetimeTest
-		self.tests_table["ps"] = PSTest
-		self.tests_table["service"] = ServiceTest
-		self.tests_table["ifconfigme"] = IfconfigMeTest
-		self.tests_table["file_exist"] = FileExistTest
-		self.tests_table["remote_fs"] = RemoteFSTest
-		self.tests_table["du"] = DUTest
-		self._logger.debug(f"init_tests_table: inited with {len(self.tests_table.keys())} test types")
-	
-	
 	def parse_config_section(self, section):
 		self._logger.debug(f"parse_config_section: parsing section {section}")
 		if self.REQUIRE_ENABLED and not (self._config.get(section, "enabled") == "True"):
 			self._logger.info(f"parse_config_section: section {section} is disabled, ignoring")
 			return
+		if self.REQUIRE_ALERT and not (self._config.has_option(section, "alert") and self._config.get(section, "alert") == "True"):
+			self._logger.debug(f"parse_config_section: section {section} is not used for alerts, ignoring")
+			return
 		_type = self._config.get(section, "type")
 		_name = section # this is redundand, but still persist
-		if _type in self.tests_table.keys():
+		if self._registry.has("tests", _type):
 			self.create_test(_type, section, _name)
 			self._logger.debug(f"parse_config_section: section {section} parsed, test {_name} created")
+		elif self._registry.has("reporters", _type) or _type in ("profile", "collector"):
+			self._logger.debug(f"parse_config_section: section {section} is not a test, ignoring")
 		else:
-			self._logger.error(f"parse_config_section: could not find type {_type} in tests_table, ignoring section")
+			self._logger.error(f"parse_config_section: could not find test type {_type} in registry, ignoring section")
 			return
 	
 	
 	def create_test(self, _type, section, _name):
 		self._logger.debug(f"create_test: will create test for type {_type}, section: {section}")
-		cls = self.tests_table[_type]
-		# new_test = cls(logger = self._logger.getChild(self._config.get(section, "type") + "_" + section),
-		new_test = cls(logger = self._logger.getChild(self._config.get(section, "type") + "_" + section),
-			config = self._config,
-			name = _name)
+		try:
+			cls = self._registry.get("tests", _type)
+		except Exception as e:
+			self._logger.error(f"create_test: could not import test type {_type} for section {section}: {e}, traceback: {traceback.format_exc()}")
+			return
+		try:
+			new_test = cls(logger = self._logger.getChild(self._config.get(section, "type") + "_" + section),
+				config = self._config,
+				name = _name)
+		except Exception as e:
+			self._logger.error(f"create_test: could not create test {_type} from section {section}: {e}, traceback: {traceback.format_exc()}")
+			return
 		self.add_test(new_test)
 	
 	
@@ -112,6 +104,41 @@ class TestLoader(object):
 		
 
 
+class ReportProfile(object):
+	"""named report profile: which tests are shown, with which template, and which reporters send it.
+	Configured by section with type = profile. All profiles are rendered from the same test results"""
+	
+	def __init__(self, name = "default", template = "main.jinja2", section_filter = "all", reporter_names = None):
+		super(ReportProfile, self).__init__()
+		self.name = name
+		self.template = template
+		self.section_filter = section_filter # all, failed, brief or tag:tag1,tag2
+		self.reporter_names = reporter_names # names of reporter sections, None - all reporters
+	
+	
+	@property
+	def brief_only(self):
+		return self.section_filter == "brief"
+	
+	
+	def select_tests(self, tests):
+		if self.section_filter == "failed":
+			return [t for t in tests if t.failed]
+		if self.section_filter.startswith("tag:"):
+			tags = [tag.strip() for tag in self.section_filter[len("tag:"):].split(",")]
+			return [t for t in tests if len(set(tags) & set(t.tags)) != 0]
+		return tests
+	
+	
+	def select_reporters(self, reporters):
+		return [r for r in reporters if self.reporter_names is None or r.name in self.reporter_names]
+	
+	
+	def __repr__(self):
+		return f"<ReportProfile {self.name}: {self.section_filter}, {self.template}, reporters: {self.reporter_names}>"
+
+
+
 class SimpleReporter(object):
 	""""""
 	
@@ -139,32 +166,73 @@ class SimpleReporter(object):
 		
 		self.TEMPLATE_FILE = "main.jinja2"
 		self._template = None
+		self._template_env = None
+		self.profiles = [] # list of ReportProfile, if none configured - one default profile is used
 		self.report_text = ""
+		self.max_body_bytes = None # size budget of report, shared by sections
+		self.capture = None # CaptureRecorder or CaptureReplayer, set by --record / --replay
+		self.timings = PhaseTimings() # durations of global phases: config, templates, tests, render, reporters
+		self.report_timings = False # add timings section to report
+		self.timings_top_n = 10 # that many slowest test phases are shown in report and log
+		self.malloc_tracer = None # profiling.MallocTracer, set by --trace-malloc
+		self.registry = None # PluginRegistry of test and reporter types
+		self._busy_reporters = {} # reporter -> its thread, which was still running after timeout_s
+		self.min_section_bytes = 2048 # each section keeps at least that much of budget
+		self.attachments = [] # list of (filename, text) of full outputs of truncated sections
+		self.report_mode = "full" # full or delta - only changed, new and failed sections are shown in full
+		self.suppress_unchanged_report = False # in delta mode, do not send report at all if nothing changed
+		self._pending_delta_state = None # (state file, hashes) of delta mode, saved only after report is sent
+		self.alert_reporters = None # names of reporters used for alerts, None - all reporters
+		self.alert_coalesce_s = 300 # alerts are sent at most once per this period, transitions in between are coalesced
+		self.alert_max_pending = 100 # if alerts could not be sent, only this many latest transitions are kept
+		self.alert_pending_max_age_s = 86400 # transitions which could not be sent for this long are dropped
+		self.serve_interval_s = 60 # in long-running mode (--serve), tests are run that often
+		self.log_level = logging.DEBUG
+		self.log_rotation = "size" # size - rotated by simple_reporter, external - reopened when moved by logrotate or newsyslog
+		self.log_max_bytes = 10 * 1024 * 1024 # log file is rotated when it grows over this size
+		self.log_backup_count = 5
+		self.log_max_message_chars = 8192 # longer log messages are cut in the middle, 0 - no limit
+		self._invalid_log_level = None # log_level from config which is not a logging level, logged once logger is ready
+		self._log_handler = None
+		self._log_listener = None
 		if self.verbose: print(f"Using config file {self.CONFIG_FILE}")
-		self.rotate_logs()
-
-	
-	def rotate_logs(self):
-		"""will rotate .log file to .log.old, thus new log file will be used on each start"""
-		OLD_LOG_POSTFIX = ".old"
-		if os.path.isfile(self.LOG_FILE + OLD_LOG_POSTFIX):
-			os.unlink(self.LOG_FILE + OLD_LOG_POSTFIX)
-		try:
-			os.rename(self.LOG_FILE, self.LOG_FILE + OLD_LOG_POSTFIX)
-		except Exception as e:
-			if self.verbose: print(f"could not rotate log file {self.LOG_FILE}, will use unrotated file!")
+		# registered first, so it runs last of atexit handlers, after everything that logs on exit
+		atexit.register(self.close_logger)
 	
 	
 	def init_logger(self):
+		"""log records are put to queue and written to log file by listener thread, so logging does not block tests.
+		Rotation by size is safe only if one process writes log file, with external rotation file is reopened when it is moved"""
+		self.close_logger()
 		self._logger = logging.getLogger("simple_reporter")
-		self._logger.setLevel(logging.DEBUG)
-		fh = logging.FileHandler(self.LOG_FILE)
-		fh.setLevel(logging.DEBUG)
+		self._logger.setLevel(self.log_level)
+		if self.log_rotation == "external":
+			fh = logging.handlers.WatchedFileHandler(self.LOG_FILE)
+		else:
+			fh = logging.handlers.RotatingFileHandler(self.LOG_FILE, maxBytes = self.log_max_bytes, backupCount = self.log_backup_count)
 		formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 		fh.setFormatter(formatter)
-		self._logger.addHandler(fh)
+		log_queue = queue.Queue()
+		self._log_handler = TruncatingQueueHandler(log_queue, self.log_max_message_chars)
+		self._log_listener = logging.handlers.QueueListener(log_queue, fh)
+		self._log_listener.start()
+		self._logger.addHandler(self._log_handler)
 		self._logger.debug("======== simple_reporter starting, version " + __version__ + " ========")
 		self._logger.info(f"using config {self.CONFIG_FILE}")
+		if self._invalid_log_level is not None:
+			self._logger.error(f"init_logger: unknown log_level {self._invalid_log_level} in config, using {logging.getLevelName(self.log_level)}")
+	
+	
+	def close_logger(self):
+		"""write queued log records and close log file"""
+		if self._log_listener is None:
+			return
+		self._logger.removeHandler(self._log_handler)
+		self._log_listener.stop()
+		for handler in self._log_listener.handlers:
+			handler.close()
+		self._log_handler = None
+		self._log_listener = None
 	
 	
 	def _load_config_section_main(self):
@@ -177,7 +245,57 @@ class SimpleReporter(object):
 			if self.verbose: print(f"Using absolute path to log file: {self.LOG_FILE}")
 		if self._config.has_option("main", "brief_section_enabled") and self._config.get("main", "brief_section_enabled") == "yes":
 			pass
+		if self._config.has_option("main", "report_mode"):
+			self.report_mode = self._config.get("main", "report_mode")
+		if self._config.has_option("main", "suppress_unchanged_report"):
+			self.suppress_unchanged_report = self._config.get("main", "suppress_unchanged_report") == "True"
+		if self._config.has_option("main", "alert_reporters"):
+			self.alert_reporters = [r.strip() for r in self._config.get("main", "alert_reporters").split(",")]
+		if self._config.has_option("main", "alert_coalesce_s"):
+			self.alert_coalesce_s = self._config.getint("main", "alert_coalesce_s")
+		if self._config.has_option("main", "alert_max_pending"):
+			self.alert_max_pending = self._config.getint("main", "alert_max_pending")
+		if self._config.has_option("main", "alert_pending_max_age_s"):
+			self.alert_pending_max_age_s = self._config.getint("main", "alert_pending_max_age_s")
+		if self._config.has_option("main", "serve_interval_s"):
+			self.serve_interval_s = self._config.getint("main", "serve_interval_s")
+		if self._config.has_option("main", "max_body_bytes"):
+			self.max_body_bytes = self._config.getint("main", "max_body_bytes")
+		if self._config.has_option("main", "min_section_bytes"):
+			self.min_section_bytes = self._config.getint("main", "min_section_bytes")
+		if self._config.has_option("main", "report_timings"):
+			self.report_timings = self._config.get("main", "report_timings") == "True"
+		if self._config.has_option("main", "timings_top_n"):
+			self.timings_top_n = self._config.getint("main", "timings_top_n")
+		if self._config.has_option("main", "log_level"):
+			log_level = self._config.get("main", "log_level").upper()
+			if isinstance(logging.getLevelName(log_level), int):
+				self.log_level = log_level
+			else:
+				self._invalid_log_level = log_level
+				self.log_level = logging.INFO
+				if self.verbose: print(f"unknown log_level {log_level} in config, using INFO")
+		if self._config.has_option("main", "log_rotation"):
+			self.log_rotation = self._config.get("main", "log_rotation")
+		if self._config.has_option("main", "log_max_bytes"):
+			self.log_max_bytes = self._config.getint("main", "log_max_bytes")
+		if self._config.has_option("main", "log_backup_count"):
+			self.log_backup_count = self._config.getint("main", "log_backup_count")
+		if self._config.has_option("main", "log_max_message_chars"):
+			self.log_max_message_chars = self._config.getint("main", "log_max_message_chars")
 		self.init_logger()
+		self.init_registry()
+	
+	
+	def init_registry(self):
+		"""built-in test and reporter types, plus plugins from entry points and plugin_dirs"""
+		self.registry = PluginRegistry(logger = self._logger.getChild("PluginRegistry"))
+		if not self._config.has_option("main", "plugin_entry_points") or self._config.get("main", "plugin_entry_points") == "True":
+			self.registry.discover_entry_points()
+		if self._config.has_option("main", "plugin_dirs"):
+			for plugin_dir in self._config.get("main", "plugin_dirs").split(","):
+				self.registry.discover_plugin_dir(plugin_dir.strip())
+		self._logger.debug(f"init_registry: {len(self.registry.specs['tests'])} test types, {len(self.registry.specs['reporters'])} reporter types")
 	
 	
 	def _load_config_section_other(self):
@@ -186,58 +304,80 @@ class SimpleReporter(object):
 		for section in sections:
 			if section == "main": # this section should be already persed above
 				continue
-			# reporter-email
-			if self._config.get(section, "type") == "reporter-email" and self._config.get(section, "enabled") == "True":
-				self._logger.debug(f"_load_config_section_other: got section for reporter-email: {section}")
-				self.reporters.append(EmailReporter(config = self._config, logger = self._logger.getChild("EmailReporter")))
-			# reporter-file
-			if self._config.get(section, "type") == "reporter-file" and self._config.get(section, "enabled") == "True":
-				self._logger.debug(f"_load_config_section_other: got section for reporter-file: {section}")
-				self.reporters.append(FileReporter(config = self._config, logger = self._logger.getChild("FileReporter")))
+			_type = self._config.get(section, "type") if self._config.has_option(section, "type") else None
+			if self.registry.has("reporters", _type) and self._config.get(section, "enabled") == "True":
+				self._logger.debug(f"_load_config_section_other: got section for {_type}: {section}")
+				try:
+					cls = self.registry.get("reporters", _type)
+				except Exception as e:
+					self._logger.error(f"_load_config_section_other: could not import reporter {_type} for section {section}: {e}, traceback: {traceback.format_exc()}")
+					continue
+				self.reporters.append(cls(config = self._config, logger = self._logger.getChild(cls.__name__), section = section))
+			# report profile
+			if self._config.get(section, "type") == "profile" and self._config.get(section, "enabled") == "True":
+				self._logger.debug(f"_load_config_section_other: got section for profile: {section}")
+				self.profiles.append(ReportProfile(name = section,
+					template = self._config.get(section, "template") if self._config.has_option(section, "template") else self.TEMPLATE_FILE,
+					section_filter = self._config.get(section, "filter") if self._config.has_option(section, "filter") else "all",
+					reporter_names = [r.strip() for r in self._config.get(section, "reporters").split(",")] if self._config.has_option(section, "reporters") else None))
 	
 	
 	def load_config(self):
 		self._config.read(self.CONFIG_FILE)
 		self._load_config_section_main()
+		if self.capture is not None:
+			# replay overrides state_dir, so it is started before reporters are created, but after logger
+			self.capture._logger = self._logger.getChild(type(self.capture).__name__)
+			self.capture.start(self._config)
 		self._load_config_section_other()
 		self._logger.debug(f"load_config: complete, file {self.CONFIG_FILE} loaded")
 		if self.verbose: print("config loaded")
 	
 	
-	def init_test_loader(self):
-		self._test_loader = TestLoader(logger = self._logger.getChild("TestLoader"), config = self._config)
+	def init_test_loader(self, alert_only = False):
+		self._test_loader = TestLoader(logger = self._logger.getChild("TestLoader"), config = self._config, registry = self.registry)
+		self._test_loader.REQUIRE_ALERT = alert_only
 		
 	
 	def init_tests(self):
 		self._logger.debug("init_tests: starting")
 		self.tests = []
+		self._test_loader.tests = []
 		self._test_loader.load_all()
 		self.tests = self._test_loader.tests
 		self._logger.info(f"init_tests: complete, inited {len(self.tests)} tests")
 	
 	
 	def init_template(self):
-		env = Environment(loader = FileSystemLoader([os.path.join(os.path.abspath(os.path.dirname(__file__)), "templates"),]), autoescape = select_autoescape())
-		self._template = env.get_template(self.TEMPLATE_FILE)
+		self._template_env = Environment(loader = FileSystemLoader([os.path.join(os.path.abspath(os.path.dirname(__file__)), "templates"),]), autoescape = select_autoescape())
+		self._template = self._template_env.get_template(self.TEMPLATE_FILE)
+	
+	
+	def init_all(self, alert_only = False):
+		self.timings.timed("load config", self.load_config)
+		self.timings.timed("init templates", self.init_template)
+		self.init_test_loader(alert_only = alert_only)
+		self.timings.timed("init tests", self.init_tests)
+		self.snapshot_memory("init")
 	
 	
-	def init_all(self):
-		self.load_config()
-		self.init_template()
-		self.init_test_loader()
-		self.init_tests()
+	def snapshot_memory(self, phase):
+		if self.malloc_tracer is not None:
+			self.malloc_tracer._logger = self._logger.getChild("MallocTracer")
+			self.malloc_tracer.snapshot(phase)
 	
 	
 	def run_tests(self):
 		self._logger.info(f"run_tests: starting execution of tests - {len(self.tests)} in list")
 		for t in self.tests:
 			try:
-				t.run()
+				self.timings.timed("run tests", t.run)
 				if self.verbose: print(f"test {t.name} - type {t.TYPE} - complete")
 			except Exception as e:
 				self._logger.error(f"run_tests: got error while running test {t}: {e}, traceback: {traceback.format_exc()}")
 				if self.verbose: print(f"test {t.name} - type {t.TYPE} - ERROR - {e}")
 		self._logger.info("run_tests: complete")
+		self.snapshot_memory("run_tests")
 	
 	
 	def get_simple_stats(self):
@@ -253,19 +393,139 @@ class SimpleReporter(object):
 				self.tests_ignored.append(t)
 	
 	
-	def compile_report(self):
-		os_type_dict = detect_OS()
-		self.report_text = self._template.render(version = __version__,
+	def apply_report_mode(self):
+		"""in delta mode, compare hash of each test result with hashes from last report and set delta_status of tests.
+		New hashes are saved by send_reports, only if report was sent. Returns False if report should not be sent, as nothing changed"""
+		if self.report_mode != "delta":
+			return True
+		state_file = os.path.join(get_state_dir(self._config), "report_delta.json")
+		prev_state = load_json_state(state_file, {})
+		new_state = {}
+		now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		changed_count = 0
+		for t in self.tests:
+			result_hash = t.snapshot.hash
+			prev = prev_state.get(t.name)
+			if prev is None:
+				t.delta_status = "new"
+			elif prev["hash"] != result_hash:
+				t.delta_status = "changed"
+			else:
+				t.delta_status = "unchanged"
+			t.unchanged_since = prev["since"] if t.delta_status == "unchanged" else now_str
+			new_state[t.name] = {"hash": result_hash, "since": t.unchanged_since}
+			if t.delta_status != "unchanged" or t.failed:
+				changed_count += 1
+		self._pending_delta_state = (state_file, new_state)
+		self._logger.info(f"apply_report_mode: {changed_count} of {len(self.tests)} tests are changed, new or failed")
+		if changed_count == 0 and self.suppress_unchanged_report:
+			self._logger.info("apply_report_mode: nothing changed since last report, report suppressed")
+			if self.verbose: print("nothing changed since last report, report suppressed")
+			return False
+		return True
+	
+	
+	def apply_body_budget(self, tests = None, brief_only = False):
+		"""share max_body_bytes between sections: failed first, then by priority.
+		Sections which do not fit are truncated in report and attached in full"""
+		tests = self.tests if tests is None else tests
+		self.attachments = []
+		for t in self.tests:
+			t.report_limit_bytes = None
+			t.attachment_name = None
+		if self.max_body_bytes is None or self.max_body_bytes <= 0 or brief_only:
+			return
+		# header, brief section and section frames take some space too
+		fixed_size = 1024 + sum([len(t.snapshot.brief or "") + 200 for t in tests])
+		remaining = self.max_body_bytes - fixed_size
+		ordered = sorted([t for t in tests if not t.ignored], key = lambda t: (not t.failed, -t.priority))
+		sizes = [len(t.result.encode("utf-8")) for t in ordered]
+		for i, t in enumerate(ordered):
+			# keep room for minimal share of each next section
+			reserve = sum([min(size, self.min_section_bytes) for size in sizes[i + 1:]])
+			limit = max(self.min_section_bytes, remaining - reserve)
+			if sizes[i] <= limit:
+				remaining -= sizes[i]
+				continue
+			t.report_limit_bytes = limit
+			t.attachment_name = re.sub(r"[^A-Za-z0-9_.-]", "_", t.name) + ".txt"
+			self.attachments.append((t.attachment_name, t.result))
+			remaining -= limit
+			self._logger.info(f"apply_body_budget: section {t.name} ({sizes[i]} bytes) truncated to {limit} bytes, attached as {t.attachment_name}")
+	
+	
+	def generate_report(self, profile = None):
+		"""render report chunk by chunk with Jinja2 generate(), so full report text is never built.
+		profile selects template and tests, default is main template with all tests"""
+		template = self._template if profile is None else self._template_env.get_template(profile.template)
+		tests = self.tests if profile is None else profile.select_tests(self.tests)
+		brief_only = False if profile is None else profile.brief_only
+		self.apply_body_budget(tests = tests, brief_only = brief_only)
+		from tests import BaseTest
+		os_type_dict = BaseTest._os_type_dict
+		return template.generate(version = __version__,
 			host = get_hostname(),
 			datetime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-			tests = self.tests,
+			tests = tests,
+			brief_only = brief_only,
 			os_type_dict = os_type_dict,
-			config_file = self.CONFIG_FILE)
-		self._logger.debug("compile_report: complete")
+			config_file = self.CONFIG_FILE,
+			timings = list(self.timings.durations.items()) if self.report_timings else None,
+			slowest_timings = PhaseTimings.slowest(self.get_test_timings(), self.timings_top_n) if self.report_timings else None)
+	
+	
+	def get_test_timings(self):
+		"""durations of test phases as list of ("test phase", seconds)"""
+		return [(f"{t.name} {phase}", duration_s) for t in self.tests for phase, duration_s in t.timings.durations.items()]
+	
+	
+	def log_timings(self):
+		for phase, duration_s in self.timings.durations.items():
+			self._logger.info(f"log_timings: {phase}: {duration_s:.3f}s")
+		for name, duration_s in PhaseTimings.slowest(self.get_test_timings(), self.timings_top_n):
+			self._logger.info(f"log_timings: slowest test phase: {name}: {duration_s:.3f}s")
+	
+	
+	def compile_report(self, profile = None):
+		self.report_text = self.timings.timed("render", "".join, self.generate_report(profile = profile))
+		self._logger.debug(f"compile_report: complete, {len(self.report_text)} chars")
+	
+	
+	def send_reports(self, stream = True):
+		"""render and send report of every profile, from the same test results.
+		Returns dict profile name -> list of reporter summaries"""
+		profiles = self.profiles if len(self.profiles) != 0 else [ReportProfile(template = self.TEMPLATE_FILE)]
+		result_dict = {}
+		for profile in profiles:
+			if profile.section_filter != "all" and profile.section_filter != "brief" and len(profile.select_tests(self.tests)) == 0:
+				self._logger.info(f"send_reports: no tests selected for profile {profile.name}, skipping it")
+				continue
+			self._logger.info(f"send_reports: sending profile {profile}")
+			self.report_text = None
+			result_dict[profile.name] = self.send_report(stream = stream, reporters = profile.select_reporters(self.reporters), profile = profile, tests = profile.select_tests(self.tests))
+		self.save_delta_state(result_dict)
+		self.snapshot_memory("render")
+		self.log_timings()
+		return result_dict
+	
+	
+	def save_delta_state(self, result_dict):
+		"""save hashes of delta mode if any text reporter sent report, otherwise next run compares with last sent report again.
+		STRUCTURED reporters do not send report text, so they do not count"""
+		if self._pending_delta_state is None:
+			return
+		state_file, new_state = self._pending_delta_state
+		text_reporters = [r.name for r in self.reporters if not r.STRUCTURED]
+		if not any([summary["status"] == "ok" and summary["reporter"] in text_reporters for summaries in result_dict.values() for summary in summaries]):
+			self._logger.error(f"save_delta_state: report was not sent by any text reporter, {state_file} is not updated")
+			return
+		save_json_state(state_file, new_state)
+		self._pending_delta_state = None
 	
 	
 	def send_message(self, message):
 		self.report_text = f"\n{message}\n"
+		self.attachments = []
 		self.send_report()
 		
 	
@@ -274,13 +534,236 @@ class SimpleReporter(object):
 		self._logger.debug(f"add_test: added test {test_obj} ({test_obj.descr})")
 	
 	
-	def send_report(self):
-		self._logger.info(f"send_report: starting, will be used reporters: {self.reporters} ({len(self.reporters)} total)")
+	@staticmethod
+	def _read_chunks(chunks_queue, aborted):
+		"""chunks from queue until None. Raises if feeding was aborted, so reporter does not wait forever for the end of stream"""
+		while True:
+			try:
+				chunk = chunks_queue.get(timeout = 0.1)
+			except queue.Empty:
+				if aborted.is_set():
+					raise RuntimeError("report stream was aborted")
+				continue
+			if chunk is None:
+				return
+			yield chunk
+	
+	
+	def _run_reporter(self, reporter, report, attachments, summary, chunks_queue = None, tests = None, aborted = None):
+		"""runs in reporter thread, fills summary dict. If chunks_queue is set, reporter gets report as stream of chunks from it,
+		until aborted event is set. STRUCTURED reporters get tests instead of report"""
+		start = time.monotonic()
+		try:
+			if reporter.STRUCTURED:
+				result = reporter.send_tests(tests)
+			elif chunks_queue is not None:
+				result = reporter.send_report_stream(self._read_chunks(chunks_queue, aborted), attachments)
+			else:
+				result = reporter.send_report(report, attachments)
+			if result is False:
+				summary["status"] = "failed"
+				summary["error"] = "reporter could not send report"
+			else:
+				summary["status"] = "ok"
+		except Exception as e:
+			summary["status"] = "failed"
+			summary["error"] = str(e)
+			self._logger.error(f"_run_reporter: got error from reporter {reporter.name}: {e}, traceback: {traceback.format_exc()}")
+		summary["duration_s"] = time.monotonic() - start
+	
+	
+	def _feed_chunk(self, job, chunk):
+		"""put chunk to queue of streaming reporter, stop feeding and abort its stream if it died or missed its deadline"""
+		while job["alive"]:
+			if not job["thread"].is_alive() or time.monotonic() > job["deadline"]:
+				job["alive"] = False
+				job["aborted"].set()
+				self._logger.error(f"_feed_chunk: reporter {job['reporter'].name} stopped reading report stream")
+				return
+			try:
+				job["queue"].put(chunk, timeout = 0.1)
+				return
+			except queue.Full:
+				continue
+	
+	
+	def send_report(self, stream = False, reporters = None, profile = None, tests = None):
+		"""send report with all reporters concurrently, wait for each of them at most its timeout_s.
+		If stream is True and all reporters support streaming, report is rendered chunk by chunk straight into reporters,
+		otherwise it is rendered once into self.report_text.
+		reporters is list of reporters to use, default is all of them. profile is passed to generate_report.
+		tests are passed to STRUCTURED reporters, which do not use report text.
+		Reporter which still runs after its timeout in previous send_report is skipped with status busy.
+		Returns list of summary dicts: reporter, status (ok, failed, timeout or busy), duration_s, error"""
+		reporters = self.reporters if reporters is None else reporters
+		self._logger.info(f"send_report: starting, will be used reporters: {reporters} ({len(reporters)} total)")
 		if self.verbose: print("sending report...")
-		for reporter in self.reporters:
-			reporter.send_report(self.report_text)
+		summary_list = []
+		for reporter in list(reporters):
+			if reporter in self._busy_reporters and self._busy_reporters[reporter].is_alive():
+				summary_list.append({"reporter": reporter.name, "status": "busy", "duration_s": 0.0, "error": "still sending previous report"})
+				self._logger.error(f"send_report: reporter {reporter.name} is still sending previous report, skipping it")
+				reporters = [r for r in reporters if r is not reporter]
+			else:
+				self._busy_reporters.pop(reporter, None)
+		text_reporters = [r for r in reporters if not r.STRUCTURED]
+		chunks = None
+		if len(text_reporters) == 0:
+			pass
+		elif stream and all([r.STREAMING for r in text_reporters]):
+			chunks = self.generate_report(profile = profile)
+		elif stream:
+			self.compile_report(profile = profile)
+		start = time.monotonic()
+		jobs = []
+		for reporter in reporters:
+			job = {"reporter": reporter,
+				"summary": {"reporter": reporter.name, "status": "timeout", "duration_s": None, "error": ""},
+				"queue": queue.Queue(maxsize = 64) if chunks is not None and not reporter.STRUCTURED else None,
+				"deadline": start + reporter.timeout_s,
+				"alive": True,
+				"aborted": threading.Event()}
+			# daemon threads, so reporter which hangs after its timeout does not block exit
+			job["thread"] = threading.Thread(target = self._run_reporter, args = (reporter, self.report_text, self.attachments, job["summary"], job["queue"], tests, job["aborted"]), daemon = True)
+			job["thread"].start()
+			jobs.append(job)
+		if chunks is not None:
+			# streamed render includes waiting for slow reporters to take chunks
+			render_start = time.monotonic()
+			stream_jobs = [job for job in jobs if job["queue"] is not None]
+			try:
+				for chunk in chunks:
+					for job in stream_jobs:
+						self._feed_chunk(job, chunk)
+			except BaseException:
+				# render failed, reporters should drop partial report
+				for job in stream_jobs:
+					job["aborted"].set()
+				raise
+			for job in stream_jobs:
+				self._feed_chunk(job, None)
+			self.timings.add("render", time.monotonic() - render_start)
+		for job in jobs:
+			reporter = job["reporter"]
+			summary = job["summary"]
+			job["thread"].join(max(0, job["deadline"] - time.monotonic()))
+			if job["thread"].is_alive():
+				job["aborted"].set()
+				summary = {"reporter": reporter.name, "status": "timeout", "duration_s": reporter.timeout_s, "error": f"no result after {reporter.timeout_s}s"}
+				self._busy_reporters[reporter] = job["thread"]
+			summary_list.append(summary)
+			self.timings.add(f"send {reporter.name}", summary["duration_s"])
+			log = self._logger.info if summary["status"] == "ok" else self._logger.error
+			log(f"send_report: reporter {summary['reporter']}: {summary['status']}, {summary['duration_s']:.3f}s {summary['error']}")
+			if self.verbose: print(f"reporter {summary['reporter']} - {summary['status']} - {summary['duration_s']:.3f}s {summary['error']}")
 		self._logger.debug("send_report: complete")
-		if self.verbose: print("report sent OK")
+		if self.verbose: print(f"report sent, {len([s for s in summary_list if s['status'] == 'ok'])} of {len(summary_list)} reporters OK")
+		return summary_list
+	
+	
+	def _compose_alert(self, pending):
+		"""compose one alert message from pending transitions, flapping test is reported once"""
+		by_test = {}
+		for p in pending:
+			by_test.setdefault(p["test"], []).append(p)
+		failed_lines = []
+		ok_lines = []
+		for test_name, transitions in by_test.items():
+			last = transitions[-1]
+			flap_note = f" (flapped {len(transitions)} times since {transitions[0]['date']})" if len(transitions) > 1 else ""
+			if last["failed"]:
+				failed_lines.append(f"FAILED: {test_name} at {last['date']}{flap_note}: {last['error_text']}")
+			else:
+				ok_lines.append(f"OK: {test_name} at {last['date']}{flap_note}")
+		return "\n".join([f"ALERT from {get_hostname()}: {len(failed_lines)} tests failed, {len(ok_lines)} tests recovered", ""] + failed_lines + ok_lines)
+	
+	
+	def run_alerts(self):
+		"""compare failed state of tests with their last known state, send short alert on OK->failed and failed->OK transitions.
+		Transitions are coalesced: alert is sent at most once per alert_coalesce_s, later transitions wait for next run.
+		Transitions which could not be sent are kept at most alert_pending_max_age_s, and at most alert_max_pending of them"""
+		state_file = os.path.join(get_state_dir(self._config), "alert_state.json")
+		state = load_json_state(state_file, {"tests": {}, "pending": [], "last_alert": 0})
+		now = time.time()
+		now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+		for t in self.tests:
+			if t.ignored:
+				continue
+			failed = bool(t.failed)
+			# unknown previous state is treated as OK, so tests failing on first run are alerted too
+			if failed != state["tests"].get(t.name, False):
+				state["pending"].append({"test": t.name, "failed": failed, "date": now_str, "time": now, "error_text": t.error_text})
+				self._logger.info(f"run_alerts: test {t.name} changed state, failed: {failed}")
+			state["tests"][t.name] = failed
+		pending = [p for p in state["pending"] if now - p.get("time", now) < self.alert_pending_max_age_s]
+		pending = pending[-self.alert_max_pending:] if self.alert_max_pending > 0 else []
+		if len(pending) != len(state["pending"]):
+			self._logger.error(f"run_alerts: {len(state['pending']) - len(pending)} unsent transitions are too old or too many, dropped")
+			state["pending"] = pending
+		# STRUCTURED reporters do not send alert text, so they can not tell if alert was delivered
+		reporters = [r for r in self.reporters if not r.STRUCTURED and (self.alert_reporters is None or r.name in self.alert_reporters)]
+		if len(state["pending"]) != 0 and len(reporters) == 0:
+			self._logger.error(f"run_alerts: no text reporters for alerts, alert_reporters: {self.alert_reporters}, {len(state['pending'])} transitions are not sent")
+		elif len(state["pending"]) != 0 and now - state["last_alert"] >= self.alert_coalesce_s:
+			self.report_text = self._compose_alert(state["pending"])
+			self.attachments = []
+			summary_list = self.send_report(reporters = reporters)
+			if any([s["status"] == "ok" for s in summary_list]):
+				state["pending"] = []
+				state["last_alert"] = now
+		elif len(state["pending"]) != 0:
+			self._logger.info(f"run_alerts: {len(state['pending'])} transitions pending, alert was sent less than {self.alert_coalesce_s}s ago")
+		save_json_state(state_file, state)
+	
+	
+	def serve(self):
+		"""long-running mode: run tests every serve_interval_s and pass results to STRUCTURED reporters (metrics, json).
+		Tests are created anew for each run, text reports are not sent"""
+		reporters = [r for r in self.reporters if r.STRUCTURED]
+		self._logger.info(f"serve: starting, interval {self.serve_interval_s}s, reporters: {reporters}")
+		while True:
+			start = time.monotonic()
+			self.timings = PhaseTimings()
+			self.run_tests()
+			self.send_report(reporters = reporters, tests = self.tests)
+			time.sleep(max(0, self.serve_interval_s - (time.monotonic() - start)))
+			self.init_tests()
+	
+	
+	def run_collector(self):
+		"""collector mode: receive results pushed by other hosts, send fleet digest every digest_interval_s with text reporters"""
+		collector = FleetCollector(config = self._config, logger = self._logger.getChild("FleetCollector"))
+		reporters = [r for r in self.reporters if not r.STRUCTURED]
+		collector.start()
+		if self.verbose: print(f"collector listening on {collector.listen}, digest every {collector.digest_interval_s}s")
+		try:
+			while True:
+				time.sleep(collector.digest_interval_s)
+				digest = collector.compose_digest()
+				if digest is None:
+					self._logger.info("run_collector: no hosts reported yet, digest is not sent")
+					continue
+				self.report_text = digest
+				self.attachments = []
+				summary_list = self.send_report(reporters = reporters)
+				if any([s["status"] == "ok" for s in summary_list]):
+					collector.mark_digest_sent()
+				else:
+					self._logger.error("run_collector: digest was not sent, changes will be shown in next digest")
+		finally:
+			collector.stop()
+	
+	
+	def close_reporters(self):
+		for reporter in self.reporters:
+			if reporter in self._busy_reporters and self._busy_reporters[reporter].is_alive():
+				# its thread still uses session or file, closing them under it would lose the report
+				self._logger.error(f"close_reporters: reporter {reporter.name} is still sending after timeout, not closing it")
+				continue
+			try:
+				reporter.close()
+			except Exception as e:
+				self._logger.error(f"close_reporters: got error closing {reporter}: {e}, traceback: {traceback.format_exc()}")
 	
 	
 	def save_heartbeat(self):
@@ -323,6 +806,13 @@ if __name__ == "__main__":
 		print("""Usage:
 	--collect-only - only collect data and save state (if possible), do not report
 	-m, --message - send message only, do not collect
+	--alert - run only tests with alert = True, send short alert if their failed state changed since last run
+	--serve - long-running mode: run tests every serve_interval_s, export results with metrics and json reporters
+	--collector - fleet collector mode: receive results pushed by other hosts (reporter-push), send one fleet digest
+	--record DIR - save outputs of all commands and file reads of this run into capture bundle DIR
+	--replay DIR - run tests on outputs from capture bundle DIR instead of this host, print report, send nothing
+	--profile DIR - run under cProfile, save pstats and collapsed stacks (for flamegraph.pl) to DIR
+	--trace-malloc - log top memory allocation sites after init, after running tests and after render
 	-v, --verbose - be verbose
 	""")
 		sys.exit(0)
@@ -338,6 +828,13 @@ if __name__ == "__main__":
 		CONFIG_FILE = arguments[arguments.index("-c") + 1]
 	if "--config" in arguments:
 		CONFIG_FILE = arguments[arguments.index("--config") + 1]
+	ALERT = True if "--alert" in arguments else False
+	SERVE = True if "--serve" in arguments else False
+	COLLECTOR = True if "--collector" in arguments else False
+	RECORD_DIR = arguments[arguments.index("--record") + 1] if "--record" in arguments else None
+	REPLAY_DIR = arguments[arguments.index("--replay") + 1] if "--replay" in arguments else None
+	if REPLAY_DIR is not None and "-c" not in arguments and "--config" not in arguments:
+		CONFIG_FILE = os.path.join(REPLAY_DIR, "simple_reporter.conf")
 	message = None
 	if "-m" in arguments or "--message" in arguments:
 		if "--message" in arguments:
@@ -347,8 +844,36 @@ if __name__ == "__main__":
 		message = " ".join(arguments[pos + 1:])
 	
 		
+	PROFILE_DIR = arguments[arguments.index("--profile") + 1] if "--profile" in arguments else None
+	if PROFILE_DIR is not None:
+		from profiling import RunProfiler
+		profiler = RunProfiler(PROFILE_DIR)
+		profiler._logger = logging.getLogger("simple_reporter").getChild("RunProfiler")
+		profiler.start()
+	
 	sr = SimpleReporter(verbose = VERBOSE, config_file = CONFIG_FILE)
-	sr.init_all()
+	if PROFILE_DIR is not None:
+		# atexit runs handlers in reverse order, profiler.stop should log before SimpleReporter closes logger
+		atexit.register(profiler.stop)
+	if "--trace-malloc" in arguments:
+		from profiling import MallocTracer
+		sr.malloc_tracer = MallocTracer()
+		sr.malloc_tracer.start()
+	if RECORD_DIR is not None:
+		sr.capture = CaptureRecorder(RECORD_DIR)
+		atexit.register(sr.capture.save)
+	if REPLAY_DIR is not None:
+		sr.capture = CaptureReplayer(REPLAY_DIR)
+		atexit.register(sr.capture.save)
+	sr.init_all(alert_only = ALERT)
+	
+	
+	if REPLAY_DIR is not None:
+		sr.run_tests()
+		sr.apply_report_mode()
+		sr.compile_report()
+		print(sr.report_text)
+		sys.exit(0)
 	
 	
 	if COLLECT_ONLY:
@@ -357,13 +882,40 @@ if __name__ == "__main__":
 		sys.exit(0)
 	if message is not None:
 		sr.send_message(message)
+		sr.close_reporters()
+		sys.exit(0)
+	
+	
+	if COLLECTOR:
+		try:
+			sr.run_collector()
+		except KeyboardInterrupt:
+			pass
+		sr.close_reporters()
+		sys.exit(0)
+	
+	
+	if SERVE:
+		try:
+			sr.serve()
+		except KeyboardInterrupt:
+			pass
+		sr.close_reporters()
+		sys.exit(0)
+	
+	
+	if ALERT:
+		sr.run_tests()
+		sr.run_alerts()
+		sr.log_timings()
+		sr.close_reporters()
 		sys.exit(0)
 	
 	
 	sr.run_tests()
-	if not COLLECT_ONLY:
-		sr.compile_report()
-		sr.send_report()
+	if not COLLECT_ONLY and sr.apply_report_mode():
+		sr.send_reports(stream = True)
+		sr.close_reporters()
 	
 	pass
 
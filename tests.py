@@ -9,11 +9,14 @@ import os
 import datetime
 import time
 import glob
+import re
+import stat
 
 
 from jinja2 import Template, Environment, FileSystemLoader, select_autoescape
 
 from base_functions import *
+from probes import Probe, EndpointProber
 
 
 """Test classes here.
@@ -23,6 +26,45 @@ Each test checks something, and then generates report.
 
 
 
+class TestResult(object):
+	"""immutable snapshot of test result, made once run() of test is complete.
+	Templates and reporters read it, so report is rendered and brief is computed only once"""
+	
+	__slots__ = ("name", "type", "descr", "date_start", "date_end", "failed", "ignored", "error_text",
+		"result", "brief", "report", "hash", "tags", "timings", "data", "metrics")
+	
+	def __init__(self, **fields):
+		for slot in self.__slots__:
+			object.__setattr__(self, slot, fields.get(slot))
+	
+	
+	def __setattr__(self, name, value):
+		raise AttributeError(f"TestResult is immutable, could not set {name}")
+	
+	
+	def __repr__(self):
+		return f"<TestResult {self.name}: {'failed' if self.failed else 'ok'}>"
+	
+	
+	def as_record(self):
+		"""result as dict for machine-readable reporters"""
+		return {"name": self.name,
+			"type": self.type,
+			"descr": self.descr,
+			"date_start": self.date_start.isoformat() if self.date_start is not None else None,
+			"date_end": self.date_end.isoformat() if self.date_end is not None else None,
+			"duration_s": (self.date_end - self.date_start).total_seconds() if self.date_start is not None and self.date_end is not None else None,
+			"failed": bool(self.failed),
+			"ignored": self.ignored,
+			"error_text": self.error_text,
+			"brief": self.brief,
+			"hash": self.hash,
+			"tags": self.tags,
+			"timings": self.timings,
+			"data": self.data}
+
+
+
 class BaseTest(object):
 	"""Base class for tests
 	
@@ -51,10 +93,23 @@ class BaseTest(object):
 		self.result_brief = None
 		self.error_text = ""
 		self.ignored = False
+		self.priority = 0 # sections with higher priority get their share of report size budget first
+		self.report_limit_bytes = None # if set, result is truncated to that much in report
+		self.attachment_name = None # name of attachment with full result, if it was truncated
+		self.delta_status = None # in delta report mode: new, changed or unchanged
+		self.unchanged_since = None # in delta report mode: date of report when result was last changed
 		self.TEMPLATE_FILE = "base_template.jinja2"
 		self._template = None
 		self._logger = logger
 		self.init_template()
+		self.tags = [] # used by report profiles to select tests
+		self.timings = PhaseTimings() # durations of collect, parse and render phases
+		self._snapshot = None # TestResult, made when run() is complete
+		self._truncated_reports = {} # report_limit_bytes -> rendered report
+		if self._config is not None and self._config.has_option(self.name, "priority"):
+			self.priority = self._config.getint(self.name, "priority")
+		if self._config is not None and self._config.has_option(self.name, "tags"):
+			self.tags = [tag.strip() for tag in self._config.get(self.name, "tags").split(",")]
 	
 	
 	@property
@@ -77,18 +132,105 @@ class BaseTest(object):
 		return self.result_brief
 	
 	
+	@property
+	def result_data(self):
+		"""structured (JSON-serializable) result of test, for machine-readable reporters. None if test has no such data"""
+		return None
+	
+	
+	@property
+	def result_metrics(self):
+		"""numeric values of test for metrics exporters: list of (name, help, labels dict, value)"""
+		return []
+	
+	
+	def as_record(self):
+		"""result of test as dict for machine-readable reporters"""
+		return self.snapshot.as_record()
+	
+	
+	def finalize(self):
+		"""make immutable snapshot of result, brief, rendered report, data and metrics"""
+		try:
+			brief = self.report_brief
+		except Exception as e:
+			self._logger.error(f"finalize: could not get brief: {e}, traceback: {traceback.format_exc()}")
+			brief = None
+		try:
+			data = self.result_data
+			metrics = self.result_metrics
+		except Exception as e:
+			self._logger.error(f"finalize: could not get data and metrics: {e}, traceback: {traceback.format_exc()}")
+			data = None
+			metrics = []
+		self._truncated_reports = {}
+		report = self.timings.timed("render", self._render_report)
+		self._snapshot = TestResult(name = self.name,
+			type = self.TYPE,
+			descr = self.descr,
+			date_start = self.date_start,
+			date_end = self.date_end,
+			failed = self.failed,
+			ignored = self.ignored,
+			error_text = self.error_text,
+			result = self.result,
+			brief = brief,
+			report = report,
+			hash = self.result_hash,
+			tags = tuple(self.tags),
+			timings = dict(self.timings.durations),
+			data = data,
+			metrics = tuple(metrics))
+		return self._snapshot
+	
+	
+	@property
+	def snapshot(self):
+		"""TestResult of last run, made on first access if test was not run"""
+		if self._snapshot is None:
+			self.finalize()
+		return self._snapshot
+	
+	
+	@property
+	def normalized_result(self):
+		"""result without volatile parts, used to detect changes between reports in delta mode"""
+		return f"{self.failed}\n{self.error_text}\n{self.result}"
+	
+	
+	@property
+	def result_hash(self):
+		import hashlib
+		return hashlib.sha256(self.normalized_result.encode("utf-8")).hexdigest()
+	
+	
 	@property
 	def report(self):
-		report = self._template.render(name = self.name, descr = self.descr, report = self.result, error_text = self.error_text)
-		self._logger.debug(f"report: will return: {report}")
+		"""rendered report from snapshot. If report_limit_bytes is set, truncated report is rendered once for each limit"""
+		if self.report_limit_bytes is None:
+			return self.snapshot.report
+		if self.report_limit_bytes not in self._truncated_reports:
+			self._truncated_reports[self.report_limit_bytes] = self.timings.timed("render", self._render_report, self.report_limit_bytes)
+		return self._truncated_reports[self.report_limit_bytes]
+	
+	
+	def _render_report(self, limit_bytes = None):
+		result = self.result
+		if limit_bytes is not None:
+			result = truncate_text_to_bytes(result, limit_bytes) + f"\n[... truncated to {limit_bytes} bytes, full output attached as {self.attachment_name}.gz]"
+		report = self._template.render(name = self.name, descr = self.descr, report = result, error_text = self.error_text)
+		self._logger.debug(f"_render_report: rendered {len(report)} chars")
 		return report
 	
 	
 	def run(self):
 		self.mark_start()
-		self.collect()
-		self.parse()
-		self.mark_end()
+		try:
+			self.timings.timed("collect", self.collect)
+			self.timings.timed("parse", self.parse)
+		finally:
+			self.mark_end()
+			self.finalize()
 		# raise NotImplemented
 	
 	
@@ -102,6 +244,22 @@ class BaseTest(object):
 		pass
 	
 	
+	def _get_state_file(self):
+		return os.path.join(get_state_dir(self._config), f"{self.TYPE}_{self.name}.json")
+	
+	
+	def load_state(self):
+		"""load state saved by previous run of this test, empty dict if none"""
+		return load_json_state(self._get_state_file(), {})
+	
+	
+	def save_state(self, state):
+		try:
+			save_json_state(self._get_state_file(), state)
+		except Exception as e:
+			self._logger.error(f"save_state: could not save state: {e}, traceback: {traceback.format_exc()}")
+	
+	
 	def mark_start(self):
 		self.running = True
 		self.complete = False
@@ -169,6 +327,11 @@ class DFTrivialTest(BaseCMDTest):
 		self.descr = "disk free test (trivial)"
 		self.CMD_TO_RUN = "df"
 		self.TYPE = "df-trivial"
+	
+	
+	@property
+	def normalized_result(self):
+		return f"{self.failed}\n{self.error_text}\n{normalize_df_output(self.result)}"
 
 
 
@@ -182,6 +345,11 @@ class DFTest(BaseCMDTest):
 		self.descr = "disk free test using df command"
 		self.CMD_TO_RUN = "df"
 		self.TYPE = "df"
+	
+	
+	@property
+	def normalized_result(self):
+		return f"{self.failed}\n{self.error_text}\n{normalize_df_output(self.result)}"
 
 
 
@@ -200,6 +368,17 @@ class UptimeTest(BaseCMDTest):
 	def report_brief(self):
 		result_brief = self.raw_cmd_result.replace("\n", "")
 		return f"Uptime: {result_brief}"
+	
+	
+	@property
+	def normalized_result(self):
+		# uptime changes every time, but boot time only changes on reboot
+		boot_time = get_boot_time(self._os_type_dict["os_family"])
+		if boot_time is None:
+			# boot time computed from uptime drifts, so it is rounded down to 10 minutes
+			boot_time = datetime.datetime.now() - parse_uptime(self.raw_cmd_result)
+			boot_time = boot_time.replace(second = 0, microsecond = 0, minute = boot_time.minute // 10 * 10)
+		return f"{self.failed}\nboot at {boot_time}"
 
 
 
@@ -223,6 +402,11 @@ class DatetimeTest(BaseTest):
 	def parse(self):
 		# nothing to parse here
 		pass
+	
+	
+	@property
+	def normalized_result(self):
+		return ""
 
 
 
@@ -275,6 +459,13 @@ class IfconfigTest(BaseCMDTest):
 		result_brief = "\n".join(result_brief_list)
 		return result_brief if result_brief != "" else None
 	
+	
+	@property
+	def normalized_result(self):
+		# RX/TX packet and byte counters change every run
+		lines = [l for l in self.result.splitlines() if not l.strip().startswith(("RX ", "TX ", "collisions"))]
+		return f"{self.failed}\n{self.error_text}\n" + "\n".join(lines)
+	
 
 
 class DmesgTest(BaseCMDTest):
@@ -298,6 +489,12 @@ class DmesgTest(BaseCMDTest):
 			self._logger.error(f"parse: got except {e}, traceback: {traceback.format_exc()}")
 	
 	
+	@property
+	def normalized_result(self):
+		# [12345.678901] timestamps of Linux dmesg
+		return f"{self.failed}\n{self.error_text}\n" + re.sub(r"^\[\s*\d+\.\d+\]\s*", "", self.result, flags = re.MULTILINE)
+	
+	
 	def init_from_conf_dict(self):
 		try:
 			self.num_lines = self._config.getint(self.name, "last_lines")
@@ -307,54 +504,162 @@ class DmesgTest(BaseCMDTest):
 
 
 class ZFSZPoolStatusTest(BaseCMDTest):
-	"""ZFSZPoolStatusTest"""
+	"""ZFSZPoolStatusTest - check pool and vdev health, error counters and scrub age using zpool status -p.
+	Runs on any OS where zpool command exists"""
 	def __init__(self, config = None, logger = None, name = "zfs_zpool_status"):
 		super(ZFSZPoolStatusTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "zpool status"
-		self.CMD_TO_RUN = "zpool status"
+		self.CMD_TO_RUN = "zpool status -p"
 		self.TYPE = "zfs_zpool_status"
+		self.max_scrub_age_days = None
+		self.pools = {}
+		self.init_from_conf_dict()
 	
 	
-	def parse(self):
-		if "state: DEGRADED" in self.raw_cmd_result:
-			self.error_text += "ONE OR MORE POOL DEGRADED!"
-			self.failed = True
-		if "state: UNAVAIL" in self.raw_cmd_result:
-			self.error_text += "ONE OR MORE POOL UNAVAILABLE!"
-			self.failed = True
-		if "state: FAULTED" in self.raw_cmd_result:
-			if "state: UNAVAIL" in self.raw_cmd_result:
-				self.error_text += "ONE OR MORE POOL HAS FAILED!"
-				self.failed = True
-		super(ZFSZPoolStatusTest, self).parse()	
-		
+	def init_from_conf_dict(self):
+		if self._config.has_option(self.name, "max_scrub_age_days"):
+			self.max_scrub_age_days = self._config.getint(self.name, "max_scrub_age_days")
 	
-	def run(self):
-		if self._os_type_dict["os_family"] != "FreeBSD":
-			self._logger.info(f"run: unsupported OS detected: {self._os_type_dict['os_family']}, returning None")
+	
+	def collect(self):
+		if find_executable("zpool") is None:
+			self._logger.info("collect: zpool command not found, test ignored")
 			self.ignored = True
 			return
-		self.raw_cmd_result = self.run_cmd()
-		self.parse()
+		super(ZFSZPoolStatusTest, self).collect()
+	
+	
+	def _check_pool(self, pool_name, pool):
+		problems = []
+		if pool["state"] in ("DEGRADED", "UNAVAIL", "FAULTED", "SUSPENDED"):
+			problems.append(f"pool {pool_name} is {pool['state']}")
+		for vdev in pool["vdevs"]:
+			# DEGRADED pool and mirror/raidz vdevs are consequence of their children, which are reported themselves
+			if vdev["state"] not in ("ONLINE", "AVAIL", "INUSE", "DEGRADED"):
+				problems.append(f"vdev {vdev['name']} of {pool_name} is {vdev['state']}")
+			if vdev["read"] + vdev["write"] + vdev["cksum"] != 0:
+				problems.append(f"vdev {vdev['name']} of {pool_name} has errors: read {vdev['read']}, write {vdev['write']}, cksum {vdev['cksum']}")
+		if pool["errors"] != "" and pool["errors"] != "No known data errors":
+			problems.append(f"pool {pool_name}: {pool['errors']}")
+		if self.max_scrub_age_days is not None and not pool["scrub_in_progress"]:
+			if pool["last_scrub"] is None:
+				problems.append(f"pool {pool_name} was never scrubbed")
+			elif datetime.datetime.now() - pool["last_scrub"] > datetime.timedelta(days = self.max_scrub_age_days):
+				problems.append(f"pool {pool_name} last scrubbed {pool['last_scrub']}, more than {self.max_scrub_age_days} days ago")
+		return problems
+	
+	
+	def parse(self):
+		if self.ignored:
+			return
+		self.pools = parse_zpool_status(self.raw_cmd_result)
+		problems = []
+		for pool_name, pool in self.pools.items():
+			problems += self._check_pool(pool_name, pool)
+		if len(problems) != 0:
+			self.failed = True
+			self.error_text += "ZFS PROBLEMS DETECTED: " + "; ".join(problems)
+			self._logger.info(f"parse: set failed = True because of problems: {problems}")
+			self.result_brief = f"ZFS: {len(problems)} problems: {'; '.join(problems)}"
+		else:
+			self.result_brief = f"ZFS: {len(self.pools)} pools, no problems"
+		super(ZFSZPoolStatusTest, self).parse()
+	
+	
+	@property
+	def result_data(self):
+		return {"pools": self.pools}
 
 
 
 class ZFSZPoolListTest(BaseCMDTest):
-	"""ZFSZPoolListTest - show output of command zpool list"""
+	"""ZFSZPoolListTest - show pool capacity and fragmentation (zpool list -Hp) and top-N datasets by usage (zfs list -Hp).
+	Runs on any OS where zpool command exists"""
 	def __init__(self, config = None, logger = None, name = "zfs_zpool_list"):
 		super(ZFSZPoolListTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "zpool list"
-		self.CMD_TO_RUN = "zpool list"
+		self.CMD_TO_RUN = "zpool list -Hp -o name,size,alloc,free,frag,cap,health"
+		self.ZFS_LIST_CMD = "zfs list -Hp -o name,used,avail,usedbydataset"
 		self.TYPE = "zfs_zpool_list"
-		
+		self.max_capacity_pct = 80
+		self.max_fragmentation_pct = None
+		self.top_n = 10
+		self.pools = []
+		self.datasets = []
+		self.raw_zfs_list_result = ""
+		self.init_from_conf_dict()
 	
-	def run(self):
-		if self._os_type_dict["os_family"] != "FreeBSD":
-			self._logger.info(f"run: unsupported OS detected: {self._os_type_dict['os_family']}, returning None")
+	
+	def init_from_conf_dict(self):
+		if self._config.has_option(self.name, "max_capacity_pct"):
+			self.max_capacity_pct = self._config.getint(self.name, "max_capacity_pct")
+		if self._config.has_option(self.name, "max_fragmentation_pct"):
+			self.max_fragmentation_pct = self._config.getint(self.name, "max_fragmentation_pct")
+		if self._config.has_option(self.name, "top_n"):
+			self.top_n = self._config.getint(self.name, "top_n")
+	
+	
+	def collect(self):
+		if find_executable("zpool") is None:
+			self._logger.info("collect: zpool command not found, test ignored")
 			self.ignored = True
 			return
-		self.raw_cmd_result = self.run_cmd()
-		self.parse()
+		super(ZFSZPoolListTest, self).collect()
+		if self.top_n > 0:
+			try:
+				self.raw_zfs_list_result = run_command(self.ZFS_LIST_CMD)
+			except Exception as e:
+				self._logger.error(f"collect: got error running {self.ZFS_LIST_CMD}: {e}, traceback: {traceback.format_exc()}")
+				self.error_text += str(e)
+	
+	
+	def parse(self):
+		if self.ignored:
+			return
+		def fmt(value, suffix = ""):
+			return "-" if value is None else f"{value}{suffix}"
+		
+		self.pools = parse_zpool_list(self.raw_cmd_result)
+		self.datasets = sorted([d for d in parse_zfs_list(self.raw_zfs_list_result) if d["used_by_dataset"] is not None], key = lambda d: d["used_by_dataset"], reverse = True)[:self.top_n]
+		problems = []
+		result_lines = [f"{'NAME':<20}{'SIZE':<8}{'ALLOC':<8}{'FREE':<8}{'FRAG':<6}{'CAP':<6}HEALTH"]
+		for p in self.pools:
+			if p["health"] != "ONLINE":
+				problems.append(f"pool {p['name']} is {p['health']}")
+			if p["cap_pct"] is not None and p["cap_pct"] > self.max_capacity_pct:
+				problems.append(f"pool {p['name']} capacity {p['cap_pct']}% > {self.max_capacity_pct}%")
+			if self.max_fragmentation_pct is not None and p["frag_pct"] is not None and p["frag_pct"] > self.max_fragmentation_pct:
+				problems.append(f"pool {p['name']} fragmentation {p['frag_pct']}% > {self.max_fragmentation_pct}%")
+			result_lines.append(f"{p['name']:<20}{humanify_bytes(p['size'] or 0):<8}{humanify_bytes(p['alloc'] or 0):<8}{humanify_bytes(p['free'] or 0):<8}{fmt(p['frag_pct'], '%'):<6}{fmt(p['cap_pct'], '%'):<6}{p['health']}")
+		if len(self.datasets) != 0:
+			result_lines.append(f"\ntop {self.top_n} datasets by own usage:")
+			for d in self.datasets:
+				result_lines.append(f"{humanify_bytes(d['used_by_dataset']):<8}{d['name']} (with children {humanify_bytes(d['used'] or 0)}, avail {humanify_bytes(d['avail'] or 0)})")
+		self.result = "\n".join(result_lines)
+		if len(problems) != 0:
+			self.failed = True
+			self.error_text += "; ".join(problems)
+			self._logger.info(f"parse: set failed = True because of problems: {problems}")
+		self.result_brief = "\n".join([f"ZFS pool {p['name']}: {fmt(p['cap_pct'], '%')} used, {p['health']}" for p in self.pools]) or None
+	
+	
+	@property
+	def result_data(self):
+		return {"pools": self.pools, "datasets": self.datasets}
+	
+	
+	@property
+	def result_metrics(self):
+		metrics = []
+		for p in self.pools:
+			labels = {"pool": p["name"]}
+			metrics.append(("zpool_size_bytes", "zpool size", labels, p["size"]))
+			metrics.append(("zpool_allocated_bytes", "zpool allocated space", labels, p["alloc"]))
+			metrics.append(("zpool_free_bytes", "zpool free space", labels, p["free"]))
+			metrics.append(("zpool_capacity_ratio", "zpool used capacity", labels, p["cap_pct"] / 100 if p["cap_pct"] is not None else None))
+			metrics.append(("zpool_fragmentation_ratio", "zpool fragmentation", labels, p["frag_pct"] / 100 if p["frag_pct"] is not None else None))
+			metrics.append(("zpool_online", "1 if zpool health is ONLINE", labels, p["health"] == "ONLINE"))
+		return metrics
 
 
 
@@ -385,59 +690,206 @@ class RemoteFSTest(BaseCMDTest):
 
 
 class SmartctlTest(BaseCMDTest):
-	"""SmartctlTest"""
+	"""SmartctlTest - check SMART health of all detected disks.
+	
+	Disks are queried in parallel with smartctl -j, JSON output is parsed into per-disk health, temperature,
+	reallocated/pending sectors and wear level, and checked against thresholds.
+	Full smartctl -a dumps are cached in state and refreshed only when health changes or full_dump_ttl_s expires.
+	"""
 	def __init__(self, config = None, logger = None, name = "smartctl"):
 		super(SmartctlTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "SMART info using smartctl command"
 		self.CMD_TO_RUN = "smartctl -a "
+		self.SCAN_CMD = "smartctl --scan-open"
+		self.JSON_CMD = "smartctl -j -H -A -i "
 		self.TYPE = "smartctl"
-		self.detected_disks = []
-		self.raw_cmd_result_list = []
+		self.detected_disks = [] # list of (device, device_type) tuples
+		self.disks = {} # device -> dict of parsed values
+		self.full_dumps = {} # device -> {"health", "date", "text"}
+		self.max_parallel = 8
+		self.cmd_timeout_s = 120
+		self.full_dump = True
+		self.full_dump_ttl_s = 86400
+		self.max_temperature = 60
+		self.max_reallocated_sectors = 0
+		self.max_pending_sectors = 0
+		self.max_wear_pct = 90
+		self.init_from_conf_dict()
+	
+	
+	def init_from_conf_dict(self):
+		try:
+			if self._config.has_option(self.name, "max_parallel"):
+				self.max_parallel = self._config.getint(self.name, "max_parallel")
+			if self._config.has_option(self.name, "cmd_timeout_s"):
+				self.cmd_timeout_s = self._config.getint(self.name, "cmd_timeout_s")
+			if self._config.has_option(self.name, "full_dump"):
+				self.full_dump = self._config.get(self.name, "full_dump") == "True"
+			if self._config.has_option(self.name, "full_dump_ttl_s"):
+				self.full_dump_ttl_s = self._config.getint(self.name, "full_dump_ttl_s")
+			if self._config.has_option(self.name, "max_temperature"):
+				self.max_temperature = self._config.getint(self.name, "max_temperature")
+			if self._config.has_option(self.name, "max_reallocated_sectors"):
+				self.max_reallocated_sectors = self._config.getint(self.name, "max_reallocated_sectors")
+			if self._config.has_option(self.name, "max_pending_sectors"):
+				self.max_pending_sectors = self._config.getint(self.name, "max_pending_sectors")
+			if self._config.has_option(self.name, "max_wear_pct"):
+				self.max_wear_pct = self._config.getint(self.name, "max_wear_pct")
+		except Exception as e:
+			self._logger.error(f"init_from_conf_dict: got error while initing from section: {e}, traceback: {traceback.format_exc()}")
+	
+	
+	def _detect_disks_sysfs(self):
+		"""fallback detection if smartctl --scan-open gives nothing"""
+		disk_tmp_list = []
+		if self._os_type_dict["os_family"] == "FreeBSD":
+			for d in glob.glob("/dev/*"):
+				if re.match(r"^/dev/(da|ada|nda|nvd)[0-9]+$", d):
+					disk_tmp_list.append((d, None))
+		elif os.path.isdir("/sys/block"):
+			for d in os.listdir("/sys/block"):
+				if re.match(r"^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|hd[a-z]+|nvme[0-9]+n[0-9]+)$", d):
+					disk_tmp_list.append((f"/dev/{d}", None))
+		return sorted(disk_tmp_list)
 	
 	
 	def _detect_disks(self):
 		self.detected_disks = []
-		if self._os_type_dict["os_family"] == "FreeBSD":
-			disk_tmp_list = glob.glob("/dev/da*") # currently only da* disks are searched
-			self._logger.debug(f"_detect_disks: got glob result: {disk_tmp_list}")
-			for d in disk_tmp_list:
-				if "p" not in d:
-					self.detected_disks.append(d)
-		elif self._os_type_dict["os_family"] == "RedHat" or self._os_type_dict["os_family"] == "Debian" or self._os_type_dict["os_family"] == "SuSE":
-			disk_tmp_list = glob.glob("/dev/sd*") + glob.glob("/dev/vd*")
-			self._logger.debug(f"_detect_disks: got glob result: {disk_tmp_list}")
-			for d in disk_tmp_list:
-				if not d[-1].isnumeric():
-					self.detected_disks.append(d)
+		try:
+			self.detected_disks = parse_smartctl_scan(run_command(self.SCAN_CMD, timeout = self.cmd_timeout_s))
+			self._logger.debug(f"_detect_disks: got scan result: {self.detected_disks}")
+		except Exception as e:
+			self._logger.error(f"_detect_disks: could not run {self.SCAN_CMD}: {e}, traceback: {traceback.format_exc()}")
+		if len(self.detected_disks) == 0:
+			self.detected_disks = self._detect_disks_sysfs()
+			self._logger.debug(f"_detect_disks: got fallback result: {self.detected_disks}")
 		self._logger.info(f"_detect_disks: detected disks: {self.detected_disks}.")
 		return self.detected_disks
 	
 	
+	def _get_device_args(self, disk):
+		device, device_type = disk
+		return f"-d {device_type} {device}" if device_type is not None else device
+	
+	
+	def _query_disk(self, disk):
+		"""runs in worker thread, returns dict of parsed values for disk"""
+		try:
+			res = run_command(self.JSON_CMD + self._get_device_args(disk), timeout = self.cmd_timeout_s)
+			self._logger.debug(f"_query_disk: for disk {disk[0]} got {len(res)} bytes")
+			return parse_smartctl_json(res)
+		except Exception as e:
+			self._logger.error(f"_query_disk: was running command for disk {disk[0]}, got error {e}, traceback is: {traceback.format_exc()}")
+			return {"error": str(e)}
+	
+	
+	def _get_full_dump(self, disk):
+		"""runs in worker thread, returns text of smartctl -a for disk"""
+		try:
+			return run_command(self.CMD_TO_RUN + self._get_device_args(disk), timeout = self.cmd_timeout_s)
+		except Exception as e:
+			self._logger.error(f"_get_full_dump: was running command for disk {disk[0]}, got error {e}, traceback is: {traceback.format_exc()}")
+			return f"could not get smartctl -a output: {e}"
+	
+	
 	def run_cmd(self):
-		self.raw_cmd_result_list = []
+		self.disks = dict(zip([d[0] for d in self.detected_disks], run_parallel(self._query_disk, self.detected_disks, self.max_parallel)))
+		if not self.full_dump:
+			return
+		# refresh full dumps only if health changed or dump is too old
+		now = time.time()
+		self.full_dumps = self.load_state().get("full_dumps", {})
+		stale_disks = []
 		for d in self.detected_disks:
-			try:
-				res = run_command(self.CMD_TO_RUN + d)
-				self._logger.debug(f"run_cmd: for disk {d} got result {res}")
-				self.raw_cmd_result_list.append(res)
-			except Exception as e:
-				self._logger.error(f"run_cmd: was running command for disk {d}, got error {e}, traceback is: {traceback.format_exc()}")
-		
-		
+			cached = self.full_dumps.get(d[0])
+			if cached is None or cached["health"] != self.disks[d[0]].get("health") or now - cached["date"] > self.full_dump_ttl_s:
+				stale_disks.append(d)
+		self._logger.debug(f"run_cmd: will refresh full dumps for disks: {[d[0] for d in stale_disks]}")
+		for d, text in zip(stale_disks, run_parallel(self._get_full_dump, stale_disks, self.max_parallel)):
+			self.full_dumps[d[0]] = {"health": self.disks[d[0]].get("health"), "date": now, "text": text}
+		self.full_dumps = {d[0]: self.full_dumps[d[0]] for d in self.detected_disks}
+		self.save_state({"full_dumps": self.full_dumps})
+	
+	
+	def _check_disk(self, values):
+		"""return list of problems of disk"""
+		problems = []
+		if "error" in values:
+			return [f"could not query disk: {values['error']}"]
+		if values["health"] == "FAILED":
+			problems.append("SMART health FAILED")
+		if values["temperature"] is not None and values["temperature"] > self.max_temperature:
+			problems.append(f"temperature {values['temperature']}C > {self.max_temperature}C")
+		if values["reallocated_sectors"] is not None and values["reallocated_sectors"] > self.max_reallocated_sectors:
+			problems.append(f"reallocated sectors {values['reallocated_sectors']} > {self.max_reallocated_sectors}")
+		if values["pending_sectors"] is not None and values["pending_sectors"] > self.max_pending_sectors:
+			problems.append(f"pending sectors {values['pending_sectors']} > {self.max_pending_sectors}")
+		if values["wear_pct"] is not None and values["wear_pct"] > self.max_wear_pct:
+			problems.append(f"wear level {values['wear_pct']}% > {self.max_wear_pct}%")
+		return problems
+	
+	
 	def parse(self):
-		for r in self.raw_cmd_result_list:
-			self.result += r + "\n\n"
+		def fmt(value, suffix = ""):
+			return "-" if value is None else f"{value}{suffix}"
+		
+		result_lines = [f"{'DEVICE':<16}{'HEALTH':<8}{'TEMP':<6}{'REALLOC':<9}{'PENDING':<9}{'WEAR':<6}MODEL"]
+		problem_lines = []
+		for device, values in self.disks.items():
+			for problem in self._check_disk(values):
+				problem_lines.append(f"{device}: {problem}")
+			if "error" in values:
+				result_lines.append(f"{device:<16}ERROR")
+				continue
+			result_lines.append(f"{device:<16}{fmt(values['health']):<8}{fmt(values['temperature'], 'C'):<6}{fmt(values['reallocated_sectors']):<9}{fmt(values['pending_sectors']):<9}{fmt(values['wear_pct'], '%'):<6}{fmt(values['model'])}")
+		if len(problem_lines) != 0:
+			self.failed = True
+			self.error_text += "SMART PROBLEMS DETECTED: " + "; ".join(problem_lines)
+			self._logger.info(f"parse: set failed = True because of problems: {problem_lines}")
+			self.result_brief = f"SMART: {len(self.disks)} disks, problems: {'; '.join(problem_lines)}"
+		else:
+			self.result_brief = f"SMART: {len(self.disks)} disks, no problems"
+		self.result = "\n".join(result_lines) + "\n"
+		for device, dump in self.full_dumps.items():
+			dump_date = datetime.datetime.fromtimestamp(dump["date"]).strftime("%Y-%m-%d %H:%M:%S")
+			self.result += f"\n\nsmartctl -a {device} (as of {dump_date}):\n{dump['text']}"
 	
 	
-	def run(self):
+	def collect(self):
 		self._detect_disks()
 		self.run_cmd()
-		self.parse()
+	
+	
+	@property
+	def result_data(self):
+		return {"disks": self.disks}
+	
+	
+	@property
+	def normalized_result(self):
+		# temperature and counters change all the time, only health of disks is compared
+		lines = [f"{device}: {values.get('health', values.get('error'))}" for device, values in sorted(self.disks.items())]
+		return f"{self.failed}\n" + "\n".join(lines)
+	
+	
+	@property
+	def result_metrics(self):
+		metrics = []
+		for device, values in self.disks.items():
+			labels = {"device": device}
+			if "error" in values:
+				continue
+			metrics.append(("smart_health_ok", "1 if SMART health is PASSED", labels, values["health"] == "PASSED" if values["health"] is not None else None))
+			metrics.append(("smart_temperature_celsius", "disk temperature", labels, values["temperature"]))
+			metrics.append(("smart_reallocated_sectors", "reallocated sectors count", labels, values["reallocated_sectors"]))
+			metrics.append(("smart_pending_sectors", "pending sectors count", labels, values["pending_sectors"]))
+			metrics.append(("smart_wear_ratio", "SSD wear level", labels, values["wear_pct"] / 100 if values["wear_pct"] is not None else None))
+		return metrics
 
 
 
 class PingTest(BaseCMDTest):
-	"""PingTest
+	"""PingTest - ping list of hosts concurrently, parse statistics and check thresholds
 	
 	possible errors:
 	From 10.70.255.252 icmp_seq=1 Destination Host Unreachable
@@ -449,35 +901,70 @@ class PingTest(BaseCMDTest):
 		self.descr = "ping test"
 		self.CMD_TO_RUN = "ping"
 		self.TYPE = "ping"
-		self.host = ""
+		self.hosts = []
 		self.count = 4
+		self.timeout_s = 10
+		self.max_parallel = 256
+		self.max_loss_pct = 0.0
+		self.max_rtt_ms = None
+		self.hosts_stats = {} # host -> dict of statistics, None if ping failed
+		self.hosts_output = {} # host -> raw ping output
+		self.init_from_conf_dict()
 	
 	
 	def init_from_conf_dict(self):
 		try:
-			self.host = self._config.get(self.name, "host")
-			self.count = self._config.getint(self.name, "count")
-			self.CMD_TO_RUN = f"ping -c {self.count} {self.host}"
+			if self._config.has_option(self.name, "hosts"):
+				self.hosts = [h.strip() for h in self._config.get(self.name, "hosts").replace("\n", ",").split(",") if h.strip() != ""]
+			else:
+				self.hosts = [self._config.get(self.name, "host")]
+			if self._config.has_option(self.name, "count"):
+				self.count = self._config.getint(self.name, "count")
+			if self._config.has_option(self.name, "timeout_s"):
+				self.timeout_s = self._config.getint(self.name, "timeout_s")
+			if self._config.has_option(self.name, "max_parallel"):
+				self.max_parallel = self._config.getint(self.name, "max_parallel")
+			if self._config.has_option(self.name, "max_loss_pct"):
+				self.max_loss_pct = self._config.getfloat(self.name, "max_loss_pct")
+			if self._config.has_option(self.name, "max_rtt_ms"):
+				self.max_rtt_ms = self._config.getfloat(self.name, "max_rtt_ms")
+			self.descr = f"ping {', '.join(self.hosts)}"
 		except Exception as e:
-			self._logger.error(f": got error: {e}, traceback: {traceback.format_exc()}")
+			self._logger.error(f"init_from_conf_dict: got error: {e}, traceback: {traceback.format_exc()}")
 	
 	
-	@property
-	def report_brief(self):
-		for l in self.raw_cmd_result.splitlines():
-			if " transmitted," in l:
-				result_brief = l.replace("\n", "")
-				return f"Ping {self.host}: {result_brief}"
-		return f"Ping {self.host}: {self.raw_cmd_result}"
-
+	def _get_cmd(self, host):
+		# both variants limit total run time of ping to timeout_s
+		if self._os_type_dict["os_family"] == "FreeBSD":
+			return f"ping -c {self.count} -t {self.timeout_s} {host}"
+		return f"ping -c {self.count} -w {self.timeout_s} {host}"
 	
-	def run(self):
-		self.init_from_conf_dict()
-		self.raw_cmd_result = self.run_cmd()
-		self.parse()
+	
+	def _ping_host(self, host):
+		"""runs in worker thread"""
+		try:
+			return run_command(self._get_cmd(host), timeout = self.timeout_s + 5)
+		except Exception as e:
+			self._logger.error(f"_ping_host: got error pinging {host}: {e}")
+			return f"ping: {host}: {e}"
+	
+	
+	def collect(self):
+		self.hosts_output = dict(zip(self.hosts, run_parallel(self._ping_host, self.hosts, self.max_parallel)))
+		self.raw_cmd_result = "\n".join(self.hosts_output.values())
+	
+	
+	def _check_host(self, stats):
+		if stats is None:
+			return "no reply statistics"
+		problems = []
+		if stats["loss_pct"] > self.max_loss_pct:
+			problems.append(f"loss {stats['loss_pct']}% > {self.max_loss_pct}%")
+		if self.max_rtt_ms is not None and stats["rtt_avg"] is not None and stats["rtt_avg"] > self.max_rtt_ms:
+			problems.append(f"avg rtt {stats['rtt_avg']}ms > {self.max_rtt_ms}ms")
+		return ", ".join(problems) if len(problems) != 0 else None
 	
 	
-	# TODO: uneder construction
 	def parse(self):
 		"""should parse these outputs:
 		Name or service not known
@@ -485,12 +972,73 @@ class PingTest(BaseCMDTest):
 		6 packets transmitted, 0 received, 100% packet loss, time 130ms
 		
 		"""
-		return None
+		def fmt(value):
+			return "-" if value is None else f"{value:.3f}"
+		
+		self.hosts_stats = {}
+		result_lines = [f"{'HOST':<32}{'TX':<5}{'RX':<5}{'LOSS':<8}RTT MIN/AVG/MAX/MDEV ms"]
+		problems = []
+		for host, output in self.hosts_output.items():
+			stats = parse_ping_output(output)
+			self.hosts_stats[host] = stats
+			problem = self._check_host(stats)
+			if problem is not None:
+				problems.append(f"{host}: {problem}")
+			if stats is None:
+				error_line = output.strip().splitlines()[-1] if output.strip() != "" else "no output"
+				result_lines.append(f"{host:<32}{error_line}")
+				continue
+			result_lines.append(f"{host:<32}{stats['transmitted']:<5}{stats['received']:<5}{str(stats['loss_pct']) + '%':<8}{fmt(stats['rtt_min'])}/{fmt(stats['rtt_avg'])}/{fmt(stats['rtt_max'])}/{fmt(stats['rtt_mdev'])}")
+		self.result = "\n".join(result_lines)
+		if len(problems) != 0:
+			self.failed = True
+			self.error_text += "; ".join(problems)
+			self._logger.info(f"parse: set failed = True because of problems: {problems}")
+	
+	
+	@property
+	def report_brief(self):
+		if len(self.hosts) == 1:
+			stats = self.hosts_stats.get(self.hosts[0])
+			if stats is None:
+				return f"Ping {self.hosts[0]}: {self.raw_cmd_result.strip()}"
+			return f"Ping {self.hosts[0]}: {stats['transmitted']} packets transmitted, {stats['received']} received, {stats['loss_pct']}% packet loss"
+		failed_hosts = [h for h, stats in self.hosts_stats.items() if self._check_host(stats) is not None]
+		if len(failed_hosts) == 0:
+			return f"Ping: all {len(self.hosts)} hosts OK"
+		return f"Ping: {len(failed_hosts)} of {len(self.hosts)} hosts have problems: {', '.join(failed_hosts)}"
+	
+	
+	@property
+	def result_data(self):
+		return {"hosts": self.hosts_stats}
 	
 	
+	@property
+	def result_metrics(self):
+		metrics = []
+		for host, stats in self.hosts_stats.items():
+			labels = {"host": host}
+			metrics.append(("ping_up", "1 if host replied to ping", labels, stats is not None and stats["received"] > 0))
+			if stats is None:
+				continue
+			metrics.append(("ping_loss_ratio", "ping packet loss", labels, stats["loss_pct"] / 100))
+			metrics.append(("ping_rtt_avg_seconds", "ping average round trip time", labels, stats["rtt_avg"] / 1000 if stats["rtt_avg"] is not None else None))
+			metrics.append(("ping_rtt_max_seconds", "ping maximum round trip time", labels, stats["rtt_max"] / 1000 if stats["rtt_max"] is not None else None))
+		return metrics
+	
+
 
 class TracerouteTest(BaseCMDTest):
-	"""checks traceroute"""
+	"""checks traceroute to hosts, concurrently
+	
+	mode = full - report full traceroute output
+	mode = route_change - run traceroute -n with bounded wait and max hops, compare hops with stored baseline,
+		report full trace only if route changed or hop became unreachable. Hop matches baseline if any of its responders
+		is known for this hop, baseline hop which never replied matches any hop, known hop with no reply is a change.
+		If baseline is not updated on change, new route
+		is accepted after it is seen in accept_after_runs runs in a row
+	"""
 	
 	def __init__(self, config = None, logger = None, name = "traceroute"):
 		super(TracerouteTest, self).__init__(config = config, logger = logger, name = name)
@@ -498,18 +1046,159 @@ class TracerouteTest(BaseCMDTest):
 		self.descr = "traceroute test"
 		self.CMD_TO_RUN = "traceroute"
 		self.TYPE = "traceroute"
-		self.host = ""
+		self.hosts = []
+		self.mode = "full"
+		self.wait_s = 2
+		self.max_hops = 30
+		self.max_parallel = 16
+		self.probes = 3
+		self.update_baseline = True
+		self.accept_after_runs = 3
+		self.hosts_output = {} # host -> raw traceroute output
+		self.hosts_hops = {} # host -> list of hops
+		self.changed_hosts = []
+		self.init_from_conf_dict()
 	
 	
 	def init_from_conf_dict(self):
-		self.host = self._config.get(self.name, "host")
-		self.CMD_TO_RUN = f"traceroute {self.host}"
+		if self._config.has_option(self.name, "hosts"):
+			self.hosts = [h.strip() for h in self._config.get(self.name, "hosts").replace("\n", ",").split(",") if h.strip() != ""]
+		else:
+			self.hosts = [self._config.get(self.name, "host")]
+		if self._config.has_option(self.name, "mode"):
+			self.mode = self._config.get(self.name, "mode")
+		if self._config.has_option(self.name, "wait_s"):
+			self.wait_s = self._config.getint(self.name, "wait_s")
+		if self._config.has_option(self.name, "max_hops"):
+			self.max_hops = self._config.getint(self.name, "max_hops")
+		if self._config.has_option(self.name, "max_parallel"):
+			self.max_parallel = self._config.getint(self.name, "max_parallel")
+		if self._config.has_option(self.name, "probes"):
+			self.probes = self._config.getint(self.name, "probes")
+		if self._config.has_option(self.name, "update_baseline"):
+			self.update_baseline = self._config.get(self.name, "update_baseline") == "True"
+		if self._config.has_option(self.name, "accept_after_runs"):
+			self.accept_after_runs = self._config.getint(self.name, "accept_after_runs")
+		self.descr = f"traceroute to {', '.join(self.hosts)}"
+	
+	
+	def _get_cmd(self, host):
+		if self.mode == "route_change":
+			return f"traceroute -n -q {self.probes} -w {self.wait_s} -m {self.max_hops} {host}"
+		return f"traceroute {host}"
+	
+	
+	def _traceroute_host(self, host):
+		"""runs in worker thread"""
+		try:
+			timeout = self.wait_s * self.max_hops * self.probes + 10 if self.mode == "route_change" else None
+			return run_command(self._get_cmd(host), timeout = timeout)
+		except Exception as e:
+			self._logger.error(f"_traceroute_host: got error tracing {host}: {e}")
+			return f"traceroute: {host}: {e}"
 	
 	
-	def run(self):
-		self.init_from_conf_dict()
-		self.raw_cmd_result = self.run_cmd()
-		self.parse()
+	@staticmethod
+	def _strip_unanswered(hops):
+		"""hops without trailing hops which did not reply"""
+		hops = list(hops)
+		while len(hops) != 0 and hops[-1] == ["*"]:
+			hops.pop()
+		return hops
+	
+	
+	@classmethod
+	def _same_route(cls, baseline_hops, hops):
+		baseline_hops = cls._strip_unanswered(baseline_hops)
+		hops = cls._strip_unanswered(hops)
+		if len(baseline_hops) != len(hops):
+			return False
+		for baseline_hop, hop in zip(baseline_hops, hops):
+			if baseline_hop == ["*"]:
+				continue
+			if hop == ["*"]:
+				# known hop became unreachable
+				return False
+			# load balanced hop replies from different addresses
+			if len(set(baseline_hop) & set(hop)) == 0:
+				return False
+		return True
+	
+	
+	@staticmethod
+	def _merge_hops(baseline_hops, hops):
+		"""union of responders of each hop"""
+		merged = []
+		for i in range(max(len(baseline_hops), len(hops))):
+			responders = set()
+			for h in (baseline_hops, hops):
+				if i < len(h) and h[i] != ["*"]:
+					responders.update(h[i])
+			merged.append(sorted(responders) if len(responders) != 0 else ["*"])
+		return merged
+	
+	
+	def collect(self):
+		self.hosts_output = dict(zip(self.hosts, run_parallel(self._traceroute_host, self.hosts, self.max_parallel)))
+		self.raw_cmd_result = "\n".join(self.hosts_output.values())
+	
+	
+	def parse(self):
+		if self.mode != "route_change":
+			self.result = self.raw_cmd_result
+			return
+		state = self.load_state()
+		baseline = state.get("baseline", {})
+		candidates = state.get("candidates", {}) # host -> {"hops", "runs"}, changed route and number of runs in a row it was seen
+		result_parts = []
+		self.changed_hosts = []
+		for host, output in self.hosts_output.items():
+			hops = parse_traceroute_output(output)
+			self.hosts_hops[host] = hops
+			if len(hops) == 0:
+				self.changed_hosts.append(host)
+				result_parts.append(f"traceroute {host}: FAILED\n{output}")
+				continue
+			if host not in baseline:
+				result_parts.append(f"traceroute {host}: baseline route saved ({len(hops)} hops)")
+				baseline[host] = hops
+				continue
+			if self._same_route(baseline[host], hops):
+				result_parts.append(f"traceroute {host}: route unchanged ({len(hops)} hops)")
+				baseline[host] = self._merge_hops(baseline[host], hops)
+				candidates.pop(host, None)
+				continue
+			self.changed_hosts.append(host)
+			baseline_len = len(baseline[host])
+			was_reachable = [str(i + 1) for i in range(min(len(hops), len(baseline[host]))) if hops[i] == ["*"] and baseline[host][i] != ["*"]]
+			note = f", became unreachable: hop {', '.join(was_reachable)}" if len(was_reachable) != 0 else ""
+			candidate = candidates.get(host)
+			if candidate is not None and self._same_route(candidate["hops"], hops):
+				candidate = {"hops": self._merge_hops(candidate["hops"], hops), "runs": candidate["runs"] + 1}
+			else:
+				candidate = {"hops": hops, "runs": 1}
+			if self.update_baseline or (self.accept_after_runs > 0 and candidate["runs"] >= self.accept_after_runs):
+				note += ", new route is saved as baseline"
+				baseline[host] = candidate["hops"]
+				candidates.pop(host, None)
+			else:
+				candidates[host] = candidate
+			result_parts.append(f"traceroute {host}: ROUTE CHANGED{note}, was {baseline_len} hops, now {len(hops)} hops\n{output}")
+		self.save_state({"baseline": baseline, "candidates": candidates})
+		self.result = "\n".join(result_parts)
+		if len(self.changed_hosts) != 0:
+			self.failed = True
+			self.error_text += f"route changed for: {', '.join(self.changed_hosts)}"
+			self.result_brief = f"Traceroute: route changed for {', '.join(self.changed_hosts)}"
+		else:
+			self.result_brief = f"Traceroute: route unchanged for {len(self.hosts)} hosts"
+	
+	
+	@property
+	def result_data(self):
+		if self.mode != "route_change":
+			return None
+		return {"hops": self.hosts_hops, "changed_hosts": self.changed_hosts}
 	
 
 
@@ -535,7 +1224,6 @@ class PSTest(BaseCMDTest):
 	@property
 	def report_brief(self):
 		if self.process_substr is None:
-			self._logger.debug(f"report_brief: {self.raw_cmd_result}")
 			return f"ps: {len(self.raw_cmd_result.splitlines()) - 1} processes"
 		else:
 			tmp_result_list = []
@@ -555,10 +1243,20 @@ class PSTest(BaseCMDTest):
 		self.result = "\n".join(result_tmp_list)
 	
 	
-	def run(self):
+	@property
+	def normalized_result(self):
+		# only USER and COMMAND of ps aux lines, PID, %CPU, %MEM, VSZ, RSS, STAT and TIME change all the time
+		lines = []
+		for line in (self.result if self.process_substr is not None else self.raw_cmd_result).splitlines():
+			words = line.split(None, 10)
+			if len(words) == 11:
+				lines.append(f"{words[0]} {words[10]}")
+		return f"{self.failed}\n{self.error_text}\n" + "\n".join(sorted(lines))
+	
+	
+	def collect(self):
 		self.init_from_conf_dict()
 		self.raw_cmd_result = self.run_cmd()
-		self.parse()
 
 	
 
@@ -578,8 +1276,11 @@ class DowntimeTest(BaseTest):
 		self.downtime_s = None
 	
 	
-	def run(self):
+	def collect(self):
 		self.last_heartbeat = read_heartbeat(self.heartbeat_file)
+	
+	
+	def parse(self):
 		self.compile_report()
 	
 
@@ -631,13 +1332,13 @@ class FileContentTest(BaseTest):
 		
 		
 	def collect(self):
-		if not os.path.isfile(self.path):
+		try:
+			full_file_content = read_file(self.path)
+		except OSError as e:
 			self.failed = True
 			self.result = f"file {self.path} is not present"
-			self._logger.error(f"collect: could not find file {self.path}")
+			self._logger.error(f"collect: could not read file {self.path}: {e}")
 			return False
-		with open(self.path, "r") as f:
-			full_file_content = f.read()
 		lines_list = full_file_content.splitlines()
 		self.total_lines = len(lines_list)
 		self._logger.debug(f"collect: num of strings: {self.total_lines}")
@@ -656,115 +1357,476 @@ class FileContentTest(BaseTest):
 
 
 class FileExistTest(BaseTest):
-	"""Check if path exist and it's a file. Otherwise fail"""
+	"""Check if paths exist and they are files. Otherwise fail.
+	
+	paths may contain glob patterns and lists of paths (comma or newline separated). Each matched file can
+	also be checked for min_size (bytes), max_age_s (mtime), owner (name or uid) and mode (octal, i.e. 0640).
+	Paths are grouped by dir, and each dir is read once with os.scandir. Only violations are reported.
+	"""
 	
 	def __init__(self, config = None, logger = None, name = "file_exist"):
 		super(FileExistTest, self).__init__(config = config, logger = logger, name = name)
 		self.TYPE = "file_exist"
 		self.descr = "check if file exist"
-		self._file_exist = None
-		self._file_size = None
-		self._file_perm = None
+		self.paths = []
+		self.min_size = None
+		self.max_age_s = None
+		self.owner_uid = None
+		self.mode = None
+		self.checked_count = 0
+		self.violations = [] # list of (path, problem)
 		self.init_from_conf_dict()
 		
 	
 	def init_from_conf_dict(self):
-		self.path = self._config.get(self.name, "path")
-		self.descr = f"check if file {self.path} exist"
+		paths_str = self._config.get(self.name, "paths") if self._config.has_option(self.name, "paths") else self._config.get(self.name, "path")
+		self.paths = [p.strip() for p in paths_str.replace("\n", ",").split(",") if p.strip() != ""]
+		self.descr = f"check if file {self.paths[0]} exist" if len(self.paths) == 1 else f"check if {len(self.paths)} files exist"
+		if self._config.has_option(self.name, "min_size"):
+			self.min_size = self._config.getint(self.name, "min_size")
+		if self._config.has_option(self.name, "max_age_s"):
+			self.max_age_s = self._config.getint(self.name, "max_age_s")
+		if self._config.has_option(self.name, "owner"):
+			import pwd
+			owner = self._config.get(self.name, "owner")
+			try:
+				self.owner_uid = int(owner) if owner.isdigit() else pwd.getpwnam(owner).pw_uid
+			except KeyError:
+				self.failed = True
+				self.error_text += f"unknown owner {owner} in config. "
+				self._logger.error(f"init_from_conf_dict: unknown owner {owner}, owner will not be checked")
+		if self._config.has_option(self.name, "mode"):
+			mode = self._config.get(self.name, "mode")
+			try:
+				self.mode = int(mode, 8)
+			except ValueError:
+				self.failed = True
+				self.error_text += f"mode {mode} in config is not octal. "
+				self._logger.error(f"init_from_conf_dict: mode {mode} is not octal, mode will not be checked")
+	
+	
+	@staticmethod
+	def _is_pattern(path):
+		return re.search(r"[*?[]", path) is not None
+	
+	
+	def _group_by_dir(self):
+		"""return dict dir -> list of (pattern, name_pattern), with globs in dir part expanded"""
+		dirs_dict = {}
+		for pattern in self.paths:
+			dir_pattern, name_pattern = os.path.split(pattern)
+			dirs = sorted(glob.glob(dir_pattern)) if self._is_pattern(dir_pattern) else [dir_pattern]
+			if len(dirs) == 0:
+				self.violations.append((pattern, "no matching dirs"))
+			for d in dirs:
+				dirs_dict.setdefault(d, []).append((pattern, name_pattern))
+		return dirs_dict
+	
+	
+	def _check_entry(self, entry, now):
+		"""return list of problems of file entry"""
+		if not entry.is_file():
+			return ["not a file"]
+		st = entry.stat()
+		problems = []
+		if self.min_size is not None and st.st_size < self.min_size:
+			problems.append(f"size {st.st_size} < {self.min_size}")
+		if self.max_age_s is not None and now - st.st_mtime > self.max_age_s:
+			problems.append(f"modified {humanify_seconds(now - st.st_mtime)} ago, max age is {humanify_seconds(self.max_age_s)}")
+		if self.owner_uid is not None and st.st_uid != self.owner_uid:
+			problems.append(f"owner uid {st.st_uid} != {self.owner_uid}")
+		if self.mode is not None and stat.S_IMODE(st.st_mode) != self.mode:
+			problems.append(f"mode {stat.S_IMODE(st.st_mode):04o} != {self.mode:04o}")
+		return problems
+	
+	
+	def _check_dir(self, dir_path, patterns, now):
+		import fnmatch
+		try:
+			with os.scandir(dir_path if dir_path != "" else ".") as it:
+				entries = {e.name: e for e in it}
+		except OSError as e:
+			for pattern, name_pattern in patterns:
+				self.violations.append((pattern, f"could not read dir: {e.strerror}"))
+			return
+		for pattern, name_pattern in patterns:
+			if self._is_pattern(name_pattern):
+				matched = [entries[n] for n in sorted(fnmatch.filter(entries.keys(), name_pattern))]
+			else:
+				matched = [entries[name_pattern]] if name_pattern in entries else []
+			if len(matched) == 0:
+				self.violations.append((os.path.join(dir_path, name_pattern), "is not present"))
+				self.checked_count += 1
+				continue
+			for entry in matched:
+				self.checked_count += 1
+				try:
+					for problem in self._check_entry(entry, now):
+						self.violations.append((entry.path, problem))
+				except OSError as e:
+					self.violations.append((entry.path, f"could not stat: {e.strerror}"))
 	
 	
 	def collect(self):
-		if not os.path.isfile(self.path):
-			self.failed = True
-			self.result = f"file {self.path} is not present"
-			self._logger.error(f"collect: could not find file {self.path}")
-			return False
-		self._file_exist = True
-		self._logger.info(f"collect: file exist: {self.path}")
+		self.checked_count = 0
+		self.violations = []
+		now = time.time()
+		for dir_path, patterns in self._group_by_dir().items():
+			self._check_dir(dir_path, patterns, now)
+		self._logger.info(f"collect: checked {self.checked_count} files, {len(self.violations)} violations")
 	
 	
 	def parse(self):
-		if not self._file_exist:
-			self.result = f"file {self.path} does not exist"
+		if len(self.violations) == 0:
+			self.result = f"all {self.checked_count} files are OK"
+			if self.failed:
+				self.result += f", but test is misconfigured: {self.error_text}"
 			return
-		self.result = f"file {self.path} exist"
+		self.failed = True
+		self.error_text += f"{len(self.violations)} violations in {self.checked_count} files"
+		result_lines = [f"{len(self.violations)} violations in {self.checked_count} files:"]
+		for path, problem in self.violations:
+			result_lines.append(f"file {path} {problem}")
+		self.result = "\n".join(result_lines)
+		self.result_brief = f"Files: {len(self.violations)} violations in {self.checked_count} files"
 
 
-# TODO: under construction and testing
 class ServiceTest(BaseCMDTest):
-	"""Show status of target service self.service_name"""
+	"""Show status of services.
+	
+	services is a list of units (names or glob patterns). All of them are queried with single command:
+	systemctl show on systemd, or one shell loop of service status on FreeBSD.
+	Test fails if service is not in ok_states, or if it was restarted since previous run.
+	"""
 	
 	def __init__(self, config = None, logger = None, name = "servicetest"):
 		super(ServiceTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "service status"
 		self.CMD_TO_RUN = ""
+		self.SHOW_PROPERTIES = ["Id", "LoadState", "ActiveState", "SubState", "NRestarts", "ExecMainStartTimestamp"]
 		self.TYPE = "service"
-		self.service_name = ""
+		self.services = []
+		self.ok_states = ["active"]
+		self.units = {} # unit -> dict of state
 		self.systemctl_is_used = False
+		self.init_from_conf_dict()
 	
 	
 	def init_from_conf_dict(self):
-		if self._config.has_option(self.name, "service_name"):
-			self.service_name = self._config.get(self.name, "service_name")
-			self.descr = f"status of {self.service_name} service"
-			self._logger.debug(f"init_from_conf_dict: got service_name = {self.service_name}")
+		if self._config.has_option(self.name, "services"):
+			self.services = [u.strip() for u in self._config.get(self.name, "services").replace("\n", ",").split(",") if u.strip() != ""]
+		elif self._config.has_option(self.name, "service_name"):
+			self.services = [self._config.get(self.name, "service_name")]
 		else:
-			self._logger.error("init_from_conf_dict: no section in config")
-		if (self._os_type_dict["os_family"] == "RedHat" and self._os_type_dict["major_version"] >= 7) \
-			or (self._os_type_dict["os_family"] == "SuSE" and self._os_type_dict["major_version"] >= 12) \
-			or (self._os_type_dict["os_family"] == "Debian" and self._os_type_dict["major_version"] >= 10):
-			self.systemctl_is_used = True
-			self.CMD_TO_RUN = f"systemctl status {self.service_name}"
-		if (self._os_type_dict["os_family"] == "RedHat" and self._os_type_dict["major_version"] < 7) \
-			or (self._os_type_dict["os_family"] == "SuSE" and self._os_type_dict["major_version"] < 12) \
-			or (self._os_type_dict["os_family"] == "Debian" and self._os_type_dict["major_version"] < 10) \
-			or (self._os_type_dict["os_family"] == "FreeBSD"):
-			self.systemctl_is_used = False
-			self.CMD_TO_RUN = f"service {self.service_name} status"
+			self._logger.error("init_from_conf_dict: no services in config")
+		self.descr = f"status of services: {', '.join(self.services)}"
+		self._logger.debug(f"init_from_conf_dict: got services = {self.services}")
+		if self._config.has_option(self.name, "ok_states"):
+			self.ok_states = [st.strip() for st in self._config.get(self.name, "ok_states").split(",")]
+		self.systemctl_is_used = get_host_fact("systemd", lambda: find_executable("systemctl") is not None and os.path.isdir("/run/systemd/system"))
+	
+	
+	@staticmethod
+	def _is_pattern(name):
+		return re.search(r"[*?[]", name) is not None
+	
+	
+	def _expand_patterns(self, available):
+		import fnmatch
+		result_list = []
+		for s in self.services:
+			matched = fnmatch.filter(available, s) if self._is_pattern(s) else [s]
+			for m in matched:
+				if m not in result_list:
+					result_list.append(m)
+		return result_list
+	
+	
+	def _collect_systemctl(self):
+		units = [s for s in self.services]
+		if any(self._is_pattern(s) for s in self.services):
+			listed = run_command("systemctl list-units --all --plain --no-legend --no-pager --type=service")
+			units = self._expand_patterns([l.split()[0] for l in listed.splitlines() if l.strip() != ""])
+		if len(units) == 0:
+			return {}
+		self.CMD_TO_RUN = f"systemctl show --no-pager --property={','.join(self.SHOW_PROPERTIES)} {' '.join(units)}"
+		self.raw_cmd_result = self.run_cmd()
+		result_dict = {}
+		for unit, props in parse_systemctl_show(self.raw_cmd_result).items():
+			result_dict[unit] = {"state": props.get("ActiveState", "unknown") if props.get("LoadState") != "not-found" else "not-found",
+				"substate": props.get("SubState", ""),
+				"restarts": props.get("NRestarts", ""),
+				"started": props.get("ExecMainStartTimestamp", "")}
+		return result_dict
+	
+	
+	def _collect_service(self):
+		units = [s for s in self.services]
+		if any(self._is_pattern(s) for s in self.services):
+			enabled = run_command("service -e")
+			units = self._expand_patterns([os.path.basename(l.strip()) for l in enabled.splitlines() if l.strip() != ""])
+		if len(units) == 0:
+			return {}
+		self.CMD_TO_RUN = "sh -c 'for s in \"$@\"; do echo \"== $s\"; service \"$s\" onestatus 2>&1; echo \"== rc=$?\"; done' sh " + " ".join(units)
+		self.raw_cmd_result = self.run_cmd()
+		result_dict = {}
+		for unit, status in parse_service_status_batch(self.raw_cmd_result).items():
+			result_dict[unit] = {"state": "active" if status["running"] else "inactive",
+				"substate": "running" if status["running"] else "",
+				"restarts": "",
+				"started": status["pid"] or ""}
+		return result_dict
+	
+	
+	def collect(self):
+		if len(self.services) == 0:
+			return
+		self.units = self._collect_systemctl() if self.systemctl_is_used else self._collect_service()
 	
 	
 	def parse(self):
-		if self.service_name == "":
-			return None
-		if self.systemctl_is_used:
-			if self.raw_cmd_result == "-1":
-				self.error = True
-				self.result = f"got error running systemctl, please check configuration"
-				return
+		if len(self.services) == 0:
+			self.result = "no services configured"
+			return
+		if len(self.units) == 0:
+			self.failed = True
+			self.error_text += "no services found"
+			self.result = f"got no status for services {', '.join(self.services)}, please check configuration"
+			return
+		prev_units = self.load_state().get("units", {})
+		result_lines = [f"{'UNIT':<32}{'STATE':<12}{'SUB':<12}{'RESTARTS':<10}STARTED"]
+		problems = []
+		for unit, status in self.units.items():
+			if status["state"] not in self.ok_states:
+				problems.append(f"{unit} is {status['state']}")
+			elif unit in prev_units and (prev_units[unit]["restarts"], prev_units[unit]["started"]) != (status["restarts"], status["started"]):
+				problems.append(f"{unit} restarted since last run")
+			result_lines.append(f"{unit:<32}{status['state']:<12}{status['substate']:<12}{status['restarts']:<10}{status['started']}")
+		self.save_state({"units": self.units})
+		self.result = "\n".join(result_lines)
+		if len(problems) != 0:
+			self.failed = True
+			self.error_text += "; ".join(problems)
+			self._logger.info(f"parse: set failed = True because of problems: {problems}")
+			self.result_brief = f"Services: {len(problems)} of {len(self.units)} have problems: {'; '.join(problems)}"
+		else:
+			self.result_brief = f"Services: all {len(self.units)} are {', '.join(self.ok_states)}"
+	
+	
+	@property
+	def result_data(self):
+		return {"units": self.units}
+	
+	
+	@property
+	def result_metrics(self):
+		return [("service_ok", "1 if service is in ok_states", {"unit": unit}, status["state"] in self.ok_states) for unit, status in self.units.items()]
 
 
 
-class IfconfigMeTest(BaseCMDTest):
+class EndpointsTest(BaseTest):
+	"""Probe endpoints concurrently: TCP connect, HTTP(S) GET with expected status and body, external IP.
+	
+	endpoints is newline separated list of lines: <url> [kind=external_ip] [status=200] [body=substring] [timeout=3]
+	url is tcp://host:port, http://... or https://...
+	"""
+	
+	def __init__(self, config = None, logger = None, name = "endpoints"):
+		super(EndpointsTest, self).__init__(config = config, logger = logger, name = name)
+		self.descr = "endpoints probe"
+		self.TYPE = "endpoints"
+		self.timeout_s = 5.0
+		self.max_parallel = 64
+		self.probes = []
+		self.init_from_conf_dict()
+	
+	
+	def init_from_conf_dict(self):
+		if self._config.has_option(self.name, "timeout_s"):
+			self.timeout_s = self._config.getfloat(self.name, "timeout_s")
+		if self._config.has_option(self.name, "max_parallel"):
+			self.max_parallel = self._config.getint(self.name, "max_parallel")
+		if self._config.has_option(self.name, "endpoints"):
+			self.probes = [Probe.from_line(l, timeout_s = self.timeout_s) for l in self._config.get(self.name, "endpoints").splitlines() if l.strip() != ""]
+		self.descr = f"probe of {len(self.probes)} endpoints"
+	
+	
+	def _probe_all(self):
+		EndpointProber(max_parallel = self.max_parallel, logger = self._logger).run(self.probes)
+		return [p.result_dict for p in self.probes]
+	
+	
+	def collect(self):
+		# goes through run_probes hook, so --record saves results and --replay does not touch network
+		for p, result_dict in zip(self.probes, run_probes(f"{self.TYPE} {self.name}", self._probe_all)):
+			p.set_result(result_dict)
+	
+	
+	def parse(self):
+		result_lines = [f"{'ENDPOINT':<48}{'KIND':<13}{'STATUS':<8}{'LATENCY':<11}RESULT"]
+		failed_probes = []
+		for p in self.probes:
+			if not p.ok:
+				failed_probes.append(p)
+			latency = f"{p.latency_ms:.1f}ms" if p.latency_ms is not None else "-"
+			if not p.ok:
+				outcome = f"FAILED: {p.error}"
+			elif p.kind == "external_ip":
+				outcome = f"IP: {p.body.strip()}"
+			else:
+				outcome = "OK"
+			result_lines.append(f"{p.url:<48}{p.kind:<13}{str(p.status or '-'):<8}{latency:<11}{outcome}")
+		self.result = "\n".join(result_lines)
+		brief_list = [f"External IP: {p.body.strip()}" for p in self.probes if p.kind == "external_ip" and p.ok]
+		if len(failed_probes) != 0:
+			self.failed = True
+			self.error_text += "; ".join([f"{p.url}: {p.error}" for p in failed_probes])
+			self._logger.info(f"parse: set failed = True because of failed probes: {failed_probes}")
+			brief_list.append(f"Endpoints: {len(failed_probes)} of {len(self.probes)} failed: {', '.join([p.url for p in failed_probes])}")
+		elif len(brief_list) != len(self.probes):
+			brief_list.append(f"Endpoints: all {len(self.probes)} OK")
+		self.result_brief = "\n".join(brief_list)
+	
+	
+	@property
+	def result_data(self):
+		return {"probes": [{"url": p.url, "kind": p.kind, "ok": p.ok, "status": p.status, "latency_ms": p.latency_ms, "error": p.error} for p in self.probes]}
+	
+	
+	@property
+	def result_metrics(self):
+		metrics = []
+		for p in self.probes:
+			labels = {"url": p.url, "kind": p.kind}
+			metrics.append(("endpoint_up", "1 if endpoint probe is OK", labels, bool(p.ok)))
+			metrics.append(("endpoint_latency_seconds", "endpoint probe latency", labels, p.latency_ms / 1000 if p.latency_ms is not None else None))
+		return metrics
+
+
+
+class IfconfigMeTest(EndpointsTest):
 	"""Test outer IP using public web service ifconfig.me/ip"""
 	
 	def __init__(self, config = None, logger = None, name = "ifconfigmetest"):
+		self.URL = "https://ifconfig.me/ip"
 		super(IfconfigMeTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "request extermal IP address from ifconfig.me web service"
 		self.TYPE = "ifconfigme"
-		self.URL = "https://ifconfig.me/ip"
-		self.CMD_TO_RUN = f"curl -s {self.URL}"
+	
+	
+	def init_from_conf_dict(self):
+		if self._config.has_option(self.name, "url"):
+			self.URL = self._config.get(self.name, "url")
+		if self._config.has_option(self.name, "timeout_s"):
+			self.timeout_s = self._config.getfloat(self.name, "timeout_s")
+		self.probes = [Probe(self.URL, kind = "external_ip", timeout_s = self.timeout_s)]
+	
+	
+	def parse(self):
+		super(IfconfigMeTest, self).parse()
+		self.result = self.probes[0].body.strip() if self.probes[0].ok else self.probes[0].error
 
 
 
-class DUTest(BaseCMDTest):
-	"""Test disk usage (using du) of dir"""
+class DUTest(BaseTest):
+	"""Test disk usage of dir, using native parallel scanner, report top-N largest subdirs"""
 	
 	def __init__(self, config = None, logger = None, name = "dutest"):
 		super(DUTest, self).__init__(config = config, logger = logger, name = name)
 		self.descr = "simple du (disk usage) test"
 		self.TYPE = "du"
-		# self.CMD_TO_RUN = f"du -sh"
+		self.path = ""
 		self.summarize = False
-		self._dive_into_subdirs = False
+		self.max_depth = 1
+		self.one_file_system = True
+		self.exclude = []
+		self.top_n = 10
+		self.max_parallel = 8
+		self.use_cache = False
+		self.cache_max_age_s = 86400
+		self.total_size = None
+		self.top_entries = []
+		self._scanner = None
 		self.init_from_conf_dict()
 		
 	
 	def init_from_conf_dict(self):
-		self._dive_into_subdirs = True if self._config.get(self.name, "path") == "True" else False
 		self.path = self._config.get(self.name, "path")
+		self.descr = f"disk usage of {self.path}"
 		self.summarize = True if (self._config.has_option(self.name, "summarize") and self._config.get(self.name, "summarize") == "True") else False
-		# self.CMD_TO_RUN = f"du -sh {os.path.join(self.path, '*')}"
-		self.CMD_TO_RUN = f"du -sh {self.path}" if self.summarize else f"du -h {self.path}"
-		pass
-
-
+		if self._config.has_option(self.name, "max_depth"):
+			self.max_depth = self._config.getint(self.name, "max_depth")
+		if self._config.has_option(self.name, "one_file_system"):
+			self.one_file_system = self._config.get(self.name, "one_file_system") == "True"
+		if self._config.has_option(self.name, "exclude"):
+			self.exclude = [e.strip() for e in self._config.get(self.name, "exclude").split(",") if e.strip() != ""]
+		if self._config.has_option(self.name, "top_n"):
+			self.top_n = self._config.getint(self.name, "top_n")
+		if self._config.has_option(self.name, "max_parallel"):
+			self.max_parallel = self._config.getint(self.name, "max_parallel")
+		if self._config.has_option(self.name, "cache"):
+			self.use_cache = self._config.get(self.name, "cache") == "True"
+		if self._config.has_option(self.name, "cache_max_age_s"):
+			self.cache_max_age_s = self._config.getint(self.name, "cache_max_age_s")
+	
+	
+	def collect(self):
+		state = self.load_state() if self.use_cache else {}
+		# cache is only valid for the same scan options
+		options = [self.path, self.one_file_system, self.exclude]
+		cache = state.get("cache", {}) if state.get("options") == options else {}
+		self._scanner = DirSizeScanner(max_depth = self.max_depth,
+			one_file_system = self.one_file_system,
+			exclude = self.exclude,
+			max_workers = self.max_parallel,
+			cache = cache,
+			cache_max_age_s = self.cache_max_age_s,
+			logger = self._logger)
+		try:
+			self.total_size = self._scanner.scan(self.path)
+		except OSError as e:
+			self.failed = True
+			self.error_text += f"could not scan {self.path}: {e}"
+			self._logger.error(f"collect: could not scan {self.path}: {e}")
+			return
+		self.top_entries = self._scanner.get_top_entries(self.top_n)
+		if self.use_cache:
+			self.save_state({"options": options, "cache": self._scanner.new_cache})
+	
+	
+	def parse(self):
+		if self.total_size is None:
+			return
+		self.result_brief = f"du {self.path}: {humanify_bytes(self.total_size)}"
+		result_lines = [f"{humanify_bytes(self.total_size)}\t{self.path}"]
+		if not self.summarize:
+			result_lines.append(f"top {self.top_n} largest entries (max depth {self.max_depth}):")
+			for path, size in self.top_entries:
+				result_lines.append(f"{humanify_bytes(size)}\t{path}")
+		if len(self._scanner.errors) != 0:
+			result_lines.append(f"could not read {len(self._scanner.errors)} entries, first: {self._scanner.errors[0]}")
+		self.result = "\n".join(result_lines)
+	
+	
+	@property
+	def result_data(self):
+		return {"path": self.path, "total_size": self.total_size, "top_entries": [{"path": path, "size": size} for path, size in self.top_entries]}
+	
+	
+	@property
+	def normalized_result(self):
+		# sizes change a little on every run: total is compared as du -h shows it, entries as percent of total
+		if self.total_size is None:
+			return f"{self.failed}\n{self.error_text}"
+		lines = [f"{humanify_bytes(self.total_size)}\t{self.path}"]
+		for path, size in self.top_entries:
+			lines.append(f"{round(100 * size / self.total_size) if self.total_size else 0}%\t{path}")
+		return f"{self.failed}\n{self.error_text}\n" + "\n".join(lines)
+	
+	
+	@property
+	def result_metrics(self):
+		metrics = [("du_size_bytes", "disk usage of path", {"path": self.path}, self.total_size)]
+		for path, size in self.top_entries:
+			metrics.append(("du_entry_size_bytes", "disk usage of largest entries under path", {"path": path}, size))
+		return metrics
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+
+"""shared fixtures: repo root on sys.path, config file of SimpleReporter in temp dir"""
+
+
+import os
+import sys
+import time
+import textwrap
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+
+@pytest.fixture
+def make_config(tmp_path):
+	"""returns function which writes config with [main] section pointing to tmp_path, plus given sections, and returns its path"""
+	def _make_config(sections = "", main = ""):
+		state_dir = tmp_path / "state"
+		state_dir.mkdir(exist_ok = True)
+		config_file = tmp_path / "simple_reporter.conf"
+		config_file.write_text(f"[main]\nlog_file = {tmp_path / 'simple_reporter.log'}\nstate_dir = {state_dir}\n{textwrap.dedent(main)}\n{textwrap.dedent(sections)}")
+		return str(config_file)
+	return _make_config
+
+
+@pytest.fixture
+def failing_email_section(tmp_path):
+	"""email reporter section, SMTP server refuses connections"""
+	return f"""
+[email-reporter]
+enabled = True
+type = reporter-email
+smtp_server = 127.0.0.1
+smtp_port = 1
+sender = a@example.com
+smtp_username = x
+smtp_password = y
+use_tls = False
+use_auth = False
+to = b@example.com
+email_subject = simple_reporter at {{{{ hostname }}}}
+smtp_timeout_s = 2
+outbox = False
+
+[json-reporter]
+enabled = True
+type = reporter-json
+filename = {tmp_path / 'report.ndjson'}
+"""
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	"""answers GET with status and body from server.responses (path -> (status, body, delay_s)), 404 for other paths.
+	If server.close_idle is True, connection is closed after each response without telling client, like idle timeout of server"""
+	protocol_version = "HTTP/1.1"
+	
+	def setup(self):
+		super(StandInHandler, self).setup()
+		self.server.connections += 1
+	
+	
+	def do_GET(self):
+		status, body, delay_s = self.server.responses.get(self.path, (404, b"not found", 0))
+		self.server.requests.append(self.path)
+		time.sleep(delay_s)
+		self.send_response(status)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+		if self.server.close_idle:
+			self.close_connection = True
+	
+	
+	def log_message(self, format, *args):
+		pass
+
+
+@pytest.fixture
+def http_server():
+	"""HTTP server on 127.0.0.1 and ephemeral port, set server.responses to configure it"""
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+	server.daemon_threads = True
+	server.responses = {}
+	server.requests = []
+	server.connections = 0
+	server.close_idle = False
+	server.url = f"http://127.0.0.1:{server.server_address[1]}"
+	thread = threading.Thread(target = server.serve_forever, daemon = True)
+	thread.start()
+	yield server
+	server.shutdown()
+	server.server_close()
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import os
+import json
+
+from simple_reporter import SimpleReporter
+
+
+
+def test_alert_is_kept_if_only_structured_reporter_succeeded(make_config, failing_email_section, tmp_path):
+	config_file = make_config(failing_email_section + """
+[missing-file]
+type = file_exist
+paths = /nonexistent/simple_reporter_test
+alert = True
+""")
+	sr = SimpleReporter(config_file = config_file)
+	sr.init_all(alert_only = True)
+	sr.run_tests()
+	sr.run_alerts()
+	sr.close_logger()
+	state = json.load(open(tmp_path / "state" / "alert_state.json"))
+	assert [p["test"] for p in state["pending"]] == ["missing-file"]
+	assert state["last_alert"] == 0
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import os
+
+from simple_reporter import SimpleReporter
+from capture import CaptureRecorder, CaptureReplayer
+
+
+
+def test_replay_uses_recorded_probes_and_bundle_state_dir(make_config, http_server, tmp_path):
+	http_server.responses["/ip"] = (200, b"192.0.2.1\n", 0)
+	config_file = make_config(f"""
+[email-reporter]
+enabled = True
+type = reporter-email
+smtp_server = 127.0.0.1
+smtp_port = 1
+sender = a@example.com
+smtp_username = x
+smtp_password = y
+use_tls = False
+use_auth = False
+to = b@example.com
+email_subject = test
+
+[endpoints-test]
+type = endpoints
+endpoints = {http_server.url}/ip kind=external_ip
+""")
+	bundle_dir = str(tmp_path / "bundle")
+	sr = SimpleReporter(config_file = config_file)
+	sr.capture = CaptureRecorder(bundle_dir)
+	sr.init_all()
+	sr.run_tests()
+	sr.capture.save()
+	sr.close_logger()
+	assert len(http_server.requests) == 1
+	
+	sr = SimpleReporter(config_file = os.path.join(bundle_dir, "simple_reporter.conf"))
+	sr.capture = CaptureReplayer(bundle_dir)
+	sr.init_all()
+	sr.run_tests()
+	try:
+		assert len(http_server.requests) == 1
+		assert not sr.tests[0].failed
+		assert sr.tests[0].result_brief == "External IP: 192.0.2.1"
+		assert sr.reporters[0].outbox_dir.startswith(sr.capture.state_dir)
+	finally:
+		sr.capture.save()
+		sr.close_logger()
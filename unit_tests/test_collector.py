@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import gzip
+import json
+import logging
+import sqlite3
+import urllib.error
+import urllib.request
+import configparser
+
+import pytest
+
+from collector import FleetCollector
+
+
+
+@pytest.fixture
+def collector(tmp_path):
+	config = configparser.ConfigParser()
+	config.read_string(f"""
+[main]
+state_dir = {tmp_path}
+
+[collector]
+enabled = True
+type = collector
+listen = 127.0.0.1:0
+db_file = {tmp_path / 'fleet.sqlite'}
+token = secret
+flush_interval_s = 0.1
+""")
+	collector = FleetCollector(config = config, logger = logging.getLogger("test"))
+	collector.start()
+	yield collector
+	collector.stop()
+
+
+def push(collector, payload, token = "secret", raw = None):
+	"""POST payload gzip-compressed like PushReporter does, return HTTP status"""
+	body = gzip.compress(raw if raw is not None else json.dumps(payload).encode("utf-8"))
+	request = urllib.request.Request(f"http://{collector.listen}/push", data = body, method = "POST",
+		headers = {"Content-Type": "application/json", "Content-Encoding": "gzip", "X-Simple-Reporter-Token": token})
+	try:
+		with urllib.request.urlopen(request, timeout = 5) as response:
+			return response.status
+	except urllib.error.HTTPError as e:
+		return e.code
+
+
+def make_payload(host, run, failed = False):
+	return {"host": host, "run": run, "tests": [
+		{"name": "df", "type": "df", "failed": failed, "ignored": False, "error_text": "disk full" if failed else "", "brief": f"df run {run}", "hash": "h", "data": {"used": 1}},
+		{"name": "uptime", "type": "uptime", "failed": False, "ignored": False, "error_text": "", "brief": "up", "hash": "h", "data": None}]}
+
+
+def test_pushed_payloads_are_stored_and_hosts_upserted(collector):
+	assert push(collector, make_payload("host1", "r1")) == 202
+	assert push(collector, make_payload("host2", "r1")) == 202
+	assert push(collector, make_payload("host1", "r2", failed = True)) == 202
+	db_file = collector.db_file
+	collector.stop()
+	conn = sqlite3.connect(db_file)
+	assert conn.execute("SELECT host, run, test, failed FROM results ORDER BY host, run, test").fetchall() == [
+		("host1", "r1", "df", 0), ("host1", "r1", "uptime", 0), ("host1", "r2", "df", 1), ("host1", "r2", "uptime", 0),
+		("host2", "r1", "df", 0), ("host2", "r1", "uptime", 0)]
+	hosts = conn.execute("SELECT host, run, failed_tests, brief FROM hosts ORDER BY host").fetchall()
+	assert hosts == [("host1", "r2", json.dumps(["df: disk full"]), "df run r2\nup"), ("host2", "r1", "[]", "df run r1\nup")]
+	conn.close()
+
+
+def test_bad_requests_are_rejected(collector):
+	assert push(collector, make_payload("host1", "r1"), token = "wrong") == 403
+	assert push(collector, None, raw = b"not json") == 400
+	assert push(collector, {"host": "host1", "tests": [{"brief": "no name"}]}) == 400
+	db_file = collector.db_file
+	collector.stop()
+	conn = sqlite3.connect(db_file)
+	assert conn.execute("SELECT COUNT(*) FROM results").fetchone() == (0, )
+	assert conn.execute("SELECT COUNT(*) FROM hosts").fetchone() == (0, )
+	conn.close()
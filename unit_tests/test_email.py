@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import os
+import glob
+import logging
+import configparser
+import email.message
+
+from reporters import EmailReporter
+
+
+
+def test_message_is_serialized_once_for_outbox_and_send(monkeypatch, failing_email_section, tmp_path):
+	config = configparser.ConfigParser(interpolation = None)
+	config.read_string(f"[main]\nstate_dir = {tmp_path}\n" + failing_email_section.replace("outbox = False", "outbox = True"))
+	reporter = EmailReporter(config = config, logger = logging.getLogger("test"), section = "email-reporter")
+	calls = []
+	as_bytes = email.message.Message.as_bytes
+	def counting_as_bytes(message, *args, **kwargs):
+		calls.append(message)
+		return as_bytes(message, *args, **kwargs)
+	monkeypatch.setattr(email.message.Message, "as_bytes", counting_as_bytes)
+	sent_messages = []
+	def fake_send_raw(sender, recipient_list, message):
+		sent_messages.append(message)
+		raise ConnectionRefusedError("relay is down")
+	monkeypatch.setattr(reporter, "send_raw", fake_send_raw)
+	assert reporter.send_report("report text", [("big.txt", "x" * 1000)]) is False
+	assert len(calls) == 1
+	eml_files = glob.glob(os.path.join(reporter.outbox_dir, "*.eml"))
+	assert len(eml_files) == 1
+	with open(eml_files[0], "rb") as f:
+		assert f.read() == sent_messages[0]
+	assert sent_messages[0] is reporter.message_bytes
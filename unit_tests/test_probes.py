@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+
+
+from probes import Probe, EndpointProber
+
+
+
+def test_status_and_body_are_checked(http_server):
+	http_server.responses["/ok"] = (200, b"all good", 0)
+	http_server.responses["/created"] = (201, b"", 0)
+	probes = [Probe(f"{http_server.url}/ok", expect_body = "good"),
+		Probe(f"{http_server.url}/ok", expect_body = "bad"),
+		Probe(f"{http_server.url}/created", expect_status = 200),
+		Probe(f"{http_server.url}/missing")]
+	EndpointProber().run(probes)
+	assert [p.ok for p in probes] == [True, False, False, False]
+	assert [p.status for p in probes] == [200, 200, 201, 404]
+	assert probes[1].error == "body does not contain \"bad\""
+	assert probes[2].error == "status 201 != 200"
+
+
+def test_timeout(http_server):
+	http_server.responses["/slow"] = (200, b"late", 2)
+	probe = Probe(f"{http_server.url}/slow", timeout_s = 0.3)
+	EndpointProber().run([probe])
+	assert not probe.ok
+	assert probe.error == "timeout after 0.3s"
+
+
+def test_keep_alive_connection_is_reused(http_server):
+	http_server.responses["/a"] = (200, b"a", 0)
+	probes = [Probe(f"{http_server.url}/a") for i in range(3)]
+	EndpointProber().run(probes)
+	assert all([p.ok for p in probes])
+	assert http_server.connections == 1
+
+
+def test_connection_closed_by_server_is_reopened(http_server):
+	http_server.responses["/a"] = (200, b"a", 0)
+	http_server.close_idle = True
+	probes = [Probe(f"{http_server.url}/a") for i in range(3)]
+	EndpointProber().run(probes)
+	assert [p.error for p in probes] == ["", "", ""]
+	assert http_server.connections == 3
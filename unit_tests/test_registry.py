@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import logging
+
+import registry
+from registry import PluginRegistry
+
+
+
+def test_builtin_and_plugin_dir_types_without_entry_points(monkeypatch, tmp_path):
+	monkeypatch.setattr(registry, "HAS_ENTRY_POINTS", False)
+	(tmp_path / "my_plugin.py").write_text("SIMPLE_REPORTER_TESTS = {\"my_check\": \"MyCheckTest\"}\n\nclass MyCheckTest(object):\n\tpass\n")
+	r = PluginRegistry(logger = logging.getLogger("test"))
+	r.discover_entry_points()
+	r.discover_plugin_dir(str(tmp_path))
+	assert r.get("tests", "uptime").__name__ == "UptimeTest"
+	assert r.get("tests", "my_check").__name__ == "MyCheckTest"
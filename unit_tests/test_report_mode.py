@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import os
+
+from simple_reporter import SimpleReporter
+
+
+
+DELTA_MAIN = """
+report_mode = delta
+suppress_unchanged_report = True
+"""
+
+DATETIME_TEST = """
+[datetime-test]
+type = datetime
+"""
+
+
+def run_once(config_file):
+	sr = SimpleReporter(config_file = config_file)
+	sr.init_all()
+	sr.run_tests()
+	sent = sr.apply_report_mode()
+	if sent:
+		sr.send_reports(stream = True)
+	sr.close_logger()
+	return sent
+
+
+def test_delta_state_is_not_saved_if_only_structured_reporter_succeeded(make_config, failing_email_section, tmp_path):
+	config_file = make_config(failing_email_section + DATETIME_TEST, main = DELTA_MAIN)
+	assert run_once(config_file)
+	assert not os.path.exists(tmp_path / "state" / "report_delta.json")
+
+
+def test_unchanged_report_is_suppressed_after_it_was_sent(make_config, tmp_path):
+	config_file = make_config(f"""
+[file-reporter]
+enabled = True
+type = reporter-file
+filename = {tmp_path / 'report.txt'}
+""" + DATETIME_TEST, main = DELTA_MAIN)
+	assert run_once(config_file)
+	assert os.path.exists(tmp_path / "state" / "report_delta.json")
+	assert not run_once(config_file)
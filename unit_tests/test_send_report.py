@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import os
+import time
+import queue
+import logging
+import threading
+import configparser
+
+from simple_reporter import SimpleReporter
+from reporters import FileReporter
+
+
+
+class SlowReporter(object):
+	"""text reporter which takes longer than its timeout"""
+	
+	def __init__(self, delay_s):
+		self.name = "slow"
+		self.STRUCTURED = False
+		self.STREAMING = False
+		self.timeout_s = 0.2
+		self.delay_s = delay_s
+		self.calls = 0
+	
+	
+	def send_report(self, report, attachments = []):
+		self.calls += 1
+		time.sleep(self.delay_s)
+		return True
+
+
+def make_reporter(make_config):
+	sr = SimpleReporter(config_file = make_config())
+	sr.init_all()
+	sr.report_text = "report"
+	return sr
+
+
+def test_reporter_still_running_after_timeout_is_skipped(make_config):
+	sr = make_reporter(make_config)
+	slow = SlowReporter(delay_s = 1)
+	assert [s["status"] for s in sr.send_report(reporters = [slow])] == ["timeout"]
+	assert [s["status"] for s in sr.send_report(reporters = [slow])] == ["busy"]
+	assert slow.calls == 1
+	time.sleep(1)
+	assert [s["status"] for s in sr.send_report(reporters = [slow])] == ["timeout"]
+	assert slow.calls == 2
+	sr.close_logger()
+
+
+def test_aborted_stream_keeps_old_file_report(make_config, tmp_path):
+	sr = make_reporter(make_config)
+	report_file = tmp_path / "report.txt"
+	report_file.write_text("old report")
+	config = configparser.ConfigParser()
+	config.read_string(f"[file-reporter]\ntype = reporter-file\nenabled = True\nfilename = {report_file}\n")
+	reporter = FileReporter(config = config, logger = logging.getLogger("test"), section = "file-reporter")
+	chunks_queue = queue.Queue()
+	aborted = threading.Event()
+	summary = {"status": "timeout", "error": ""}
+	thread = threading.Thread(target = sr._run_reporter, args = (reporter, None, [], summary, chunks_queue, None, aborted))
+	thread.start()
+	chunks_queue.put("partial ")
+	aborted.set()
+	thread.join(5)
+	assert not thread.is_alive()
+	assert summary["status"] == "failed"
+	assert report_file.read_text() == "old report"
+	assert sorted(os.listdir(tmp_path)) == sorted(["report.txt", "simple_reporter.conf", "simple_reporter.log", "state"])
+	sr.close_logger()
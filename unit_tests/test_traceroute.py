@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+
+
+import logging
+import configparser
+
+import pytest
+
+import base_functions
+from tests import TracerouteTest
+
+
+
+ROUTE = " 1  10.0.0.1  0.5 ms  10.0.0.1  0.4 ms  10.0.0.1  0.4 ms\n 2  {hop2}\n 3  192.0.2.8  2 ms  192.0.2.8  2 ms  192.0.2.8  2 ms\n"
+
+
+@pytest.fixture
+def trace(tmp_path):
+	"""returns function which runs route_change traceroute test on given output of traceroute"""
+	config = configparser.ConfigParser()
+	config.read_string(f"[main]\nstate_dir = {tmp_path}\n[tr]\ntype = traceroute\nhost = 192.0.2.8\nmode = route_change\nupdate_baseline = False\n")
+	def _trace(output):
+		base_functions.set_command_runner(lambda cmdstring, timeout = None: output)
+		try:
+			t = TracerouteTest(config = config, logger = logging.getLogger("test"), name = "tr")
+			t.run()
+			return t
+		finally:
+			base_functions.set_command_runner(None)
+	return _trace
+
+
+def test_load_balanced_hop_is_unchanged(trace):
+	trace(ROUTE.format(hop2 = "198.51.100.1  1 ms  198.51.100.2  1 ms  198.51.100.1  1 ms"))
+	t = trace(ROUTE.format(hop2 = "198.51.100.2  1 ms  198.51.100.3  1 ms  198.51.100.2  1 ms"))
+	assert not t.failed
+
+
+def test_known_hop_which_stopped_replying_is_change(trace):
+	trace(ROUTE.format(hop2 = "198.51.100.1  1 ms  198.51.100.1  1 ms  198.51.100.1  1 ms"))
+	t = trace(ROUTE.format(hop2 = "* * *"))
+	assert t.failed
+	assert "became unreachable: hop 2" in t.result
+
+
+def test_hop_which_never_replied_matches_any_hop(trace):
+	trace(ROUTE.format(hop2 = "* * *"))
+	t = trace(ROUTE.format(hop2 = "198.51.100.1  1 ms  198.51.100.1  1 ms  198.51.100.1  1 ms"))
+	assert not t.failed
+
+
+def test_new_route_is_accepted_after_runs_in_a_row(trace):
+	trace(ROUTE.format(hop2 = "198.51.100.1  1 ms"))
+	for i in range(3):
+		assert trace(ROUTE.format(hop2 = "203.0.113.1  1 ms")).failed
+	assert not trace(ROUTE.format(hop2 = "203.0.113.1  1 ms")).failed